@@ -0,0 +1,142 @@
+import time
+import threading
+from collections import OrderedDict
+from database import Database
+
+ACCESS_OWNER = 'owner'
+ACCESS_SHARED = 'shared'
+
+
+class AccessControl:
+    """Cached answers to "what access does user U have to document D"
+
+    Each answer is one indexed lookup on documents (primary key) and
+    document_shares (the unique (document_id, user_id) index), kept in a
+    bounded LRU so repeat checks never reach the database. Sharing,
+    unsharing, uploading and deleting invalidate the affected entries. The
+    ttl bounds how long a change made by another process can go unseen.
+    """
+
+    def __init__(self, db=None, max_size=100000, ttl=30):
+        self.db = db or Database()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (user_id, document_id) -> (level, checked_at)
+        self._users_by_document = {}  # document_id -> user IDs with a cached entry
+        # Bumped by every invalidation, so a lookup that raced one is not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _cached(self, key, now):
+        """Return (found, level) for a cache key, counting the hit or miss"""
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[1] < self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+        self.misses += 1
+        return False, None
+
+    def _store(self, key, level, now):
+        self._entries[key] = (level, now)
+        self._entries.move_to_end(key)
+        self._users_by_document.setdefault(key[1], set()).add(key[0])
+        while len(self._entries) > self.max_size:
+            (user_id, document_id), _ = self._entries.popitem(last=False)
+            self._forget_user(document_id, user_id)
+
+    def _forget_user(self, document_id, user_id):
+        users = self._users_by_document.get(document_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._users_by_document[document_id]
+
+    def access_levels(self, user_id, document_ids):
+        """Return {document_id: ACCESS_OWNER, ACCESS_SHARED or None} for many documents
+
+        Documents not in the cache are looked up in one query. The result is
+        only cached if nothing was invalidated while the query ran, as it may
+        predate a share or unshare made meanwhile.
+        """
+        now = time.monotonic()
+        levels = {}
+        missing = []
+        with self._lock:
+            generation = self._generation
+            for document_id in document_ids:
+                found, level = self._cached((user_id, document_id), now)
+                if found:
+                    levels[document_id] = level
+                else:
+                    missing.append(document_id)
+
+        if missing:
+            fetched = self.db.get_access_levels(user_id, missing)
+            with self._lock:
+                current = self._generation == generation
+                for document_id in missing:
+                    level = fetched.get(document_id)
+                    levels[document_id] = level
+                    if current:
+                        self._store((user_id, document_id), level, now)
+
+        return levels
+
+    def access_level(self, user_id, document_id):
+        """Return ACCESS_OWNER, ACCESS_SHARED or None"""
+        return self.access_levels(user_id, [document_id])[document_id]
+
+    def can_read(self, user_id, document_id):
+        return self.access_level(user_id, document_id) is not None
+
+    def is_owner(self, user_id, document_id):
+        return self.access_level(user_id, document_id) == ACCESS_OWNER
+
+    def invalidate(self, document_id, user_id=None):
+        """Forget cached access to a document, for one user or all of them"""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                users = self._users_by_document.pop(document_id, set())
+            else:
+                users = {user_id}
+                self._forget_user(document_id, user_id)
+            for user in users:
+                self._entries.pop((user, document_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._users_by_document.clear()
+
+    def stats(self):
+        """Return cache size and hit/miss counters"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def get_access_control(db):
+    """Return the process-wide AccessControl for a database file
+
+    Every DocumentManager on the same file shares one cache, so an
+    invalidation made through one is seen by all of them.
+    """
+    with _shared_lock:
+        access = _shared.get(db.db_name)
+        if access is None:
+            access = AccessControl(db)
+            _shared[db.db_name] = access
+        return access
@@ -1,47 +1,92 @@
-import hashlib
 from database import Database
+from keypool import get_default_pool
+from passwords import PasswordHasher
+from keyvault import KeyVault, is_sealed
+import metrics
 
 
 class AuthManager:
-    def __init__(self):
+    def __init__(self, key_pool=None):
         self.db = Database()
+        # Keypairs are pre-generated in the background so registration never waits on RSA
+        self.key_pool = key_pool or get_default_pool()
+        # Salted scrypt (or PBKDF2) with the parameters calibrated for this host
+        self.hasher = PasswordHasher.from_settings(self.db)
+        # Private keys are stored sealed under the user's password and unlocked once per login
+        self.vault = KeyVault(self.hasher)
 
     def hash_password(self, password):
-        """Hash password using SHA-256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hash password with a per-user salt"""
+        return self.hasher.hash(password)
 
+    @metrics.timed('auth.register', status_result=True)
     def register_user(self, username, password, role='user'):
-        """Register a new user"""
+        """Register a new user with an RSA keypair from the key pool
+
+        The private key is stored sealed under the password.
+        """
         if self.db.get_user(username):
             return False, "Username already exists"
 
         password_hash = self.hash_password(password)
+        public_key, private_key = self.key_pool.take()
+        sealed_key = self.vault.seal(password, private_key, username)
 
-        if self.db.add_user(username, password_hash, role):
+        if self.db.add_user(username, password_hash, role, public_key.decode('utf-8'), sealed_key):
             return True, "User registered successfully"
         else:
             return False, "Registration failed"
 
+    @metrics.timed('auth.login', status_result=True)
     def login_user(self, username, password):
-        """Authenticate user"""
+        """Authenticate user and unlock their private key for the session
+
+        user_data carries a vault_handle rather than the key itself; get the
+        key for each operation with private_key(user_data). Keys still stored
+        as plaintext PEM are sealed now that the password is known.
+        """
         user = self.db.get_user(username)
         if not user:
             return False, "User not found", None
 
-        password_hash = self.hash_password(password)
+        if self.hasher.verify(password, user[2]):  # password_hash is at index 2
+            # Upgrade legacy or outdated hashes now that we know the password
+            if self.hasher.needs_rehash(user[2]):
+                self.db.update_password_hash(user[0], self.hash_password(password))
+
+            sealed_key = user[5]  # private_key
+            vault_handle = None
+            if sealed_key:
+                if not is_sealed(sealed_key):
+                    sealed_key = self.vault.seal(password, sealed_key.encode('utf-8'), username)
+                    self.db.update_user_keys(username, user[4], sealed_key)  # public_key
+
+                try:
+                    vault_handle, resealed = self.vault.unlock(password, sealed_key, username)
+                except ValueError:
+                    return False, "Could not unlock private key", None
+                if resealed:
+                    self.db.update_user_keys(username, user[4], resealed)  # public_key
 
-        if user[2] == password_hash:  # password_hash is at index 2
             user_data = {
                 'id': user[0],
                 'username': user[1],
                 'role': user[3],
                 'public_key': user[4],
-                'private_key': user[5]
+                'vault_handle': vault_handle
             }
             return True, "Login successful", user_data
         else:
             return False, "Invalid password", None
 
+    def private_key(self, user_data):
+        """Return the logged-in user's unlocked private key, or None once the vault has locked it"""
+        return self.vault.key(user_data.get('vault_handle'))
+
+    def logout(self, user_data):
+        """Zeroize the user's unlocked private key"""
+        self.vault.lock(user_data.get('vault_handle'))
+
     def is_admin(self, user_data):
         """Check if user is admin"""
         return user_data and user_data.get('role') == 'admin'
\ No newline at end of file
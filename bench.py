@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the crypto, database and end-to-end document paths
+
+    python -m bench                              # crypto, database and e2e suites
+    python -m bench --suite crypto --output base.json
+    python -m bench --compare base.json          # exit status 1 on regressions
+    python -m bench --full                       # files up to 1 GB, tables up to 10^6 rows
+
+Everything runs in a scratch directory, so the working sdms.db, uploads/
+and downloads/ are never touched. Results are JSON: one entry per
+benchmark with latency percentiles, throughput and the process's peak RSS
+at that point.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import resource
+import statistics
+from profiling import Profiler, operation
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+DEFAULT_SIZES = ['4K', '64K', '1M', '16M', '64M']
+FULL_SIZES = DEFAULT_SIZES + ['256M', '1G']
+DEFAULT_ROWS = [1000, 10000, 100000]
+FULL_ROWS = DEFAULT_ROWS + [1000000]
+# Whole-buffer AES is skipped above this size; the streaming path covers it
+IN_MEMORY_LIMIT = 64 * 1024 * 1024
+
+
+def parse_size(text):
+    """Parse sizes such as 4K, 16M or 1G into bytes"""
+    text = text.strip().upper()
+    if text[-1:] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class BenchmarkRunner:
+    """Time callables and collect results in a JSON-friendly list"""
+
+    def __init__(self, repeat=5, verbose=True):
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results = []
+
+    def measure(self, name, func, repeat=None, nbytes=None, ops=1, warmup=1, **params):
+        """Run func repeatedly and record latency percentiles and throughput
+
+        nbytes (bytes processed per call) yields MB/s; otherwise throughput
+        is ops (operations per call) per second.
+        """
+        for _ in range(warmup):
+            func()
+
+        samples = []
+        for _ in range(repeat or self.repeat):
+            started = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - started)
+
+        return self.record(name, samples, nbytes, ops, **params)
+
+    def record(self, name, samples, nbytes=None, ops=1, **params):
+        """Record latencies (in seconds) that were measured by the caller"""
+        mean = statistics.mean(samples)
+        result = {
+            'name': name + ''.join(f"[{key}={value}]" for key, value in params.items()),
+            'params': params,
+            'samples': len(samples),
+            'mean_ms': mean * 1000,
+            'min_ms': min(samples) * 1000,
+            'p50_ms': percentile(samples, 0.5) * 1000,
+            'p90_ms': percentile(samples, 0.9) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'max_ms': max(samples) * 1000,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        if nbytes is not None:
+            result['mb_per_sec'] = nbytes / (1024 * 1024) / mean if mean else 0.0
+        else:
+            result['ops_per_sec'] = ops / mean if mean else 0.0
+        self.results.append(result)
+
+        if self.verbose:
+            rate = (f"{result['mb_per_sec']:.1f} MB/s" if 'mb_per_sec' in result
+                    else f"{result['ops_per_sec']:.1f} ops/s")
+            print(f"{result['name']:<60} p50 {result['p50_ms']:10.3f} ms  "
+                  f"p99 {result['p99_ms']:10.3f} ms  {rate}", file=sys.stderr)
+        return result
+
+
+def write_random_file(path, size, chunk_size=4 * 1024 * 1024):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            chunk = os.urandom(min(chunk_size, remaining))
+            f.write(chunk)
+            remaining -= len(chunk)
+
+
+def drain(chunks):
+    """Consume an iterator of chunks without keeping them"""
+    for _ in chunks:
+        pass
+
+
+def bench_crypto(runner, sizes, workdir):
+    """RSA keygen, key wrap/unwrap, AES and hashing across file sizes"""
+    from crypto import CryptoManager
+
+    crypto = CryptoManager()
+    runner.measure('crypto.rsa_keygen', crypto.generate_rsa_keypair,
+                   repeat=max(3, runner.repeat // 2), warmup=0, key_size=crypto.key_size)
+
+    public_key, private_key = crypto.generate_rsa_keypair()
+    aes_key = crypto.generate_aes_key()
+    wrapped = crypto.encrypt_with_rsa(public_key, aes_key)
+    runner.measure('crypto.rsa_wrap', lambda: crypto.encrypt_with_rsa(public_key, aes_key),
+                   repeat=runner.repeat * 20)
+    runner.measure('crypto.rsa_unwrap', lambda: crypto.decrypt_with_rsa(private_key, wrapped),
+                   repeat=runner.repeat * 20)
+
+    for label in sizes:
+        size = parse_size(label)
+        path = os.path.join(workdir, f"plain_{label}")
+        write_random_file(path, size)
+        # Larger inputs get fewer repetitions so a full run stays practical
+        repeat = runner.repeat if size <= 16 * 1024 * 1024 else max(2, runner.repeat // 2)
+
+        if size <= IN_MEMORY_LIMIT:
+            with open(path, 'rb') as f:
+                data = f.read()
+            encrypted = crypto.encrypt_with_aes(data, aes_key)
+            runner.measure('crypto.aes_encrypt', lambda: crypto.encrypt_with_aes(data, aes_key),
+                           repeat=repeat, nbytes=size, size=label)
+            runner.measure('crypto.aes_decrypt', lambda: crypto.decrypt_with_aes(encrypted, aes_key),
+                           repeat=repeat, nbytes=size, size=label)
+            del data, encrypted
+
+        encrypted_path = os.path.join(workdir, f"cipher_{label}")
+
+        def encrypt_file():
+            with open(encrypted_path, 'wb') as out:
+                for piece in crypto.encrypt_stream_segmented(crypto.read_file_chunks(path), aes_key):
+                    out.write(piece)
+
+        def decrypt_file():
+            with open(encrypted_path, 'rb') as f:
+                drain(crypto.decrypt_stream(iter(lambda: f.read(crypto.chunk_size), b""), aes_key))
+
+        runner.measure('crypto.stream_encrypt', encrypt_file, repeat=repeat, nbytes=size, size=label)
+        runner.measure('crypto.stream_decrypt', decrypt_file, repeat=repeat, nbytes=size, size=label)
+        runner.measure('crypto.sha256_file', lambda: crypto.calculate_file_hash(path),
+                       repeat=repeat, nbytes=size, size=label)
+        runner.measure('crypto.content_hash_and_key',
+                       lambda: crypto.calculate_content_hash_and_key(path),
+                       repeat=repeat, nbytes=size, size=label)
+
+        os.remove(path)
+        os.remove(encrypted_path)
+
+
+def populate(db, rows, users=100, share_ratio=0.1, batch_size=5000):
+    """Fill a database with users, documents and shares; returns the user IDs"""
+    for number in range(users):
+        db.add_user(f"bench_user_{number}", "x")
+    user_ids = [db.get_user(f"bench_user_{number}")[0] for number in range(users)]
+    rng = random.Random(rows)
+
+    for start in range(0, rows, batch_size):
+        count = min(batch_size, rows - start)
+        batch = []
+        for number in range(start, start + count):
+            file_hash = hashlib.sha256(b"%d" % number).hexdigest()
+            batch.append((f"document_{number}.txt", f"{file_hash[:2]}/{file_hash[2:4]}/{file_hash}",
+                          file_hash, "key", rng.choice(user_ids), 'none'))
+        with db.connection():
+            document_ids = db.add_documents(batch)
+            db.index_documents((document_id, row[0], '') for document_id, row in zip(document_ids, batch))
+
+    shares = [(document_id, rng.choice(user_ids), "key")
+              for document_id in rng.sample(range(1, rows + 1), int(rows * share_ratio))]
+    db.share_documents(shares)
+    return user_ids
+
+
+def bench_database(runner, row_counts, workdir):
+    """Point lookups, keyset pages, access checks, search and inserts at each table size"""
+    from database import Database
+
+    for rows in row_counts:
+        db = Database(os.path.join(workdir, f"bench_{rows}.db"))
+        started = time.perf_counter()
+        user_ids = populate(db, rows)
+        if runner.verbose:
+            print(f"populated {rows} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        rng = random.Random(0)
+        user_id = user_ids[0]
+        repeat = runner.repeat * 20
+
+        runner.measure('db.get_document', lambda: db.get_document(rng.randint(1, rows)),
+                       repeat=repeat, rows=rows)
+        runner.measure('db.get_documents_100',
+                       lambda: db.get_documents(rng.sample(range(1, rows + 1), 100)),
+                       repeat=repeat, ops=100, rows=rows)
+        runner.measure('db.get_access_levels_100',
+                       lambda: db.get_access_levels(user_id, rng.sample(range(1, rows + 1), 100)),
+                       repeat=repeat, ops=100, rows=rows)
+        runner.measure('db.page_user_documents', lambda: db.page_user_documents(user_id, 50),
+                       repeat=repeat, rows=rows)
+
+        # A deep page: the cursor of a row near the end of the user's list
+        _, after = db.page_user_documents(user_id, max(1, rows // len(user_ids) - 50))
+        runner.measure('db.page_user_documents_deep',
+                       lambda: db.page_user_documents(user_id, 50, after),
+                       repeat=repeat, rows=rows)
+        runner.measure('db.page_shared_documents', lambda: db.page_shared_documents(user_id, 50),
+                       repeat=repeat, rows=rows)
+        runner.measure('db.page_all_documents', lambda: db.page_all_documents(50),
+                       repeat=repeat, rows=rows)
+        runner.measure('db.search_documents',
+                       lambda: db.search_documents(user_id, '"document_1"*', 20),
+                       repeat=repeat, rows=rows)
+
+        batch = [(f"new_{number}.txt", "path", "hash", "key", user_id, 'none') for number in range(500)]
+        runner.measure('db.add_documents_500', lambda: db.add_documents(batch),
+                       repeat=runner.repeat, ops=500, rows=rows)
+
+        db.pool.close_all()
+
+
+def bench_end_to_end(runner, sizes, workdir):
+    """upload_document and download_document through the configured storage backend"""
+    from auth import AuthManager
+    from document_manager import DocumentManager
+    from keypool import KeyPairPool
+
+    # An unstarted pool generates the one keypair inline, so no background
+    # key generation competes with the timed uploads and downloads
+    auth = AuthManager(key_pool=KeyPairPool(size=0))
+    auth.register_user('bench_owner', 'bench password')
+    _, _, user = auth.login_user('bench_owner', 'bench password')
+    manager = DocumentManager()
+    private_key = auth.private_key(user)
+
+    for label in sizes:
+        size = parse_size(label)
+        repeat = runner.repeat if size <= 16 * 1024 * 1024 else max(2, runner.repeat // 2)
+        path = os.path.join(workdir, f"upload_{label}")
+
+        samples = []
+        document_ids = []
+        for attempt in range(repeat + 1):
+            # Fresh content each time, so deduplication does not skip the work
+            write_random_file(path, size)
+            started = time.perf_counter()
+            success, message = manager.upload_document(path, user['id'], user['public_key'])
+            elapsed = time.perf_counter() - started
+            if not success:
+                raise RuntimeError(message)
+            document_ids.append(int(message.rsplit('ID: ', 1)[1].rstrip(')')))
+            if attempt:  # The first upload is a warmup
+                samples.append(elapsed)
+        runner.record('e2e.upload_document', samples, nbytes=size, size=label)
+
+        document_id = document_ids[-1]
+
+        def download():
+            success, message = manager.download_document(document_id, user['id'], private_key)
+            if not success:
+                raise RuntimeError(message)
+
+        runner.measure('e2e.download_document', download, repeat=repeat, nbytes=size, size=label)
+        for document_id in document_ids:
+            manager.delete_document(document_id, user['id'])
+        os.remove(path)
+
+
+def compare(current, baseline, threshold, min_delta_ms=0.0):
+    """Compare p50 latencies with a baseline run
+
+    A benchmark regressed if its p50 grew by more than threshold (a
+    fraction) and by more than min_delta_ms, so sub-millisecond jitter on
+    tiny operations is not reported. Returns a list of (name, baseline ms,
+    current ms, ratio, regressed) for benchmarks present in both runs.
+    """
+    previous = {result['name']: result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        before = previous.get(result['name'])
+        if before is None or not before['p50_ms']:
+            continue
+        ratio = result['p50_ms'] / before['p50_ms']
+        regressed = ratio > 1 + threshold and result['p50_ms'] - before['p50_ms'] > min_delta_ms
+        rows.append((result['name'], before['p50_ms'], result['p50_ms'], ratio, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SDMS crypto, database and document paths")
+    parser.add_argument('--suite', default='crypto,database,e2e',
+                        help="comma separated suites to run (default: all)")
+    parser.add_argument('--sizes', help="comma separated file sizes, e.g. 4K,1M,1G")
+    parser.add_argument('--rows', help="comma separated table sizes, e.g. 1000,1000000")
+    parser.add_argument('--full', action='store_true',
+                        help="use the full ranges: files up to 1G and tables up to 10^6 rows")
+    parser.add_argument('--repeat', type=int, default=5, help="samples per benchmark (default 5)")
+    parser.add_argument('--output', help="write the JSON results to this file (default: stdout)")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare with a saved results file")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="p50 slowdown counted as a regression (default 0.10 = 10%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help="ignore slowdowns smaller than this many ms (default 0.05)")
+    parser.add_argument('--quiet', action='store_true', help="do not print progress")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="profile each suite with cProfile and tracemalloc into DIR "
+                             "(timings are inflated while profiling)")
+    args = parser.parse_args()
+
+    suites = [suite.strip() for suite in args.suite.split(',') if suite.strip()]
+    sizes = args.sizes.split(',') if args.sizes else (FULL_SIZES if args.full else DEFAULT_SIZES)
+    row_counts = ([int(rows) for rows in args.rows.split(',')] if args.rows
+                  else (FULL_ROWS if args.full else DEFAULT_ROWS))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+    profiler = Profiler(args.profile) if args.profile else Profiler.from_env()
+
+    runner = BenchmarkRunner(repeat=args.repeat, verbose=not args.quiet)
+    workdir = tempfile.mkdtemp(prefix="sdms_bench_")
+    cwd = os.getcwd()
+    started = time.time()
+    try:
+        # The managers use relative paths (sdms.db, uploads/, downloads/)
+        os.chdir(workdir)
+        if 'crypto' in suites:
+            with operation(profiler, 'crypto'):
+                bench_crypto(runner, sizes, workdir)
+        if 'database' in suites:
+            with operation(profiler, 'database'):
+                bench_database(runner, row_counts, workdir)
+        if 'e2e' in suites:
+            with operation(profiler, 'e2e'):
+                bench_end_to_end(runner, sizes, workdir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+            'seconds': time.time() - started,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'suites': suites,
+            'repeat': args.repeat,
+        },
+        'peak_rss_mb': peak_rss_mb(),
+        'results': runner.results,
+    }
+
+    regressions = []
+    if baseline is not None:
+        rows = compare(report, baseline, args.threshold, args.min_delta_ms)
+        report['comparison'] = [
+            {'name': name, 'baseline_p50_ms': before, 'p50_ms': after, 'ratio': ratio,
+             'regressed': regressed}
+            for name, before, after, ratio, regressed in rows
+        ]
+        regressions = [row for row in rows if row[4]]
+        for name, before, after, ratio, regressed in rows:
+            flag = "REGRESSED" if regressed else ("faster" if ratio < 1 - args.threshold else "")
+            print(f"{name:<60} {before:10.3f} -> {after:10.3f} ms  x{ratio:5.2f} {flag}",
+                  file=sys.stderr)
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} out of {len(rows)} compared",
+              file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Content-defined chunking for document versions
+
+A file is cut where its content, not its offset, says so, so an edit only
+changes the chunks around it and the rest of a new version matches the
+chunks already stored for the previous one, however far the edit shifted
+them.
+
+Each byte is mixed with the one before it and projected to one bit
+through a fixed table; a chunk ends after the first place the resulting
+bit string matches a fixed pattern. The scan runs in C (int XOR,
+bytes.translate and bytes.find) rather than a per-byte Python rolling
+hash. As in FastCDC, a stricter pattern is used up to the average size
+and a looser one after it, which keeps chunk sizes close to the average,
+and the first MIN_CHUNK_SIZE bytes of a chunk are never searched.
+
+The table, patterns and sizes are part of the storage format: changing
+any of them moves every boundary, and new versions then stop sharing
+chunks with the ones already stored.
+"""
+
+import hashlib
+
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+# Read size when chunking a file
+BLOCK_SIZE = 1024 * 1024
+
+_TABLE_BITS = hashlib.shake_256(b"sdms-cdc-table").digest(32)
+# Byte -> b'0' or b'1'
+TABLE = bytes(ord('0') + ((_TABLE_BITS[i // 8] >> (i % 8)) & 1) for i in range(256))
+# About one match per 2**17 positions before the average size, 2**14 after
+STRICT_PATTERN = b"01101000110111001"
+LOOSE_PATTERN = b"01000110111001"
+
+
+def project(block, previous):
+    """Map each byte of block, mixed with the byte before it, to b'0' or b'1'"""
+    mixed = int.from_bytes(block, 'big') ^ int.from_bytes(previous + block[:-1], 'big')
+    return mixed.to_bytes(len(block), 'big').translate(TABLE)
+
+
+def find_boundary(marks, start, end, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE,
+                  max_size=MAX_CHUNK_SIZE):
+    """Return where the chunk starting at start ends, given the marks up to end"""
+    if end - start <= min_size:
+        return end
+    middle = min(start + avg_size, end)
+    match = marks.find(STRICT_PATTERN, start + min_size - len(STRICT_PATTERN), middle)
+    if match != -1:
+        return match + len(STRICT_PATTERN)
+    limit = min(start + max_size, end)
+    match = marks.find(LOOSE_PATTERN, middle - len(LOOSE_PATTERN), limit)
+    if match != -1:
+        return match + len(LOOSE_PATTERN)
+    return limit
+
+
+def chunk_stream(blocks, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """Split an iterable of byte blocks into content-defined chunks
+
+    The chunks do not depend on how the input is split into blocks. Holds
+    at most one block plus max_size bytes in memory.
+    """
+    buffer = bytearray()
+    marks = bytearray()
+    previous = b"\x00"
+
+    for block in blocks:
+        if not block:
+            continue
+        buffer += block
+        marks += project(block, previous)
+        previous = block[-1:]
+
+        # A boundary is only final once max_size bytes follow the chunk start
+        start = 0
+        while len(buffer) - start >= max_size:
+            end = find_boundary(marks, start, len(buffer), min_size, avg_size, max_size)
+            yield bytes(buffer[start:end])
+            start = end
+        del buffer[:start]
+        del marks[:start]
+
+    start = 0
+    while start < len(buffer):
+        end = find_boundary(marks, start, len(buffer), min_size, avg_size, max_size)
+        yield bytes(buffer[start:end])
+        start = end
+
+
+def read_blocks(file_path, block_size=BLOCK_SIZE):
+    """Yield a file in block_size pieces"""
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            yield block
@@ -1,17 +1,23 @@
 import os
+import time
 from auth import AuthManager
 from document_manager import DocumentManager
 from crypto import CryptoManager
 from database import Database
+import metrics
+from profiling import operation
+from scrub import Scrubber, print_report
 
 
 class CLI:
-    def __init__(self):
+    def __init__(self, profiler=None):
         self.auth = AuthManager()
         self.doc_manager = DocumentManager()
         self.crypto = CryptoManager()
         self.db = Database()
         self.current_user = None
+        self.page_size = 20  # Rows per page on listing screens
+        self.profiler = profiler  # profiling.Profiler; each menu action becomes one operation
 
     def clear_screen(self):
         """Clear terminal screen"""
@@ -23,6 +29,25 @@ class CLI:
         print(f" {title}")
         print("=" * 50)
 
+    def print_paged(self, fetch_page, format_row):
+        """Print rows a page at a time, fetching the next page on request
+
+        fetch_page(page_size, after) must return (rows, next_cursor).
+        Returns the number of rows shown.
+        """
+        shown = 0
+        after = None
+        while True:
+            rows, after = fetch_page(self.page_size, after)
+            for row in rows:
+                print(format_row(row))
+            shown += len(rows)
+
+            if after is None:
+                return shown
+            if input(f"-- {shown} shown. 'n' for next page, Enter to stop: ").strip().lower() != 'n':
+                return shown
+
     def register(self):
         """User registration"""
         self.print_header("USER REGISTRATION")
@@ -39,34 +64,7 @@ class CLI:
         print(f"\n{message}")
 
         if success:
-            # Generate RSA keys for new user
-            public_key, private_key = self.crypto.generate_rsa_keypair()
-            self.db.update_user_keys(username, public_key.decode('utf-8'), private_key.decode('utf-8'))
-            print("RSA key pair generated successfully!")
-
-    def login(self):
-        """User login"""
-        self.print_header("USER LOGIN")
-
-        username = input("Username: ")
-        password = input("Password: ") 
-
-        success, message, user_data = self.auth.login_user(username, password)
-
-        if success:
-            self.current_user = user_data
-            print(f"\n{message}")
-            print(f"Welcome, {username}!")
-            if self.auth.is_admin(user_data):
-                print("You have admin privileges.")
-        else:
-            print(f"\n{message}")
-
-        if success:
-            # Generate RSA keys for new user
-            public_key, private_key = self.crypto.generate_rsa_keypair()
-            self.db.update_user_keys(username, public_key.decode('utf-8'), private_key.decode('utf-8'))
-            print("RSA key pair generated successfully!")
+            print("RSA key pair assigned successfully!")
 
     def login(self):
         """User login"""
@@ -108,6 +106,78 @@ class CLI:
 
         print(f"\n{message}")
 
+    def batch_upload(self):
+        """Upload every file in a directory or listed in a manifest"""
+        if not self.current_user:
+            print("Please login first!")
+            return
+
+        self.print_header("BATCH UPLOAD")
+
+        source = input("Enter directory or manifest file path: ")
+
+        if not os.path.exists(source):
+            print("Error: Path not found!")
+            return
+
+        file_paths = self.doc_manager.collect_upload_paths(source)
+        if not file_paths:
+            print("No files to upload.")
+            return
+
+        print(f"Uploading {len(file_paths)} files...")
+        report = self.doc_manager.batch_upload(
+            file_paths,
+            self.current_user['id'],
+            self.current_user['public_key'].encode('utf-8')
+        )
+
+        for path, success, message in report['results']:
+            print(f"{'OK  ' if success else 'FAIL'} {path}: {message}")
+
+        print(f"\n{report['succeeded']} uploaded, {report['failed']} failed, "
+              f"{report['bytes'] / (1024 * 1024):.1f} MB in {report['seconds']:.2f}s "
+              f"({report['mb_per_sec']:.1f} MB/s)")
+
+    def upload_version(self):
+        """Upload a new version of one of the user's documents"""
+        if not self.current_user:
+            print("Please login first!")
+            return
+
+        self.print_header("UPLOAD NEW VERSION")
+
+        private_key = self.unlocked_key()
+        if private_key is None:
+            return
+
+        user_id = self.current_user['id']
+
+        print("\nYour Documents:")
+        owned = self.print_paged(
+            lambda size, after: self.doc_manager.page_user_documents(user_id, size, after),
+            lambda doc: f"ID: {doc.id}, Filename: {doc.filename}, Uploaded: {doc.timestamp}"
+        )
+
+        if not owned:
+            print("You have no documents to version.")
+            return
+
+        try:
+            doc_id = int(input("\nEnter Document ID: "))
+        except ValueError:
+            print("Error: Please enter a valid Document ID!")
+            return
+
+        file_path = input("Enter path of the new version: ")
+
+        if not os.path.exists(file_path):
+            print("Error: File not found!")
+            return
+
+        success, message = self.doc_manager.upload_version(doc_id, file_path, user_id, private_key)
+        print(f"\n{message}")
+
     def download_document(self):
         """Download a document"""
         if not self.current_user:
@@ -116,32 +186,129 @@ class CLI:
 
         self.print_header("DOWNLOAD DOCUMENT")
 
-        # List user's documents
-        documents = self.doc_manager.list_user_documents(self.current_user['id'])
-        shared_docs = self.doc_manager.list_shared_documents(self.current_user['id'])
-
-        if not documents and not shared_docs:
-            print("No documents available for download.")
+        private_key = self.unlocked_key()
+        if private_key is None:
             return
 
+        # List user's documents
+        user_id = self.current_user['id']
+
         print("\nYour Documents:")
-        for doc in documents:
-            print(f"ID: {doc[0]}, Filename: {doc[1]}, Uploaded: {doc[6]}")
+        owned = self.print_paged(
+            lambda size, after: self.doc_manager.page_user_documents(user_id, size, after),
+            lambda doc: f"ID: {doc.id}, Filename: {doc.filename}, Uploaded: {doc.timestamp}"
+        )
 
         print("\nShared Documents:")
-        for doc in shared_docs:
-            print(f"ID: {doc[0]}, Filename: {doc[1]}, Owner: {doc[7]}, Shared: {doc[6]}")
+        shared = self.print_paged(
+            lambda size, after: self.doc_manager.page_shared_documents(user_id, size, after),
+            lambda doc: f"ID: {doc.id}, Filename: {doc.filename}, Owner: {doc.owner_name}, Shared: {doc.timestamp}"
+        )
+
+        if not owned and not shared:
+            print("No documents available for download.")
+            return
 
         try:
             doc_id = int(input("\nEnter Document ID to download: "))
             success, message = self.doc_manager.download_document(
                 doc_id,
-                self.current_user['private_key'].encode('utf-8')
+                self.current_user['id'],
+                private_key
             )
             print(f"\n{message}")
         except ValueError:
             print("Error: Please enter a valid Document ID!")
 
+    def version_history(self):
+        """List a document's versions and optionally download one"""
+        if not self.current_user:
+            print("Please login first!")
+            return
+
+        self.print_header("VERSION HISTORY")
+
+        try:
+            doc_id = int(input("Enter Document ID: "))
+        except ValueError:
+            print("Error: Please enter a valid Document ID!")
+            return
+
+        success, versions = self.doc_manager.list_versions(doc_id, self.current_user['id'])
+        if not success:
+            print(f"\n{versions}")
+            return
+
+        print()
+        for version in versions:
+            size = f"{version.size / 1024:.1f} KB" if version.size is not None else "?"
+            stored = f"{version.stored_bytes / 1024:.1f} KB" if version.stored_bytes is not None else "?"
+            chunks = version.chunk_count or "whole file"
+            print(f"v{version.version}  {version.created_at}  {size:>12}  SHA-256 {version.file_hash[:12]}  "
+                  f"chunks: {chunks}, stored: {stored}")
+
+        choice = input("\nEnter a version to download (blank to go back): ").strip()
+        if not choice:
+            return
+        if not choice.isdigit():
+            print("Error: Please enter a valid version number!")
+            return
+
+        private_key = self.unlocked_key()
+        if private_key is None:
+            return
+
+        success, message = self.doc_manager.download_version(doc_id, int(choice), self.current_user['id'],
+                                                             private_key)
+        print(f"\n{message}")
+
+    def bulk_download(self):
+        """Export many documents at once"""
+        if not self.current_user:
+            print("Please login first!")
+            return
+
+        self.print_header("BULK DOWNLOAD")
+
+        private_key = self.unlocked_key()
+        if private_key is None:
+            return
+
+        selection = input("Enter Document IDs (comma separated), 'mine' or 'shared': ").strip().lower()
+        user_id = self.current_user['id']
+
+        try:
+            if selection == 'mine':
+                document_ids = list(self.doc_manager.export_document_ids(user_id, 'owned'))
+            elif selection == 'shared':
+                document_ids = list(self.doc_manager.export_document_ids(user_id, 'shared'))
+            else:
+                document_ids = [int(part) for part in selection.split(',') if part.strip()]
+        except ValueError:
+            print("Error: Please enter valid Document IDs!")
+            return
+
+        if not document_ids:
+            print("No documents selected.")
+            return
+
+        archive_path = input("Archive path (.tar), or Enter to write files to downloads/: ").strip()
+
+        report = self.doc_manager.batch_download(
+            document_ids,
+            user_id,
+            private_key,
+            archive_path=archive_path or None
+        )
+
+        for document_id, success, message in report['results']:
+            print(f"{'OK  ' if success else 'FAIL'} {document_id}: {message}")
+
+        print(f"\n{report['succeeded']} exported, {report['failed']} failed "
+              f"({report['integrity_failures']} integrity failures), "
+              f"{report['bytes'] / (1024 * 1024):.1f} MB in {report['seconds']:.2f}s "
+              f"({report['mb_per_sec']:.1f} MB/s)")
+
     def share_document(self):
         """Share a document with another user"""
         if not self.current_user:
@@ -150,27 +317,125 @@ class CLI:
 
         self.print_header("SHARE DOCUMENT")
 
-        documents = self.doc_manager.list_user_documents(self.current_user['id'])
-
-        if not documents:
-            print("You have no documents to share.")
+        private_key = self.unlocked_key()
+        if private_key is None:
             return
 
+        user_id = self.current_user['id']
+
         print("\nYour Documents:")
-        for doc in documents:
-            print(f"ID: {doc[0]}, Filename: {doc[1]}")
+        owned = self.print_paged(
+            lambda size, after: self.doc_manager.page_user_documents(user_id, size, after),
+            lambda doc: f"ID: {doc.id}, Filename: {doc.filename}"
+        )
+
+        if not owned:
+            print("You have no documents to share.")
+            return
 
         try:
             doc_id = int(input("\nEnter Document ID to share: "))
             target_user = input("Enter username to share with: ")
 
             success, message = self.doc_manager.share_document_with_user(
+                doc_id, self.current_user['id'], target_user,
+                private_key
+            )
+            print(f"\n{message}")
+        except ValueError:
+            print("Error: Please enter a valid Document ID!")
+
+    def bulk_share(self):
+        """Share many documents with many users at once"""
+        if not self.current_user:
+            print("Please login first!")
+            return
+
+        self.print_header("BULK SHARE")
+
+        private_key = self.unlocked_key()
+        if private_key is None:
+            return
+
+        selection = input("Enter Document IDs (comma separated) or 'mine': ").strip().lower()
+        user_id = self.current_user['id']
+
+        try:
+            if selection == 'mine':
+                document_ids = list(self.doc_manager.export_document_ids(user_id, 'owned'))
+            else:
+                document_ids = [int(part) for part in selection.split(',') if part.strip()]
+        except ValueError:
+            print("Error: Please enter valid Document IDs!")
+            return
+
+        usernames = [name.strip() for name in input("Usernames (comma separated): ").split(',')
+                     if name.strip()]
+        if not document_ids or not usernames:
+            print("Nothing to share.")
+            return
+
+        report = self.doc_manager.share_documents_with_users(
+            document_ids, user_id, usernames, private_key
+        )
+
+        for document_id, username, success, message in report['results']:
+            if not success:
+                print(f"FAIL {document_id} -> {username}: {message}")
+        print(f"\n{report['shared']} shares made, {report['failed']} failed")
+
+    def unshare_document(self):
+        """Revoke another user's access to a document"""
+        if not self.current_user:
+            print("Please login first!")
+            return
+
+        self.print_header("UNSHARE DOCUMENT")
+
+        try:
+            doc_id = int(input("\nEnter Document ID to unshare: "))
+            target_user = input("Enter username to stop sharing with: ")
+
+            success, message = self.doc_manager.unshare_document_with_user(
                 doc_id, self.current_user['id'], target_user
             )
             print(f"\n{message}")
         except ValueError:
             print("Error: Please enter a valid Document ID!")
 
+    def delete_document(self):
+        """Delete one of the user's documents"""
+        if not self.current_user:
+            print("Please login first!")
+            return
+
+        self.print_header("DELETE DOCUMENT")
+
+        user_id = self.current_user['id']
+
+        print("\nYour Documents:")
+        owned = self.print_paged(
+            lambda size, after: self.doc_manager.page_user_documents(user_id, size, after),
+            lambda doc: f"ID: {doc.id}, Filename: {doc.filename}"
+        )
+
+        if not owned:
+            print("You have no documents to delete.")
+            return
+
+        try:
+            doc_id = int(input("\nEnter Document ID to delete: "))
+        except ValueError:
+            print("Error: Please enter a valid Document ID!")
+            return
+
+        if input("Are you sure? (y/n): ").strip().lower() != 'y':
+            print("Cancelled.")
+            return
+
+        success, message = self.doc_manager.delete_document(doc_id, user_id)
+        print(f"\n{message}")
+
     def list_documents(self):
         """List user's documents"""
         if not self.current_user:
@@ -179,23 +444,51 @@ class CLI:
 
         self.print_header("MY DOCUMENTS")
 
-        documents = self.doc_manager.list_user_documents(self.current_user['id'])
-        shared_docs = self.doc_manager.list_shared_documents(self.current_user['id'])
+        user_id = self.current_user['id']
 
         print("\nDocuments You Own:")
-        if documents:
-            for doc in documents:
-                print(f"ID: {doc[0]}, Filename: {doc[1]}, Hash: {doc[3][:16]}..., Uploaded: {doc[6]}")
-        else:
+        if not self.print_paged(
+            lambda size, after: self.doc_manager.page_user_documents(user_id, size, after),
+            lambda doc: f"ID: {doc.id}, Filename: {doc.filename}, Hash: {doc.file_hash[:16]}..., Uploaded: {doc.timestamp}"
+        ):
             print("No documents found.")
 
         print("\nDocuments Shared With You:")
-        if shared_docs:
-            for doc in shared_docs:
-                print(f"ID: {doc[0]}, Filename: {doc[1]}, Owner: {doc[7]}, Shared: {doc[6]}")
-        else:
+        if not self.print_paged(
+            lambda size, after: self.doc_manager.page_shared_documents(user_id, size, after),
+            lambda doc: f"ID: {doc.id}, Filename: {doc.filename}, Owner: {doc.owner_name}, Shared: {doc.timestamp}"
+        ):
             print("No shared documents.")
 
+    def search_documents(self):
+        """Search names and contents of documents the user can see"""
+        if not self.current_user:
+            print("Please login first!")
+            return
+
+        self.print_header("SEARCH DOCUMENTS")
+
+        query = input("Search for: ").strip()
+        if not query:
+            return
+
+        user_id = self.current_user['id']
+        started = time.perf_counter()
+        rows, after = self.doc_manager.search_documents(user_id, query, self.page_size)
+        print(f"\n({(time.perf_counter() - started) * 1000:.1f} ms)")
+
+        def fetch_page(size, cursor):
+            # The first page is already loaded
+            return (rows, after) if cursor is None else \
+                self.doc_manager.search_documents(user_id, query, size, cursor)
+
+        if not self.print_paged(
+            fetch_page,
+            lambda doc: f"ID: {doc.id}, Filename: {doc.filename}, "
+                        f"Owner: {doc.owner_name or 'you'}, Uploaded: {doc.uploaded_at}"
+        ):
+            print("No matching documents.")
+
     def admin_panel(self):
         """Admin functionality"""
         if not self.current_user or not self.auth.is_admin(self.current_user):
@@ -206,7 +499,10 @@ class CLI:
 
         print("1. List All Users")
         print("2. List All Documents")
-        print("3. Back to Main Menu")
+        print("3. Query Diagnostics")
+        print("4. Operation Stats")
+        print("5. Integrity Report")
+        print("6. Back to Main Menu")
 
         choice = input("\nEnter your choice: ")
 
@@ -214,15 +510,20 @@ class CLI:
             self.list_all_users()
         elif choice == '2':
             self.list_all_documents()
+        elif choice == '3':
+            self.query_diagnostics()
+        elif choice == '4':
+            self.operation_stats()
+        elif choice == '5':
+            self.integrity_report()
 
     def list_all_users(self):
         """List all users (admin only)"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('SELECT id, username, role, created_at FROM users')
-        users = cursor.fetchall()
-        conn.close()
+            cursor.execute('SELECT id, username, role, created_at FROM users')
+            users = cursor.fetchall()
 
         print("\nAll Users:")
         for user in users:
@@ -230,30 +531,147 @@ class CLI:
 
     def list_all_documents(self):
         """List all documents (admin only)"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT d.id, d.filename, u.username, d.uploaded_at 
-            FROM documents d 
-            JOIN users u ON d.owner_id = u.id
-            ORDER BY d.uploaded_at DESC
-        ''')
-        documents = cursor.fetchall()
-        conn.close()
-
         print("\nAll Documents:")
-        for doc in documents:
-            print(f"ID: {doc[0]}, Filename: {doc[1]}, Owner: {doc[2]}, Uploaded: {doc[3]}")
+        self.print_paged(
+            self.db.page_all_documents,
+            lambda doc: f"ID: {doc.id}, Filename: {doc.filename}, Owner: {doc.owner_name}, Uploaded: {doc.timestamp}"
+        )
+
+    def query_diagnostics(self):
+        """Show query plans for the hot listing queries (admin only)"""
+        print(f"\nSchema version: {self.db.schema_version()}")
+
+        stats = self.crypto.key_cache.stats()
+        print(f"RSA key cache: {stats['size']}/{stats['max_size']} keys, "
+              f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+
+        stats = self.doc_manager.access.stats()
+        print(f"Access cache: {stats['size']}/{stats['max_size']} entries, "
+              f"{stats['hits']} hits, {stats['misses']} misses")
+
+        stats = self.auth.key_pool.stats()
+        print(f"Keypair pool: {stats['ready']}/{stats['size']} ready ({stats['key_size']}-bit), "
+              f"{stats['served_from_pool']} served from pool, {stats['generated_inline']} generated inline")
+
+        stats = self.auth.vault.stats()
+        print(f"Key vault: {stats['unlocked']}/{stats['max_entries']} keys unlocked, "
+              f"{stats['unlocks']} unlocks, {stats['evictions']} evictions "
+              f"(idle timeout {stats['idle_timeout']}s)")
+
+        params = self.auth.hasher.params
+        if params['algorithm'] == 'scrypt':
+            print(f"Password hashing: scrypt n={params['n']} r={params['r']} p={params['p']}")
+        else:
+            print(f"Password hashing: {params['algorithm']} iterations={params['iterations']}")
+
+        for name, details in self.db.explain_query_plans().items():
+            uses_index = any('USING' in d and 'INDEX' in d for d in details)
+            full_scan = any(d.startswith('SCAN') and 'INDEX' not in d for d in details)
+            temp_sort = any('TEMP B-TREE' in d for d in details)
+            status = "OK" if uses_index and not full_scan and not temp_sort else "CHECK"
+
+            print(f"\n{name}: {status}")
+            for detail in details:
+                print(f"  {detail}")
+
+    def operation_stats(self):
+        """Show per-operation timings, slowest self time first (admin only)"""
+        print(f"\nInstrumentation: {'on' if metrics.is_enabled() else 'off'}")
+
+        stats = metrics.snapshot()
+        if stats:
+            print(f"\n{'Operation':<28} {'Count':>7} {'Errors':>6} {'Total s':>9} {'Self s':>9} "
+                  f"{'p50 ms':>8} {'p99 ms':>8} {'MB':>9}")
+            for name, stat in sorted(stats.items(), key=lambda item: -item[1]['self_seconds']):
+                print(f"{name:<28} {stat['count']:>7} {stat['errors']:>6} {stat['total_seconds']:>9.3f} "
+                      f"{stat['self_seconds']:>9.3f} {stat['p50_ms']:>8.2f} {stat['p99_ms']:>8.2f} "
+                      f"{stat['bytes'] / (1024 * 1024):>9.1f}")
+        else:
+            print("No operations recorded yet.")
+
+        print("\n1. " + ("Disable" if metrics.is_enabled() else "Enable") + " Instrumentation")
+        print("2. Reset")
+        print("3. Export (.prom or .json)")
+        print("4. Back")
+
+        choice = input("\nEnter your choice: ")
+
+        if choice == '1':
+            if metrics.is_enabled():
+                metrics.disable()
+            else:
+                metrics.enable()
+        elif choice == '2':
+            metrics.reset()
+            print("Stats reset.")
+        elif choice == '3':
+            path = input("Export path: ").strip()
+            if path:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(metrics.to_json() if path.endswith('.json') else metrics.to_prometheus())
+                print(f"Stats written to {path}")
+
+    def integrity_report(self):
+        """Show corrupt or missing payloads found by the scrubber (admin only)"""
+        scrubber = Scrubber(self.doc_manager)
+        print()
+        print_report(scrubber.report())
+
+        if input("\nScrub the next 100 payloads now? (y/N): ").strip().lower() == 'y':
+            checkpoint = scrubber.run_pass(max_payloads=100)
+            print(f"Checked {checkpoint['checked']} payloads in pass {checkpoint['pass']} so far, "
+                  f"{checkpoint['failures']} failures. Run 'python scrub.py run' for a full pass.")
+
+    def unlocked_key(self):
+        """Return the current user's private key, or None (logging out) once the vault has locked it"""
+        private_key = self.auth.private_key(self.current_user)
+        if private_key is None:
+            print("Your private key was locked after a period of inactivity. Please login again.")
+            self.current_user = None
+        return private_key
 
     def logout(self):
         """Logout current user"""
         if self.current_user:
             print(f"Goodbye, {self.current_user['username']}!")
+            self.auth.logout(self.current_user)
             self.current_user = None
         else:
             print("No user is currently logged in!")
 
+    def user_menu(self):
+        """Main menu entries for a logged-in user as (label, handler) pairs
+
+        A handler of None exits the program.
+        """
+        entries = [
+            ("Upload Document", self.upload_document),
+            ("Batch Upload", self.batch_upload),
+            ("Upload New Version", self.upload_version),
+            ("Download Document", self.download_document),
+            ("Version History", self.version_history),
+            ("Bulk Download", self.bulk_download),
+            ("Share Document", self.share_document),
+            ("Bulk Share", self.bulk_share),
+            ("Unshare Document", self.unshare_document),
+            ("Delete Document", self.delete_document),
+            ("List My Documents", self.list_documents),
+            ("Search Documents", self.search_documents),
+        ]
+        if self.auth.is_admin(self.current_user):
+            entries.append(("Admin Panel", self.admin_panel))
+        entries.append(("Logout", self.logout))
+        entries.append(("Exit", None))
+        return entries
+
+    def guest_menu(self):
+        """Main menu entries before login as (label, handler) pairs"""
+        return [
+            ("Register", self.register),
+            ("Login", self.login),
+            ("Exit", None),
+        ]
+
     def run(self):
         """Main CLI loop"""
         while True:
@@ -266,48 +684,26 @@ class CLI:
 
             if self.current_user:
                 print(f"Logged in as: {self.current_user['username']} ({self.current_user['role']})")
-                print("\n1. Upload Document")
-                print("2. Download Document")
-                print("3. Share Document")
-                print("4. List My Documents")
-                if self.auth.is_admin(self.current_user):
-                    print("5. Admin Panel")
-                print("6. Logout")
-                print("7. Exit")
+                print()
+                entries = self.user_menu()
             else:
-                print("1. Register")
-                print("2. Login")
-                print("3. Exit")
+                entries = self.guest_menu()
+
+            for number, (label, _) in enumerate(entries, start=1):
+                print(f"{number}. {label}")
 
             choice = input("\nEnter your choice: ")
 
-            if self.current_user:
-                if choice == '1':
-                    self.upload_document()
-                elif choice == '2':
-                    self.download_document()
-                elif choice == '3':
-                    self.share_document()
-                elif choice == '4':
-                    self.list_documents()
-                elif choice == '5' and self.auth.is_admin(self.current_user):
-                    self.admin_panel()
-                elif choice == '6':
-                    self.logout()
-                elif choice == '7':
-                    print("Thank you for using SDMS!")
-                    break
-                else:
-                    print("Invalid choice!")
+            if not choice.isdigit() or not 1 <= int(choice) <= len(entries):
+                print("Invalid choice!")
             else:
-                if choice == '1':
-                    self.register()
-                elif choice == '2':
-                    self.login()
-                elif choice == '3':
+                label, handler = entries[int(choice) - 1]
+                if handler is None:
+                    if self.current_user:
+                        self.auth.logout(self.current_user)
                     print("Thank you for using SDMS!")
                     break
-                else:
-                    print("Invalid choice!")
+                with operation(self.profiler, label):
+                    handler()
 
             input("\nPress Enter to continue...")
\ No newline at end of file
@@ -0,0 +1,249 @@
+import os
+import lzma
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+
+CODEC_NONE = 'none'
+CODEC_ZLIB = 'zlib'
+CODEC_LZMA = 'lzma'
+CODEC_ZSTD = 'zstd'
+
+# Formats that are already compressed; recompressing them only burns CPU
+COMPRESSED_EXTENSIONS = {
+    '.7z', '.avi', '.bz2', '.docx', '.flac', '.gif', '.gz', '.heic', '.jpeg',
+    '.jpg', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.odp', '.ods', '.odt',
+    '.ogg', '.png', '.pptx', '.rar', '.webm', '.webp', '.xlsx', '.xz', '.zip',
+    '.zst',
+}
+COMPRESSED_SIGNATURES = (
+    b'PK\x03\x04',          # zip and zip-based office formats
+    b'\x1f\x8b',            # gzip
+    b'\xfd7zXZ\x00',        # xz
+    b'(\xb5/\xfd',          # zstd
+    b'BZh',                 # bzip2
+    b'7z\xbc\xaf\x27\x1c',  # 7z
+    b'Rar!',                # rar
+    b'\x89PNG',             # png
+    b'\xff\xd8\xff',        # jpeg
+    b'GIF8',                # gif
+)
+
+SAMPLE_SIZE = 64 * 1024
+# Compress only if the sample shrinks to at most this fraction of its size
+MAX_SAMPLE_RATIO = 0.9
+
+
+def available_codecs():
+    """Return the codecs usable in this environment"""
+    codecs = [CODEC_NONE, CODEC_ZLIB, CODEC_LZMA]
+    if zstandard is not None:
+        codecs.append(CODEC_ZSTD)
+    return codecs
+
+
+def default_codec():
+    """Return the preferred codec for compressible data"""
+    return CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+
+
+def choose_codec(filename, sample, preferred=None):
+    """Pick a codec for a document from its name and a leading sample
+
+    Known compressed formats are skipped by extension or signature; anything
+    else is compressed only if a fast zlib pass over the sample pays off.
+    """
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return CODEC_NONE
+    if not sample or sample.startswith(COMPRESSED_SIGNATURES):
+        return CODEC_NONE
+
+    sample = sample[:SAMPLE_SIZE]
+    if len(zlib.compress(sample, 1)) > len(sample) * MAX_SAMPLE_RATIO:
+        return CODEC_NONE
+
+    return preferred or default_codec()
+
+
+def _compressor(codec):
+    """Return an object with compress()/flush() for a codec"""
+    if codec == CODEC_ZLIB:
+        return zlib.compressobj(6)
+    if codec == CODEC_LZMA:
+        return lzma.LZMACompressor()
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def _decompressor(codec):
+    """Return an object with decompress() for a codec"""
+    if codec == CODEC_ZLIB:
+        return zlib.decompressobj()
+    if codec == CODEC_LZMA:
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+class _ChunkReader:
+    """Read-only file object over an iterable of chunks, for zstandard.stream_reader"""
+
+    def __init__(self, chunks, on_chunk):
+        self._chunks = iter(chunks)
+        self._pending = b""
+        self._on_chunk = on_chunk  # Called with every chunk as it is taken from the iterable
+
+    def read(self, size=-1):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b""
+            self._on_chunk(chunk)
+            self._pending = chunk
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+class _ZstdFrame:
+    """Follow a zstd frame's header and block headers to learn where it ends
+
+    zstandard's stream_reader caps its output per read but stops quietly
+    when its input runs out mid-frame, so this tells a complete frame from
+    a truncated one.
+    """
+
+    def __init__(self):
+        self.complete = False
+        self._buffer = bytearray()
+        self._stage = 'header'  # then 'blocks', then 'end' after the last block
+        self._skip = 0  # Block content or checksum bytes still to pass over
+        self._checksum = False
+
+    def _header_size(self):
+        """Return the frame header's size, or None until enough of it is buffered"""
+        if len(self._buffer) < 5:
+            return None
+        descriptor = self._buffer[4]
+        single_segment = descriptor & 0x20
+        self._checksum = bool(descriptor & 0x04)
+        return (5 + (0 if single_segment else 1)          # magic, descriptor, window
+                + (0, 1, 2, 4)[descriptor & 0x03]          # dictionary ID
+                + (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6])  # content size
+
+    def feed(self, data):
+        self._buffer += data
+        while not self.complete:
+            if self._skip:
+                skipped = min(self._skip, len(self._buffer))
+                del self._buffer[:skipped]
+                self._skip -= skipped
+                if self._skip:
+                    return
+
+            if self._stage == 'header':
+                size = self._header_size()
+                if size is None or len(self._buffer) < size:
+                    return
+                del self._buffer[:size]
+                self._stage = 'blocks'
+            elif self._stage == 'blocks':
+                if len(self._buffer) < 3:
+                    return
+                header = int.from_bytes(self._buffer[:3], 'little')
+                del self._buffer[:3]
+                # An RLE block stores one byte however many it expands to
+                self._skip = 1 if (header >> 1) & 0x03 == 1 else header >> 3
+                if header & 1:  # Last block
+                    self._skip += 4 if self._checksum else 0
+                    self._stage = 'end'
+            else:
+                self.complete = True
+
+
+def _decompress_zstd(chunks, max_chunk):
+    """Decompress a zstd frame in pieces of at most max_chunk bytes"""
+    frame = _ZstdFrame()
+    reader = zstandard.ZstdDecompressor().stream_reader(_ChunkReader(chunks, frame.feed))
+    while True:
+        data = reader.read(max_chunk)
+        if not data:
+            break
+        yield data
+    if not frame.complete:
+        raise ValueError("Compressed data is truncated")
+
+
+def compress_stream(chunks, codec):
+    """Compress an iterable of chunks, yielding compressed pieces"""
+    if codec == CODEC_NONE:
+        yield from chunks
+        return
+
+    compressor = _compressor(codec)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    tail = compressor.flush()
+    if tail:
+        yield tail
+
+
+def decompress_stream(chunks, codec, max_chunk=64 * 1024):
+    """Decompress an iterable of chunks, yielding plaintext pieces
+
+    Output is capped at max_chunk bytes per piece so a highly compressible
+    input cannot expand into one huge buffer. Corrupt or truncated input
+    raises ValueError whatever the codec.
+    """
+    if codec == CODEC_NONE:
+        yield from chunks
+        return
+
+    try:
+        yield from _decompress_stream(chunks, codec, max_chunk)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"Compressed data is corrupt: {e}")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise ValueError(f"Compressed data is corrupt: {e}")
+        raise
+
+
+def _decompress_stream(chunks, codec, max_chunk):
+    """Decompress chunks with a codec's native error types"""
+    if codec == CODEC_ZSTD and zstandard is not None:
+        yield from _decompress_zstd(chunks, max_chunk)
+        return
+
+    decompressor = _decompressor(codec)
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if codec == CODEC_ZLIB:
+            data = decompressor.decompress(chunk, max_chunk)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, max_chunk)
+        else:
+            data = decompressor.decompress(chunk, max_chunk)
+            if data:
+                yield data
+            while not decompressor.needs_input and not decompressor.eof:
+                data = decompressor.decompress(b"", max_chunk)
+                if data:
+                    yield data
+
+    if codec == CODEC_ZLIB:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+    if not decompressor.eof:
+        raise ValueError("Compressed data is truncated")
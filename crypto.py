@@ -1,16 +1,115 @@
 import os
+import struct
 import hashlib
+import threading
+from collections import OrderedDict
+from functools import partial
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import AES, PKCS1_OAEP
 from Crypto.Random import get_random_bytes
 from Crypto.Util.Padding import pad, unpad
 import base64
+import metrics
+
+
+# On-disk formats. Format 1 is the original IV || AES-CBC(pad(data)) blob and
+# has no header; format 2 is a container of independently authenticated
+# AES-GCM segments behind a 16-byte header.
+FORMAT_CBC = 1
+FORMAT_SEGMENTED = 2
+
+CONTAINER_MAGIC = b"SDMS"
+# magic, format version, plaintext segment size, nonce prefix
+CONTAINER_HEADER = struct.Struct(">4sBI7s")
+SEGMENT_TAG_SIZE = 16
+DEFAULT_SEGMENT_SIZE = 64 * 1024
+
+# Domain separator for content keys derived from plaintext (see
+# calculate_content_hash_and_key)
+CONTENT_KEY_DOMAIN = b"sdms-content-key\x00"
+
+
+class KeyCache:
+    """Bounded LRU cache of imported RSA keys
+
+    Entries are keyed by the SHA-256 fingerprint of the PEM text and hold
+    the parsed key together with a PKCS1_OAEP cipher factory, so repeated
+    wraps and unwraps skip PEM parsing. Thread-safe.
+    """
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(pem):
+        """Return the cache key for a PEM-encoded key"""
+        if isinstance(pem, str):
+            pem = pem.encode('utf-8')
+        return hashlib.sha256(pem.strip()).hexdigest()
+
+    def get(self, pem):
+        """Return (rsa_key, cipher_factory) for a PEM key, importing it on a miss"""
+        fingerprint = self.fingerprint(pem)
+
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Parse outside the lock; a concurrent miss on the same key just does it twice
+        rsa_key = RSA.import_key(pem)
+        entry = (rsa_key, partial(PKCS1_OAEP.new, rsa_key))
+
+        with self._lock:
+            self._entries[fingerprint] = entry
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return entry
+
+    def invalidate(self, *pems):
+        """Drop the cached entries for the given PEM keys (None is ignored)"""
+        with self._lock:
+            for pem in pems:
+                if pem:
+                    self._entries.pop(self.fingerprint(pem), None)
+
+    def clear(self):
+        """Drop every cached key"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
 
 
 class CryptoManager:
+    # Shared by every CryptoManager so all components benefit from one cache
+    key_cache = KeyCache()
+
     def __init__(self):
         self.key_size = 2048  # RSA key size
+        self.chunk_size = 64 * 1024  # Read size for streaming file operations
 
+    @metrics.timed('crypto.rsa_keygen')
     def generate_rsa_keypair(self):
         """Generate RSA public-private key pair"""
         key = RSA.generate(self.key_size)
@@ -19,24 +118,33 @@ class CryptoManager:
 
         return public_key, private_key
 
+    @metrics.timed('crypto.rsa_wrap')
     def encrypt_with_rsa(self, public_key, data):
         """Encrypt data using RSA public key"""
-        rsa_key = RSA.import_key(public_key)
-        cipher = PKCS1_OAEP.new(rsa_key)
+        cipher = self.rsa_cipher(public_key)
         encrypted_data = cipher.encrypt(data)
         return encrypted_data
 
+    @metrics.timed('crypto.rsa_unwrap')
     def decrypt_with_rsa(self, private_key, encrypted_data):
         """Decrypt data using RSA private key"""
-        rsa_key = RSA.import_key(private_key)
-        cipher = PKCS1_OAEP.new(rsa_key)
+        cipher = self.rsa_cipher(private_key)
         decrypted_data = cipher.decrypt(encrypted_data)
         return decrypted_data
 
+    def rsa_cipher(self, key):
+        """Return a PKCS1_OAEP cipher for a PEM key (via the key cache) or an imported RsaKey"""
+        if isinstance(key, RSA.RsaKey):
+            # Unlocked vault keys are already imported and must not linger in the cache
+            return PKCS1_OAEP.new(key)
+        _, cipher_factory = self.key_cache.get(key)
+        return cipher_factory()
+
     def generate_aes_key(self):
         """Generate a random AES key (32 bytes for AES-256)"""
         return get_random_bytes(32)
 
+    @metrics.timed('crypto.aes_encrypt')
     def encrypt_with_aes(self, data, aes_key):
         """Encrypt data using AES in CBC mode"""
         iv = get_random_bytes(16)  # Initialization vector
@@ -48,8 +156,54 @@ class CryptoManager:
 
         return iv + encrypted_data  # Prepend IV for decryption
 
+    def seal_key(self, key, sealing_key, context):
+        """Encrypt a small key under another AES key, returning base64 text
+
+        AES-GCM with context (e.g. the storage key the sealed key opens) as
+        associated data, so a sealed key only opens where it was sealed.
+        """
+        nonce = get_random_bytes(12)
+        cipher = AES.new(sealing_key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(context.encode('utf-8'))
+        encrypted_key, tag = cipher.encrypt_and_digest(key)
+        return base64.b64encode(nonce + encrypted_key + tag).decode('utf-8')
+
+    def open_sealed_key(self, sealed, sealing_key, context):
+        """Decrypt a key sealed by seal_key, raising ValueError if it does not open"""
+        data = base64.b64decode(sealed)
+        if len(data) <= 12 + SEGMENT_TAG_SIZE:
+            raise ValueError("Malformed sealed key")
+        cipher = AES.new(sealing_key, AES.MODE_GCM, nonce=data[:12])
+        cipher.update(context.encode('utf-8'))
+        return cipher.decrypt_and_verify(data[12:-SEGMENT_TAG_SIZE], data[-SEGMENT_TAG_SIZE:])
+
+    def encrypt_stream_with_aes(self, chunks, aes_key):
+        """Encrypt an iterable of data chunks using AES in CBC mode
+
+        Yields the same IV + ciphertext layout as encrypt_with_aes, piece by
+        piece, so only one chunk is held in memory at a time.
+        """
+        iv = get_random_bytes(16)
+        cipher = AES.new(aes_key, AES.MODE_CBC, iv)
+        yield iv
+
+        pending = b""
+        for chunk in chunks:
+            pending += chunk
+            # Hold back the trailing partial block until the final padding
+            usable = len(pending) - (len(pending) % AES.block_size)
+            if usable:
+                yield cipher.encrypt(pending[:usable])
+                pending = pending[usable:]
+
+        yield cipher.encrypt(pad(pending, AES.block_size))
+
+    @metrics.timed('crypto.aes_decrypt')
     def decrypt_with_aes(self, encrypted_data, aes_key):
         """Decrypt data using AES"""
+        if self.detect_format(encrypted_data) == FORMAT_SEGMENTED:
+            return b"".join(self.decrypt_stream_segmented([encrypted_data], aes_key))
+
         iv = encrypted_data[:16]  # Extract IV
         actual_encrypted_data = encrypted_data[16:]
 
@@ -59,6 +213,186 @@ class CryptoManager:
 
         return decrypted_data
 
+    def decrypt_stream_with_aes(self, chunks, aes_key):
+        """Decrypt an iterable of IV + ciphertext chunks produced by AES CBC
+
+        The final block is held back until the input is exhausted so that the
+        padding can be stripped from it.
+        """
+        cipher = None
+        pending = b""
+        for chunk in chunks:
+            pending += chunk
+            if cipher is None:
+                if len(pending) < 16:
+                    continue
+                cipher = AES.new(aes_key, AES.MODE_CBC, pending[:16])
+                pending = pending[16:]
+
+            usable = len(pending) - (len(pending) % AES.block_size)
+            if usable == len(pending):
+                usable -= AES.block_size
+            if usable > 0:
+                yield cipher.decrypt(pending[:usable])
+                pending = pending[usable:]
+
+        if cipher is None or len(pending) != AES.block_size:
+            raise ValueError("Encrypted data is truncated or malformed")
+
+        yield unpad(cipher.decrypt(pending), AES.block_size)
+
+    def detect_format(self, head):
+        """Return the on-disk format of encrypted data from its first bytes"""
+        if head[:5] == CONTAINER_MAGIC + bytes([FORMAT_SEGMENTED]):
+            return FORMAT_SEGMENTED
+        return FORMAT_CBC
+
+    def _segment_nonce(self, prefix, index, last):
+        """Build the 12-byte GCM nonce for a segment
+
+        Binding the index and a final-segment flag into the nonce stops
+        segments from being reordered, dropped or the stream truncated.
+        """
+        return prefix + struct.pack(">I", index) + (b"\x01" if last else b"\x00")
+
+    def encrypt_stream_segmented(self, chunks, aes_key, segment_size=DEFAULT_SEGMENT_SIZE):
+        """Encrypt an iterable of data chunks into the segmented AES-GCM format
+
+        Layout: header || segment 0 || segment 1 || ..., where every segment
+        is GCM(plaintext[i*size:(i+1)*size]) || tag. All segments except the
+        last hold exactly segment_size bytes of plaintext, so the position of
+        any segment follows from its index.
+        """
+        prefix = get_random_bytes(7)
+        header = CONTAINER_HEADER.pack(CONTAINER_MAGIC, FORMAT_SEGMENTED, segment_size, prefix)
+        yield header
+
+        index = 0
+        pending = bytearray()
+        for chunk in chunks:
+            pending += chunk
+            # Only emit a segment once more data is known to follow it
+            while len(pending) > segment_size:
+                yield self._encrypt_segment(aes_key, header, prefix, index, pending[:segment_size], False)
+                del pending[:segment_size]
+                index += 1
+
+        yield self._encrypt_segment(aes_key, header, prefix, index, bytes(pending), True)
+
+    def _encrypt_segment(self, aes_key, header, prefix, index, data, last):
+        """Encrypt and authenticate a single container segment"""
+        cipher = AES.new(aes_key, AES.MODE_GCM, nonce=self._segment_nonce(prefix, index, last))
+        cipher.update(header)
+        encrypted_data, tag = cipher.encrypt_and_digest(bytes(data))
+        return encrypted_data + tag
+
+    def _decrypt_segment(self, aes_key, header, prefix, index, data, last):
+        """Decrypt a single container segment, raising ValueError if tampered"""
+        if len(data) < SEGMENT_TAG_SIZE:
+            raise ValueError("Encrypted data is truncated or malformed")
+        cipher = AES.new(aes_key, AES.MODE_GCM, nonce=self._segment_nonce(prefix, index, last))
+        cipher.update(header)
+        return cipher.decrypt_and_verify(bytes(data[:-SEGMENT_TAG_SIZE]), bytes(data[-SEGMENT_TAG_SIZE:]))
+
+    def _parse_header(self, header):
+        """Unpack and validate a container header"""
+        if len(header) < CONTAINER_HEADER.size:
+            raise ValueError("Encrypted data is truncated or malformed")
+        magic, version, segment_size, prefix = CONTAINER_HEADER.unpack(header[:CONTAINER_HEADER.size])
+        if magic != CONTAINER_MAGIC or version != FORMAT_SEGMENTED or segment_size <= 0:
+            raise ValueError("Unsupported container format")
+        return segment_size, prefix
+
+    def decrypt_stream_segmented(self, chunks, aes_key):
+        """Decrypt an iterable of chunks in the segmented AES-GCM format
+
+        Every segment is verified before its plaintext is yielded.
+        """
+        header = None
+        pending = bytearray()
+        index = 0
+        for chunk in chunks:
+            pending += chunk
+            if header is None:
+                if len(pending) < CONTAINER_HEADER.size:
+                    continue
+                header = bytes(pending[:CONTAINER_HEADER.size])
+                segment_size, prefix = self._parse_header(header)
+                segment_length = segment_size + SEGMENT_TAG_SIZE
+                del pending[:CONTAINER_HEADER.size]
+
+            while len(pending) > segment_length:
+                yield self._decrypt_segment(aes_key, header, prefix, index, pending[:segment_length], False)
+                del pending[:segment_length]
+                index += 1
+
+        if header is None:
+            raise ValueError("Encrypted data is truncated or malformed")
+
+        yield self._decrypt_segment(aes_key, header, prefix, index, pending, True)
+
+    def decrypt_stream(self, chunks, aes_key):
+        """Decrypt an iterable of chunks in any supported on-disk format"""
+        chunks = iter(chunks)
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= 5:
+                break
+
+        def rest():
+            yield head
+            yield from chunks
+
+        if self.detect_format(head) == FORMAT_SEGMENTED:
+            return self.decrypt_stream_segmented(rest(), aes_key)
+        return self.decrypt_stream_with_aes(rest(), aes_key)
+
+    def segmented_plaintext_size(self, header, total_size):
+        """Return (plaintext size, segment count) of a container of total_size bytes"""
+        segment_size, _ = self._parse_header(header)
+        body = total_size - CONTAINER_HEADER.size
+        segment_count = max(1, -(-body // (segment_size + SEGMENT_TAG_SIZE)))
+        plaintext_size = body - segment_count * SEGMENT_TAG_SIZE
+        if plaintext_size < 0:
+            raise ValueError("Encrypted data is truncated or malformed")
+        return plaintext_size, segment_count
+
+    @metrics.timed('crypto.decrypt_range')
+    def decrypt_range_segmented(self, read_at, total_size, aes_key, offset, length):
+        """Decrypt plaintext[offset:offset + length] from a segmented container
+
+        read_at(position, size) must return the stored bytes at that position.
+        Only the segments that overlap the requested range are read and
+        verified.
+        """
+        header = read_at(0, CONTAINER_HEADER.size)
+        segment_size, prefix = self._parse_header(header)
+        plaintext_size, segment_count = self.segmented_plaintext_size(header, total_size)
+
+        end = min(offset + length, plaintext_size)
+        if offset >= end:
+            return b""
+
+        first = offset // segment_size
+        last = (end - 1) // segment_size
+        segment_length = segment_size + SEGMENT_TAG_SIZE
+        start = CONTAINER_HEADER.size + first * segment_length
+        stop = min(CONTAINER_HEADER.size + (last + 1) * segment_length, total_size)
+        data = read_at(start, stop - start)
+
+        plaintext = bytearray()
+        for index in range(first, last + 1):
+            position = (index - first) * segment_length
+            segment = data[position:position + segment_length]
+            plaintext += self._decrypt_segment(
+                aes_key, header, prefix, index, segment, index == segment_count - 1
+            )
+
+        skip = offset - first * segment_size
+        return bytes(plaintext[skip:skip + (end - offset)])
+
+    @metrics.timed('hash.file')
     def calculate_file_hash(self, file_path):
         """Calculate SHA-256 hash of a file"""
         sha256_hash = hashlib.sha256()
@@ -70,6 +404,37 @@ class CryptoManager:
 
         return sha256_hash.hexdigest()
 
+    def read_file_chunks(self, file_path, hasher=None):
+        """Yield a file in chunk_size pieces, optionally feeding a hash object"""
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                if hasher is not None:
+                    hasher.update(chunk)
+                yield chunk
+
+    @metrics.timed('hash.content_key')
+    def calculate_content_hash_and_key(self, file_path):
+        """Hash a file and derive its content key in a single read pass
+
+        Returns (file_hash, content_key). The content key is a SHA-256 of the
+        plaintext under a separate domain prefix, so identical files get the
+        same AES key (allowing their ciphertext to be stored once) while the
+        key cannot be computed from the file_hash kept in the database.
+        """
+        sha256_hash = hashlib.sha256()
+        key_hash = hashlib.sha256(CONTENT_KEY_DOMAIN)
+
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                sha256_hash.update(chunk)
+                key_hash.update(chunk)
+
+        return sha256_hash.hexdigest(), key_hash.digest()
+
+    def calculate_data_content_key(self, data):
+        """Derive the content key for in-memory data"""
+        return hashlib.sha256(CONTENT_KEY_DOMAIN + data).digest()
+
     def calculate_data_hash(self, data):
         """Calculate SHA-256 hash of data"""
         return hashlib.sha256(data).hexdigest()
\ No newline at end of file
@@ -1,193 +1,1287 @@
 import sqlite3
 import os
+import queue
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime
+from crypto import CryptoManager
+from storage import BLOB_KEY_PREFIX_LENGTH
+import metrics
 
 
+# Hot queries are kept here so the diagnostics can EXPLAIN exactly what runs
+USER_DOCUMENTS_QUERY = '''
+    SELECT * FROM documents 
+    WHERE owner_id = ? 
+    ORDER BY uploaded_at DESC
+'''
+
+SHARED_DOCUMENTS_QUERY = '''
+    SELECT d.id, d.filename, d.file_path, d.file_hash, d.encrypted_key,
+           d.owner_id, d.uploaded_at, u.username as owner_name 
+    FROM documents d
+    JOIN document_shares ds ON d.id = ds.document_id
+    JOIN users u ON d.owner_id = u.id
+    WHERE ds.user_id = ?
+    ORDER BY ds.shared_at DESC
+'''
+
+ALL_DOCUMENTS_QUERY = '''
+    SELECT d.id, d.filename, u.username, d.uploaded_at 
+    FROM documents d 
+    JOIN users u ON d.owner_id = u.id
+    ORDER BY d.uploaded_at DESC
+'''
+
+# Keyset-paginated listings. Each selects only the columns a listing shows
+# and orders by (timestamp, id) so the next page starts strictly after the
+# last row seen; {after} is replaced by the cursor condition when present.
+USER_DOCUMENTS_PAGE_QUERY = '''
+    SELECT id, filename, file_hash, NULL, uploaded_at
+    FROM documents
+    WHERE owner_id = ? {after}
+    ORDER BY uploaded_at DESC, id DESC
+    LIMIT ?
+'''
+USER_DOCUMENTS_AFTER = 'AND (uploaded_at, id) < (?, ?)'
+
+SHARED_DOCUMENTS_PAGE_QUERY = '''
+    SELECT d.id, d.filename, d.file_hash, u.username, ds.shared_at
+    FROM document_shares ds
+    JOIN documents d ON d.id = ds.document_id
+    JOIN users u ON d.owner_id = u.id
+    WHERE ds.user_id = ? {after}
+    ORDER BY ds.shared_at DESC, ds.document_id DESC
+    LIMIT ?
+'''
+SHARED_DOCUMENTS_AFTER = 'AND (ds.shared_at, ds.document_id) < (?, ?)'
+
+ALL_DOCUMENTS_PAGE_QUERY = '''
+    SELECT d.id, d.filename, d.file_hash, u.username, d.uploaded_at
+    FROM documents d
+    JOIN users u ON d.owner_id = u.id
+    WHERE 1 = 1 {after}
+    ORDER BY d.uploaded_at DESC, d.id DESC
+    LIMIT ?
+'''
+ALL_DOCUMENTS_AFTER = 'AND (d.uploaded_at, d.id) < (?, ?)'
+
+HOT_QUERIES = {
+    'get_user_documents': (USER_DOCUMENTS_QUERY, (0,)),
+    'get_shared_documents': (SHARED_DOCUMENTS_QUERY, (0,)),
+    'get_all_documents': (ALL_DOCUMENTS_QUERY, ()),
+    'page_user_documents': (
+        USER_DOCUMENTS_PAGE_QUERY.format(after=USER_DOCUMENTS_AFTER), (0, '', 0, 1)),
+    'page_shared_documents': (
+        SHARED_DOCUMENTS_PAGE_QUERY.format(after=SHARED_DOCUMENTS_AFTER), (0, '', 0, 1)),
+    'page_all_documents': (
+        ALL_DOCUMENTS_PAGE_QUERY.format(after=ALL_DOCUMENTS_AFTER), ('', 0, 1)),
+}
+
+# Ranked full-text search over the documents a user can see: their own and
+# those shared with them. Filename matches weigh more than body matches.
+SEARCH_QUERY = '''
+    SELECT d.id, d.filename, CASE WHEN d.owner_id = ? THEN NULL ELSE u.username END,
+           d.uploaded_at, bm25(document_search, 5.0, 1.0) AS rank
+    FROM document_search
+    JOIN documents d ON d.id = document_search.rowid
+    JOIN users u ON u.id = d.owner_id
+    WHERE document_search MATCH ?
+      AND (d.owner_id = ? OR d.id IN (SELECT document_id FROM document_shares WHERE user_id = ?))
+    ORDER BY rank, d.id
+    LIMIT ? OFFSET ?
+'''
+
+SearchResult = namedtuple(
+    'SearchResult', ['id', 'filename', 'owner_name', 'uploaded_at', 'rank']
+)
+
+# Lightweight row returned by the paginated listings. owner_name is None for
+# a user's own documents; timestamp is uploaded_at, or shared_at for shares.
+DocumentSummary = namedtuple(
+    'DocumentSummary', ['id', 'filename', 'file_hash', 'owner_name', 'timestamp']
+)
+
+# One stored version of a document. file_path is a blob key for a version
+# stored whole or a manifest key for a chunked one; sealed_key is its
+# payload key sealed under the document key. stored_bytes is what storing
+# the version added: its new chunks and manifest, or the whole payload.
+DocumentVersion = namedtuple(
+    'DocumentVersion',
+    ['document_id', 'version', 'file_path', 'file_hash', 'size', 'codec', 'sealed_key',
+     'chunk_count', 'stored_bytes', 'cipher_hash', 'cipher_size', 'created_at']
+)
+
+def _file_paths_to_storage_keys(conn):
+    """Rewrite documents.file_path from uploads/ paths to storage backend keys"""
+    rows = conn.execute('SELECT id, file_path FROM documents').fetchall()
+    updates = []
+    for document_id, file_path in rows:
+        key = file_path.replace('\\', '/')
+        if key.startswith('uploads/'):
+            key = key[len('uploads/'):]
+        if key != file_path:
+            updates.append((key, document_id))
+    conn.executemany('UPDATE documents SET file_path = ? WHERE id = ?', updates)
+
+
+def _search_index_columns():
+    """Return the fts5 arguments for document_search on this SQLite version
+
+    SQLite 3.43+ can delete rows from a contentless index, which holds the
+    token index only, not the extracted text. Older versions cannot, so
+    there the index is a regular FTS5 table that stores the text as well.
+    """
+    if sqlite3.sqlite_version_info >= (3, 43, 0):
+        return "filename, body, content='', contentless_delete=1"
+    return "filename, body"
+
+
+def _create_search_index(conn):
+    """Create the full-text index and add the names of existing documents"""
+    conn.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS document_search USING fts5({_search_index_columns()})"
+    )
+    # Existing content is encrypted, so only the names can be indexed
+    conn.execute("INSERT INTO document_search (rowid, filename, body) "
+                 "SELECT id, filename, '' FROM documents")
+
+
+def _rebuild_search_index(conn):
+    """Recreate a full-text index whose rows cannot be deleted
+
+    Indexes created contentless without contentless_delete kept the terms
+    of deleted and replaced documents. Their terms are read back in order
+    through fts5vocab and indexed again in a table that supports deletes,
+    so existing documents stay searchable, phrases included, and entries
+    of deleted documents are dropped.
+    """
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'document_search'").fetchone()[0]
+    if "content=''" not in sql.replace(' ', '') or 'contentless_delete' in sql:
+        return
+
+    conn.execute("CREATE VIRTUAL TABLE temp.document_search_terms "
+                 "USING fts5vocab(main, document_search, 'instance')")
+    terms = {}  # document ID -> {column: [term, ...]}
+    rows = conn.execute('''
+        SELECT doc, col, term FROM temp.document_search_terms
+        WHERE doc IN (SELECT id FROM documents)
+        ORDER BY doc, col, offset
+    ''')
+    for document_id, column, term in rows:
+        terms.setdefault(document_id, {}).setdefault(column, []).append(term)
+    conn.execute('DROP TABLE temp.document_search_terms')
+
+    conn.execute('DROP TABLE document_search')
+    conn.execute(f"CREATE VIRTUAL TABLE document_search USING fts5({_search_index_columns()})")
+    conn.executemany(
+        'INSERT INTO document_search (rowid, filename, body) VALUES (?, ?, ?)',
+        [(document_id, ' '.join(columns.get('filename', [])), ' '.join(columns.get('body', [])))
+         for document_id, columns in terms.items()]
+    )
+
+
+# Schema migrations, applied in order on top of the base tables. PRAGMA
+# user_version records how many have run, so each executes once per file.
+# A step is either an SQL statement or a callable taking the connection.
+MIGRATIONS = [
+    # 1: indexes for the listing queries. The shares index also carries
+    # document_id so the join is answered from the index alone.
+    [
+        'CREATE INDEX IF NOT EXISTS idx_documents_owner_uploaded '
+        'ON documents (owner_id, uploaded_at DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_documents_uploaded '
+        'ON documents (uploaded_at DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_document_shares_user_shared '
+        'ON document_shares (user_id, shared_at DESC, document_id)',
+    ],
+    # 2: rebuild the listing indexes in ascending order. A reverse scan then
+    # yields (timestamp DESC, id DESC) directly, which keyset pagination
+    # needs to avoid sorting the id tie-breaker in a temp B-tree.
+    [
+        'DROP INDEX IF EXISTS idx_documents_owner_uploaded',
+        'DROP INDEX IF EXISTS idx_documents_uploaded',
+        'DROP INDEX IF EXISTS idx_document_shares_user_shared',
+        'CREATE INDEX IF NOT EXISTS idx_documents_owner_keyset '
+        'ON documents (owner_id, uploaded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_documents_keyset '
+        'ON documents (uploaded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_document_shares_user_keyset '
+        'ON document_shares (user_id, shared_at, document_id)',
+    ],
+    # 3: content-addressed blob store. One row per unique plaintext SHA-256,
+    # with the number of documents that reference it.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_documents_file_path ON documents (file_path)',
+    ],
+    # 4: compression codec applied before encryption, per document and blob
+    [
+        "ALTER TABLE documents ADD COLUMN codec TEXT NOT NULL DEFAULT 'none'",
+        "ALTER TABLE blobs ADD COLUMN codec TEXT NOT NULL DEFAULT 'none'",
+    ],
+    # 5: file_path now holds a storage backend key relative to the upload
+    # root (e.g. ab/cd/<hash>) instead of a local path
+    [
+        _file_paths_to_storage_keys,
+    ],
+    # 6: key/value settings (e.g. the session signing secret) and persisted
+    # login sessions
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            role TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)',
+    ],
+    # 7: full-text search over document names and extracted text
+    [
+        _create_search_index,
+    ],
+    # 8: the document AES key wrapped for each share recipient, so sharing
+    # is one RSA rewrap instead of re-encrypting the file
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS document_keys (
+            document_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            encrypted_key TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (document_id, user_id),
+            FOREIGN KEY (document_id) REFERENCES documents (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+    ],
+    # 9: SHA-256 of each stored ciphertext, so the scrubber can verify
+    # payloads without any user's key, and the scrubber's results
+    [
+        'ALTER TABLE blobs ADD COLUMN cipher_hash TEXT',
+        'ALTER TABLE blobs ADD COLUMN cipher_size INTEGER',
+        '''
+        CREATE TABLE IF NOT EXISTS scrub_results (
+            storage_key TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            detail TEXT,
+            cipher_hash TEXT,
+            size INTEGER,
+            checked_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_scrub_results_status ON scrub_results (status, checked_at)',
+    ],
+    # 10: document versions. The documents row keeps pointing at the
+    # current version; once a document has a second version its
+    # encrypted_key wraps a document key and sealed_key holds the current
+    # payload key sealed under it. version_chunks lists the distinct chunk
+    # blobs each chunked version references.
+    [
+        'ALTER TABLE documents ADD COLUMN sealed_key TEXT',
+        '''
+        CREATE TABLE IF NOT EXISTS document_versions (
+            document_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            file_hash TEXT NOT NULL,
+            size INTEGER,
+            codec TEXT NOT NULL DEFAULT 'none',
+            sealed_key TEXT NOT NULL,
+            chunk_count INTEGER NOT NULL DEFAULT 0,
+            stored_bytes INTEGER,
+            cipher_hash TEXT,
+            cipher_size INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (document_id, version),
+            FOREIGN KEY (document_id) REFERENCES documents (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_document_versions_file_path ON document_versions (file_path)',
+        '''
+        CREATE TABLE IF NOT EXISTS version_chunks (
+            document_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            chunk_hash TEXT NOT NULL,
+            PRIMARY KEY (document_id, version, chunk_hash)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_version_chunks_hash ON version_chunks (chunk_hash)',
+    ],
+    # 11: a full-text index that supports deleting and replacing entries
+    [
+        _rebuild_search_index,
+    ],
+]
+
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived SQLite connections
+
+    Connections are created lazily by the given factory, handed out one
+    thread at a time and returned to the pool instead of being closed.
+    Inside connection() every call on the same thread reuses the connection
+    that is already checked out, so several operations share one
+    transaction.
+    """
+
+    def __init__(self, factory, max_size=8, timeout=30):
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def acquire(self):
+        """Take an idle connection, opening a new one while below max_size"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self.max_size:
+                conn = self.factory()
+                self._all.append(conn)
+                return conn
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+    def release(self, conn):
+        """Return a connection to the pool"""
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the current thread
+
+        The outermost block commits on success and rolls back on error;
+        nested blocks on the same thread join the outer transaction.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self.acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self.release(conn)
+
+    def close_all(self):
+        """Close every connection owned by the pool"""
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
+            self._idle = queue.LifoQueue()
+
+
+# Every query method is timed as db.<method>; iterators are left out because
+# their pages are already timed through the page_* calls they make
+@metrics.instrument('db', exclude=(
+    'get_connection', 'connection', 'init_db', 'schema_version', 'migrate', 'explain_query_plans',
+    'iter_user_documents', 'iter_shared_documents', 'iter_all_documents',
+))
 class Database:
+    # Pools and schema setup are shared by every Database built for the same
+    # file, so CLI, AuthManager and DocumentManager reuse one set of connections
+    _pools = {}
+    _initialized = set()
+    _registry_lock = threading.Lock()
+
+    pool_size = 8
+    statement_cache_size = 256
+    cache_size_kib = 16 * 1024
+    mmap_size = 256 * 1024 * 1024
+
     def __init__(self, db_name="sdms.db"):
         self.db_name = db_name
-        self.init_db()
+
+        with Database._registry_lock:
+            self.pool = Database._pools.get(db_name)
+            if self.pool is None:
+                self.pool = ConnectionPool(self.get_connection, max_size=self.pool_size)
+                Database._pools[db_name] = self.pool
+
+            if db_name not in Database._initialized:
+                self.init_db()
+                Database._initialized.add(db_name)
 
     def get_connection(self):
-        """Create and return database connection"""
-        return sqlite3.connect(self.db_name)
+        """Create and return a configured database connection"""
+        conn = sqlite3.connect(
+            self.db_name,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kib)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute('PRAGMA busy_timeout = 5000')
+        return conn
+
+    def connection(self):
+        """Context manager yielding a pooled connection
+
+        Calls made inside the block on the same thread share its connection
+        and transaction:
+
+            with db.connection():
+                db.add_document(...)
+                db.share_document(...)
+        """
+        return self.pool.connection()
+
+    @classmethod
+    def close_all(cls):
+        """Close all pooled connections (e.g. on shutdown)"""
+        with cls._registry_lock:
+            for pool in cls._pools.values():
+                pool.close_all()
+            cls._pools.clear()
+            cls._initialized.clear()
 
     def init_db(self):
         """Initialize database with required tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT DEFAULT 'user',
-                public_key TEXT,
-                private_key TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Documents table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS documents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT NOT NULL,
-                file_path TEXT NOT NULL,
-                file_hash TEXT NOT NULL,
-                encrypted_key TEXT NOT NULL,
-                owner_id INTEGER NOT NULL,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (owner_id) REFERENCES users (id)
-            )
-        ''')
-
-        # Document shares table for access control
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS document_shares (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                document_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                shared_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (document_id) REFERENCES documents (id),
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                UNIQUE(document_id, user_id)
-            )
-        ''')
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # Users table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    role TEXT DEFAULT 'user',
+                    public_key TEXT,
+                    private_key TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Documents table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    file_hash TEXT NOT NULL,
+                    encrypted_key TEXT NOT NULL,
+                    owner_id INTEGER NOT NULL,
+                    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (owner_id) REFERENCES users (id)
+                )
+            ''')
+
+            # Document shares table for access control
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS document_shares (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    document_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    shared_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (document_id) REFERENCES documents (id),
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    UNIQUE(document_id, user_id)
+                )
+            ''')
 
+            self.migrate(conn)
+
+    def schema_version(self):
+        """Return the number of migrations applied to the database"""
+        with self.connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self, conn):
+        """Apply pending schema migrations, each in its own transaction"""
         conn.commit()
-        conn.close()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+
+        for number, steps in enumerate(MIGRATIONS[version:], start=version + 1):
+            try:
+                conn.execute('BEGIN')
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f'PRAGMA user_version = {number}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def explain_query_plans(self):
+        """Return EXPLAIN QUERY PLAN details for each hot query"""
+        plans = {}
+        with self.connection() as conn:
+            for name, (query, params) in HOT_QUERIES.items():
+                rows = conn.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()
+                plans[name] = [row[3] for row in rows]  # detail column
+        return plans
 
     def add_user(self, username, password_hash, role='user', public_key=None, private_key=None):
         """Add a new user to the database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, role, public_key, private_key)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (username, password_hash, role, public_key, private_key))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
-        finally:
-            conn.close()
+            try:
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, role, public_key, private_key)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (username, password_hash, role, public_key, private_key))
+                return True
+            except sqlite3.IntegrityError:
+                return False
 
     def get_user(self, username):
         """Get user by username"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
-        conn.close()
-
-        return user
+            cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
+            return cursor.fetchone()
 
     def get_user_by_id(self, user_id):
         """Get user by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+            cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+            return cursor.fetchone()
 
-        return user
+    def update_password_hash(self, user_id, password_hash):
+        """Replace a user's stored password hash"""
+        with self.connection() as conn:
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
 
-    def add_document(self, filename, file_path, file_hash, encrypted_key, owner_id):
+    def add_document(self, filename, file_path, file_hash, encrypted_key, owner_id, codec='none'):
         """Add a new document to the database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT INTO documents (filename, file_path, file_hash, encrypted_key, owner_id)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (filename, file_path, file_hash, encrypted_key, owner_id))
+            cursor.execute('''
+                INSERT INTO documents (filename, file_path, file_hash, encrypted_key, owner_id, codec)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (filename, file_path, file_hash, encrypted_key, owner_id, codec))
 
-        document_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            return cursor.lastrowid
 
-        return document_id
+    def add_documents(self, rows):
+        """Add many documents in one transaction
+
+        rows are (filename, file_path, file_hash, encrypted_key, owner_id,
+        codec) tuples. Returns the new document IDs in the same order.
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.executemany('''
+                INSERT INTO documents (filename, file_path, file_hash, encrypted_key, owner_id, codec)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+            # The write lock is held for the whole statement, so the IDs are consecutive
+            last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+            return list(range(last_id - len(rows) + 1, last_id + 1))
 
     def get_document(self, document_id):
         """Get document by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT * FROM documents WHERE id = ?', (document_id,))
+            return cursor.fetchone()
+
+    def delete_document(self, document_id):
+        """Delete a document row, its versions, shares and recipients' keys"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('DELETE FROM version_chunks WHERE document_id = ?', (document_id,))
+            cursor.execute('DELETE FROM document_versions WHERE document_id = ?', (document_id,))
+            cursor.execute('DELETE FROM document_keys WHERE document_id = ?', (document_id,))
+            cursor.execute('DELETE FROM document_shares WHERE document_id = ?', (document_id,))
+            cursor.execute('DELETE FROM documents WHERE id = ?', (document_id,))
+            deleted = cursor.rowcount > 0
+            cursor.execute('DELETE FROM document_search WHERE rowid = ?', (document_id,))
+
+            return deleted
+
+    def count_documents_with_path(self, file_path):
+        """Count documents stored at the given path, in their current or an older version"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT COUNT(*) FROM (
+                    SELECT id FROM documents WHERE file_path = ?
+                    UNION
+                    SELECT document_id FROM document_versions WHERE file_path = ?
+                )
+            ''', (file_path, file_path))
+            return cursor.fetchone()[0]
+
+    def index_documents(self, entries):
+        """Add (document_id, filename, text) entries to the full-text index"""
+        with self.connection() as conn:
+            conn.executemany(
+                'INSERT INTO document_search (rowid, filename, body) VALUES (?, ?, ?)', entries
+            )
+
+    def reindex_document(self, document_id, filename, text):
+        """Replace a document's full-text entry, e.g. for a new version"""
+        with self.connection() as conn:
+            conn.execute('DELETE FROM document_search WHERE rowid = ?', (document_id,))
+            conn.execute('INSERT INTO document_search (rowid, filename, body) VALUES (?, ?, ?)',
+                         (document_id, filename, text))
+
+    def search_documents(self, user_id, match, limit=20, offset=0):
+        """Run an FTS5 MATCH over the documents a user can see, best matches first"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                SEARCH_QUERY, (user_id, match, user_id, user_id, limit, offset)
+            ).fetchall()
+        return [SearchResult(*row) for row in rows]
+
+    def get_blob(self, file_hash):
+        """Get a blob by its plaintext hash"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT * FROM blobs WHERE hash = ?', (file_hash,))
+            return cursor.fetchone()
+
+    def add_blob_references(self, blobs):
+        """Record one more reference to each blob, creating new ones
+
+        Each blob is (hash, size, codec, cipher_hash, cipher_size). The
+        ciphertext digest is None when the payload was already stored; a
+        digest means the caller has just published its payload in this
+        transaction (see lock_blobs), so it replaces the recorded codec and
+        digest together.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.executemany('''
+                INSERT INTO blobs (hash, size, codec, cipher_hash, cipher_size, ref_count)
+                VALUES (?, ?, ?, ?, ?, 1)
+                ON CONFLICT (hash) DO UPDATE SET
+                    ref_count = ref_count + 1,
+                    codec = CASE WHEN excluded.cipher_hash IS NULL THEN codec ELSE excluded.codec END,
+                    cipher_hash = COALESCE(excluded.cipher_hash, cipher_hash),
+                    cipher_size = COALESCE(excluded.cipher_size, cipher_size)
+            ''', blobs)
+
+    def lock_blobs(self, file_hashes):
+        """Take the database write lock, then get blobs as get_blobs does
+
+        Inside a connection() block no other writer can change the rows
+        until the transaction ends, so an upload can decide whether to
+        publish its payload from them and record it atomically.
+        """
+        with self.connection() as conn:
+            # Any write statement takes the lock, even one that changes nothing
+            conn.execute('UPDATE blobs SET ref_count = ref_count WHERE 0')
+            return self.get_blobs(file_hashes)
+
+    def release_blob(self, file_hash):
+        """Drop one reference to a blob
 
-        cursor.execute('SELECT * FROM documents WHERE id = ?', (document_id,))
-        document = cursor.fetchone()
-        conn.close()
+        Returns True when that was the last reference and the row was
+        removed, meaning the stored payload can be deleted.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        return document
+            cursor.execute(
+                'UPDATE blobs SET ref_count = ref_count - 1 WHERE hash = ?', (file_hash,)
+            )
+            cursor.execute(
+                'DELETE FROM blobs WHERE hash = ? AND ref_count <= 0', (file_hash,)
+            )
+            return cursor.rowcount > 0
+
+    def release_blobs(self, file_hashes):
+        """Drop one reference to each blob, returning the hashes whose last reference that was"""
+        file_hashes = list(file_hashes)
+        released = []
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.executemany(
+                'UPDATE blobs SET ref_count = ref_count - 1 WHERE hash = ?',
+                [(file_hash,) for file_hash in file_hashes]
+            )
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(file_hashes), 500):
+                batch = file_hashes[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                cursor.execute(
+                    f'SELECT hash FROM blobs WHERE hash IN ({placeholders}) AND ref_count <= 0', batch
+                )
+                released.extend(row[0] for row in cursor.fetchall())
+            cursor.executemany('DELETE FROM blobs WHERE hash = ?', [(file_hash,) for file_hash in released])
+
+        return released
+
+    def get_blobs(self, file_hashes):
+        """Get several blobs by plaintext hash, returned as a dict keyed by hash"""
+        file_hashes = list(file_hashes)
+        blobs = {}
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(file_hashes), 500):
+                batch = file_hashes[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                cursor.execute(f'SELECT * FROM blobs WHERE hash IN ({placeholders})', batch)
+                for blob in cursor.fetchall():
+                    blobs[blob[0]] = blob
+
+        return blobs
+
+    def get_documents(self, document_ids):
+        """Get several documents by ID, returned as a dict keyed by ID"""
+        document_ids = list(document_ids)
+        documents = {}
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(document_ids), 500):
+                batch = document_ids[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                cursor.execute(f'SELECT * FROM documents WHERE id IN ({placeholders})', batch)
+                for document in cursor.fetchall():
+                    documents[document[0]] = document
+
+        return documents
+
+    def get_access_levels(self, user_id, document_ids):
+        """Get a user's access to several documents as {document_id: 'owner' or 'shared'}
+
+        Documents the user cannot read, or that do not exist, are left out.
+        """
+        document_ids = list(document_ids)
+        levels = {}
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(document_ids), 500):
+                batch = document_ids[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                cursor.execute(f'''
+                    SELECT d.id, CASE WHEN d.owner_id = ? THEN 'owner' ELSE 'shared' END
+                    FROM documents d
+                    WHERE d.id IN ({placeholders})
+                      AND (d.owner_id = ? OR EXISTS (
+                          SELECT 1 FROM document_shares ds
+                          WHERE ds.document_id = d.id AND ds.user_id = ?))
+                ''', [user_id] + batch + [user_id, user_id])
+                levels.update(cursor.fetchall())
+
+        return levels
 
     def get_user_documents(self, user_id):
         """Get all documents owned by a user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT * FROM documents 
-            WHERE owner_id = ? 
-            ORDER BY uploaded_at DESC
-        ''', (user_id,))
+            cursor.execute(USER_DOCUMENTS_QUERY, (user_id,))
 
-        documents = cursor.fetchall()
-        conn.close()
+            return cursor.fetchall()
 
-        return documents
+    def share_document(self, document_id, user_id, encrypted_key=None):
+        """Share a document with another user
 
-    def share_document(self, document_id, user_id):
-        """Share a document with another user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        encrypted_key is the document's AES key wrapped for that user; it is
+        stored alongside the share so they can decrypt. Returns False if the
+        share (and the user's key, when given) already existed.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
             cursor.execute('''
-                INSERT INTO document_shares (document_id, user_id)
+                INSERT OR IGNORE INTO document_shares (document_id, user_id)
                 VALUES (?, ?)
             ''', (document_id, user_id))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
-        finally:
-            conn.close()
+            added = cursor.rowcount > 0
+
+            if encrypted_key is not None:
+                # Shares made before per-recipient keys existed get their key now
+                cursor.execute('''
+                    INSERT OR IGNORE INTO document_keys (document_id, user_id, encrypted_key)
+                    VALUES (?, ?, ?)
+                ''', (document_id, user_id, encrypted_key))
+                added = added or cursor.rowcount > 0
+
+            return added
+
+    def share_documents(self, shares):
+        """Share many documents in one transaction
+
+        shares are (document_id, user_id, encrypted_key) tuples. Existing
+        shares are kept and only gain a key if they lacked one.
+        """
+        shares = list(shares)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.executemany('''
+                INSERT OR IGNORE INTO document_shares (document_id, user_id)
+                VALUES (?, ?)
+            ''', [(document_id, user_id) for document_id, user_id, _ in shares])
+            cursor.executemany('''
+                INSERT OR IGNORE INTO document_keys (document_id, user_id, encrypted_key)
+                VALUES (?, ?, ?)
+            ''', shares)
+
+    def get_document_key(self, document_id, user_id):
+        """Get a document's AES key wrapped for a recipient, or None"""
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT encrypted_key FROM document_keys WHERE document_id = ? AND user_id = ?',
+                (document_id, user_id)
+            ).fetchone()
+            return row[0] if row else None
+
+    def get_document_keys(self, user_id, document_ids):
+        """Get a recipient's wrapped keys for several documents as {document_id: key}"""
+        document_ids = list(document_ids)
+        keys = {}
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(document_ids), 500):
+                batch = document_ids[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                cursor.execute(f'''
+                    SELECT document_id, encrypted_key FROM document_keys
+                    WHERE user_id = ? AND document_id IN ({placeholders})
+                ''', [user_id] + batch)
+                keys.update(cursor.fetchall())
+
+        return keys
+
+    def get_key_recipients(self, document_id):
+        """Get (user_id, public_key) for every recipient holding a copy of a document's key"""
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT u.id, u.public_key
+                FROM document_keys dk
+                JOIN users u ON u.id = dk.user_id
+                WHERE dk.document_id = ?
+            ''', (document_id,)).fetchall()
+
+    def rekey_document(self, document_id, encrypted_key, recipient_keys):
+        """Replace a document's key: the owner's copy and (user_id, encrypted_key) recipient copies"""
+        with self.connection() as conn:
+            conn.execute('UPDATE documents SET encrypted_key = ? WHERE id = ?', (encrypted_key, document_id))
+            conn.executemany(
+                'UPDATE document_keys SET encrypted_key = ? WHERE document_id = ? AND user_id = ?',
+                [(key, document_id, user_id) for user_id, key in recipient_keys]
+            )
+
+    def add_document_version(self, document_id, file_path, file_hash, size, codec, sealed_key,
+                             chunk_hashes=(), chunk_count=0, stored_bytes=None, cipher_hash=None,
+                             cipher_size=None, created_at=None):
+        """Record the next version of a document, returning its version number
+
+        chunk_hashes are the distinct chunk blobs the version references.
+        created_at defaults to now.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # Numbered in the INSERT itself so concurrent uploads cannot take the same number
+            cursor.execute('''
+                INSERT INTO document_versions
+                    (document_id, version, file_path, file_hash, size, codec, sealed_key,
+                     chunk_count, stored_bytes, cipher_hash, cipher_size, created_at)
+                SELECT ?, COALESCE(MAX(version), 0) + 1, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                       COALESCE(?, CURRENT_TIMESTAMP)
+                FROM document_versions WHERE document_id = ?
+            ''', (document_id, file_path, file_hash, size, codec, sealed_key, chunk_count,
+                  stored_bytes, cipher_hash, cipher_size, created_at, document_id))
+            version = cursor.execute(
+                'SELECT version FROM document_versions WHERE rowid = ?', (cursor.lastrowid,)
+            ).fetchone()[0]
+
+            cursor.executemany(
+                'INSERT INTO version_chunks (document_id, version, chunk_hash) VALUES (?, ?, ?)',
+                [(document_id, version, chunk_hash) for chunk_hash in chunk_hashes]
+            )
+            return version
+
+    def set_current_version(self, document_id, file_path, file_hash, codec, sealed_key):
+        """Point a document row at the version to open by default"""
+        with self.connection() as conn:
+            conn.execute('''
+                UPDATE documents SET file_path = ?, file_hash = ?, codec = ?, sealed_key = ?
+                WHERE id = ?
+            ''', (file_path, file_hash, codec, sealed_key, document_id))
+
+    def get_document_versions(self, document_id):
+        """Get every recorded version of a document, oldest first"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                'SELECT * FROM document_versions WHERE document_id = ? ORDER BY version',
+                (document_id,)
+            ).fetchall()
+        return [DocumentVersion(*row) for row in rows]
+
+    def get_document_version(self, document_id, version=None):
+        """Get one version of a document, the latest if version is None"""
+        with self.connection() as conn:
+            if version is None:
+                row = conn.execute('''
+                    SELECT * FROM document_versions WHERE document_id = ?
+                    ORDER BY version DESC LIMIT 1
+                ''', (document_id,)).fetchone()
+            else:
+                row = conn.execute(
+                    'SELECT * FROM document_versions WHERE document_id = ? AND version = ?',
+                    (document_id, version)
+                ).fetchone()
+        return DocumentVersion(*row) if row else None
+
+    def get_version_chunk_hashes(self, document_id):
+        """Get the chunk blobs of every version of a document, once per version that references them"""
+        with self.connection() as conn:
+            return [row[0] for row in conn.execute(
+                'SELECT chunk_hash FROM version_chunks WHERE document_id = ?', (document_id,)
+            )]
+
+    def unshare_document(self, document_id, user_id):
+        """Stop sharing a document with a user and drop their copy of its key"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                'DELETE FROM document_keys WHERE document_id = ? AND user_id = ?',
+                (document_id, user_id)
+            )
+            cursor.execute(
+                'DELETE FROM document_shares WHERE document_id = ? AND user_id = ?',
+                (document_id, user_id)
+            )
+            return cursor.rowcount > 0
 
     def get_shared_documents(self, user_id):
         """Get documents shared with a user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT d.*, u.username as owner_name 
-            FROM documents d
-            JOIN document_shares ds ON d.id = ds.document_id
-            JOIN users u ON d.owner_id = u.id
-            WHERE ds.user_id = ?
-            ORDER BY ds.shared_at DESC
-        ''', (user_id,))
+            cursor.execute(SHARED_DOCUMENTS_QUERY, (user_id,))
 
-        documents = cursor.fetchall()
-        conn.close()
+            return cursor.fetchall()
 
-        return documents
+    def get_all_documents(self):
+        """Get every document with its owner's username (admin view)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(ALL_DOCUMENTS_QUERY)
+
+            return cursor.fetchall()
+
+    def _page(self, query, after_clause, params, page_size, after):
+        """Fetch one keyset page, returning (rows, cursor for the next page)"""
+        if after is not None:
+            query = query.format(after=after_clause)
+            params = params + tuple(after)
+        else:
+            query = query.format(after='')
+
+        with self.connection() as conn:
+            # Ask for one extra row to learn whether another page exists
+            rows = conn.execute(query, params + (page_size + 1,)).fetchall()
+
+        rows = [DocumentSummary(*row) for row in rows]
+        if len(rows) <= page_size:
+            return rows, None
+
+        rows = rows[:page_size]
+        return rows, (rows[-1].timestamp, rows[-1].id)
+
+    def _iterate(self, fetch_page, page_size):
+        """Yield rows page by page so only one page is in memory at a time"""
+        after = None
+        while True:
+            rows, after = fetch_page(page_size, after)
+            yield from rows
+            if after is None:
+                return
+
+    def page_user_documents(self, user_id, page_size=50, after=None):
+        """Get one page of a user's documents, newest first
+
+        Pass the returned cursor as after to fetch the following page; it is
+        None on the last page.
+        """
+        return self._page(USER_DOCUMENTS_PAGE_QUERY, USER_DOCUMENTS_AFTER,
+                          (user_id,), page_size, after)
+
+    def page_shared_documents(self, user_id, page_size=50, after=None):
+        """Get one page of documents shared with a user, most recent first"""
+        return self._page(SHARED_DOCUMENTS_PAGE_QUERY, SHARED_DOCUMENTS_AFTER,
+                          (user_id,), page_size, after)
+
+    def page_all_documents(self, page_size=50, after=None):
+        """Get one page of all documents with owner names (admin view)"""
+        return self._page(ALL_DOCUMENTS_PAGE_QUERY, ALL_DOCUMENTS_AFTER,
+                          (), page_size, after)
+
+    def iter_user_documents(self, user_id, page_size=500):
+        """Lazily yield every document owned by a user"""
+        return self._iterate(
+            lambda size, after: self.page_user_documents(user_id, size, after), page_size
+        )
+
+    def iter_shared_documents(self, user_id, page_size=500):
+        """Lazily yield every document shared with a user"""
+        return self._iterate(
+            lambda size, after: self.page_shared_documents(user_id, size, after), page_size
+        )
+
+    def iter_all_documents(self, page_size=500):
+        """Lazily yield every document in the system"""
+        return self._iterate(self.page_all_documents, page_size)
 
     def update_user_keys(self, username, public_key, private_key):
-        """Update user's RSA keys"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Update user's RSA keys
 
-        cursor.execute('''
-            UPDATE users 
-            SET public_key = ?, private_key = ? 
-            WHERE username = ?
-        ''', (public_key, private_key, username))
+        The previous keys are evicted from the shared RSA key cache.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        conn.commit()
-        conn.close()
\ No newline at end of file
+            cursor.execute('SELECT public_key, private_key FROM users WHERE username = ?', (username,))
+            previous_keys = cursor.fetchone()
+
+            cursor.execute('''
+                UPDATE users 
+                SET public_key = ?, private_key = ? 
+                WHERE username = ?
+            ''', (public_key, private_key, username))
+
+        if previous_keys:
+            CryptoManager.key_cache.invalidate(*previous_keys)
+
+    def get_setting(self, key, default=None):
+        """Get a stored setting value"""
+        with self.connection() as conn:
+            row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+            return row[0] if row else default
+
+    def set_setting(self, key, value):
+        """Store a setting value, replacing any previous one"""
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT INTO settings (key, value) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            ''', (key, value))
+
+    def setdefault_setting(self, key, value):
+        """Store a setting only if it is unset, returning the value that is stored
+
+        Safe when several processes race to initialise the same setting.
+        """
+        with self.connection() as conn:
+            conn.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', (key, value))
+            return conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()[0]
+
+    def add_session(self, session_id, user_id, username, role, expires_at):
+        """Persist a login session"""
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT INTO sessions (id, user_id, username, role, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (session_id, user_id, username, role, expires_at))
+
+    def get_session(self, session_id):
+        """Get a persisted session as (id, user_id, username, role, expires_at)"""
+        with self.connection() as conn:
+            return conn.execute(
+                'SELECT id, user_id, username, role, expires_at FROM sessions WHERE id = ?',
+                (session_id,)
+            ).fetchone()
+
+    def delete_session(self, session_id):
+        """Remove a persisted session"""
+        with self.connection() as conn:
+            conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+    def delete_expired_sessions(self, now):
+        """Remove persisted sessions that expired at or before now, returning how many"""
+        with self.connection() as conn:
+            return conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,)).rowcount
+
+    def page_stored_payloads(self, after='', limit=100):
+        """Get the next document payloads in storage key order
+
+        Rows are (storage_key, file_hash, cipher_hash, cipher_size): current
+        payloads from documents and older ones (whole blobs or version
+        manifests) from document_versions, where a manifest's ciphertext
+        digest is recorded. Each payload is listed once however many
+        documents reference it. Both walks follow a file_path index, so
+        resuming after a key never rescans earlier ones.
+        """
+        with self.connection() as conn:
+            current = conn.execute('''
+                SELECT file_path, MIN(file_hash), NULL, NULL
+                FROM documents
+                WHERE file_path > ?
+                GROUP BY file_path
+                ORDER BY file_path
+                LIMIT ?
+            ''', (after, limit)).fetchall()
+            versions = conn.execute('''
+                SELECT file_path, MIN(file_hash), MAX(cipher_hash), MAX(cipher_size)
+                FROM document_versions
+                WHERE file_path > ?
+                GROUP BY file_path
+                ORDER BY file_path
+                LIMIT ?
+            ''', (after, limit)).fetchall()
+
+        # The current version of a versioned document is in both; keep its digest
+        payloads = {row[0]: row for row in current}
+        payloads.update((row[0], row) for row in versions)
+        return [payloads[key] for key in sorted(payloads)[:limit]]
+
+    def page_chunk_hashes(self, after='', limit=100):
+        """Get the next distinct chunk blob hashes referenced by document versions, in order"""
+        with self.connection() as conn:
+            return [row[0] for row in conn.execute('''
+                SELECT DISTINCT chunk_hash FROM version_chunks
+                WHERE chunk_hash > ?
+                ORDER BY chunk_hash
+                LIMIT ?
+            ''', (after, limit))]
+
+    def get_scrub_results(self, storage_keys):
+        """Get the last scrub result for several payloads, keyed by storage key"""
+        storage_keys = list(storage_keys)
+        results = {}
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(storage_keys), 500):
+                batch = storage_keys[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                cursor.execute(f'SELECT * FROM scrub_results WHERE storage_key IN ({placeholders})',
+                               batch)
+                for result in cursor.fetchall():
+                    results[result[0]] = result
+
+        return results
+
+    def record_scrub_results(self, results):
+        """Store (storage_key, status, detail, cipher_hash, size, checked_at) rows"""
+        with self.connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO scrub_results
+                    (storage_key, status, detail, cipher_hash, size, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', results)
+
+    def prune_scrub_results(self):
+        """Drop results for payloads no document or version references any more"""
+        with self.connection() as conn:
+            # Chunk blobs are stored under storage.blob_key(<hash>)
+            return conn.execute(f'''
+                DELETE FROM scrub_results
+                WHERE storage_key NOT IN (SELECT file_path FROM documents)
+                  AND storage_key NOT IN (SELECT file_path FROM document_versions)
+                  AND substr(storage_key, {BLOB_KEY_PREFIX_LENGTH + 1})
+                      NOT IN (SELECT chunk_hash FROM version_chunks)
+            ''').rowcount
+
+    def count_scrub_results(self):
+        """Count scrubbed payloads by status"""
+        with self.connection() as conn:
+            return dict(conn.execute(
+                'SELECT status, COUNT(*) FROM scrub_results GROUP BY status'
+            ).fetchall())
+
+    def get_scrub_failures(self, statuses, limit=100):
+        """Get failed payloads with the documents they back, most recently checked first
+
+        A payload backs a document as its current version, an older version
+        or a chunk of one. Rows are (storage_key, status, detail,
+        checked_at, document_count, document IDs as a comma separated
+        string).
+        """
+        placeholders = ', '.join('?' * len(statuses))
+        failed = f"FROM scrub_results s {{join}} WHERE s.status IN ({placeholders})"
+        chunk_join = ('JOIN version_chunks c '
+                      f'ON c.chunk_hash = substr(s.storage_key, {BLOB_KEY_PREFIX_LENGTH + 1})')
+        with self.connection() as conn:
+            return conn.execute(f'''
+                SELECT storage_key, status, detail, checked_at,
+                       COUNT(DISTINCT document_id), GROUP_CONCAT(DISTINCT document_id)
+                FROM (
+                    SELECT s.*, d.id AS document_id
+                    {failed.format(join='JOIN documents d ON d.file_path = s.storage_key')}
+                    UNION ALL
+                    SELECT s.*, v.document_id
+                    {failed.format(join='JOIN document_versions v ON v.file_path = s.storage_key')}
+                    UNION ALL
+                    SELECT s.*, c.document_id
+                    {failed.format(join=chunk_join)}
+                )
+                GROUP BY storage_key
+                ORDER BY checked_at DESC
+                LIMIT ?
+            ''', list(statuses) * 3 + [limit]).fetchall()
\ No newline at end of file
@@ -1,100 +1,560 @@
 import os
+import json
+import uuid
 import base64
-from database import Database
-from crypto import CryptoManager
+import hashlib
+import shutil
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque, namedtuple
+from database import Database, DocumentVersion
+from crypto import CryptoManager, FORMAT_SEGMENTED
+from storage import blob_key, create_storage
+from chunking import chunk_stream, read_blocks
+from compression import (CODEC_NONE, CODEC_ZLIB, SAMPLE_SIZE, choose_codec, compress_stream,
+                         decompress_stream)
+from search import DocumentSearch, extract_file_text, extract_text
+from access import ACCESS_OWNER, ACCESS_SHARED, get_access_control
+import metrics
+
+
+# Shares made before per-recipient keys existed have no key for the recipient
+MISSING_KEY_MESSAGE = "No key has been shared with you for this document; ask the owner to share it again"
+
+# Result of storing a file's content, before its document row is written.
+# text is what goes into the search index besides the filename; cipher_hash
+# and cipher_size describe the ciphertext written to staged_key, or are all
+# None if the content was already stored.
+PreparedUpload = namedtuple(
+    'PreparedUpload',
+    ['filename', 'storage_key', 'file_hash', 'encrypted_key_b64', 'size', 'codec', 'text',
+     'cipher_hash', 'cipher_size', 'staged_key'],
+    defaults=('', None, None, None)
+)
+
+# Chunked versions are stored as an encrypted manifest under this prefix,
+# listing the version's chunks in order as [chunk hash, base64 chunk key,
+# size, codec]; the chunks themselves are ordinary content-addressed blobs
+MANIFEST_PREFIX = 'manifests/'
+MANIFEST_FORMAT = 1
+
+# Chunks looked up in the blob store per query while storing a version
+CHUNK_LOOKUP_BATCH = 64
+
+# Result of chunking and staging a new version's content. entries is the
+# manifest; blobs holds one staged blob per distinct chunk, for publish_blobs.
+StoredChunks = namedtuple(
+    'StoredChunks',
+    ['entries', 'file_hash', 'size', 'codec', 'blobs']
+)
+
+
+def staged_blob(upload):
+    """Return a PreparedUpload's blob as DocumentManager.publish_blobs takes it"""
+    return (upload.file_hash, upload.size, upload.codec, upload.cipher_hash, upload.cipher_size,
+            upload.staged_key)
+
+
+def hash_chunks(chunks, hasher):
+    """Yield chunks unchanged while feeding them to a hash object"""
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
 
 
 class DocumentManager:
-    def __init__(self):
+    def __init__(self, storage=None):
         self.db = Database()
         self.crypto = CryptoManager()
         self.upload_dir = "uploads"
-        self.ensure_upload_dir()
+        # Encrypted payloads go through a storage backend; documents.file_path
+        # holds the backend key
+        self.storage = storage or create_storage(self.upload_dir)
+        # 'auto' picks a codec per document from a sample; or force one codec
+        self.compression = 'auto'
+        self.search_index = DocumentSearch(self.db)
+        # Cached per-user access checks, shared by every manager on this database
+        self.access = get_access_control(self.db)
+        # Index extracted text as well as filenames. The index is stored
+        # unencrypted in the database, so turn this off for sensitive data.
+        self.index_content = True
+        # Chunks fetched ahead of the one being decrypted when reading a chunked version
+        self.chunk_readahead = 4
 
-    def ensure_upload_dir(self):
-        """Create upload directory if it doesn't exist"""
-        if not os.path.exists(self.upload_dir):
-            os.makedirs(self.upload_dir)
+    def blob_key(self, file_hash):
+        """Return the content-addressed storage key for a blob (see storage.blob_key)"""
+        return blob_key(file_hash)
 
-    def upload_document(self, file_path, owner_id, owner_public_key):
-        """Upload and encrypt a document"""
+    @metrics.timed('document.upload', status_result=True)
+    def upload_document(self, file_path, owner_id, owner_public_key, stream=True, filename=None):
+        """Upload and encrypt a document
+
+        Content is stored once per unique plaintext in the blob store. With
+        stream=True the file is read, compressed and encrypted in fixed-size
+        chunks straight into the store, so memory use does not grow with the
+        file size. filename overrides the name recorded for the document.
+        """
         if not os.path.exists(file_path):
             return False, "File not found"
 
         try:
-            # Generate AES key for document encryption
-            aes_key = self.crypto.generate_aes_key()
+            if stream:
+                upload = self.prepare_upload(file_path, owner_public_key, filename)
+            else:
+                filename = filename or os.path.basename(file_path)
+
+                # Read file content
+                with open(file_path, 'rb') as f:
+                    file_data = f.read()
+
+                # Calculate file hash for integrity verification and addressing
+                file_hash = self.crypto.calculate_data_hash(file_data)
+                aes_key = self.crypto.calculate_data_content_key(file_data)
+                storage_key = self.blob_key(file_hash)
+
+                # Compress, encrypt and store the content unless it is already present
+                blob = self.stored_blob(file_hash)
+                cipher_hash = cipher_size = staged_key = None
+                if blob:
+                    codec = blob[4]  # codec
+                else:
+                    codec = self.choose_codec(filename, file_data[:SAMPLE_SIZE])
+                    compressed_data = b"".join(compress_stream([file_data], codec))
+                    encrypted_data = self.crypto.encrypt_with_aes(compressed_data, aes_key)
+                    staged_key = self.staging_key(storage_key)
+                    self.storage.put(staged_key, [encrypted_data])
+                    cipher_hash = hashlib.sha256(encrypted_data).hexdigest()
+                    cipher_size = len(encrypted_data)
+
+                # Encrypt AES key with owner's RSA public key
+                encrypted_aes_key = self.crypto.encrypt_with_rsa(owner_public_key, aes_key)
+                encrypted_key_b64 = base64.b64encode(encrypted_aes_key).decode('utf-8')
+
+                text = extract_text(file_data) if self.index_content else ''
+                upload = PreparedUpload(filename, storage_key, file_hash, encrypted_key_b64,
+                                        len(file_data), codec, text, cipher_hash, cipher_size,
+                                        staged_key)
+
+            document_id = self.record_upload(upload, owner_id)
+            return True, f"Document uploaded successfully (ID: {document_id})"
+
+        except Exception as e:
+            return False, f"Upload failed: {str(e)}"
+
+    @metrics.timed('document.record_upload')
+    def record_upload(self, upload, owner_id):
+        """Store document metadata, the blob reference and the search entry together
+
+        Returns the new document ID.
+        """
+        published = []
+        try:
+            with self.db.connection():
+                (blob,) = self.publish_blobs([staged_blob(upload)], published)
+                self.db.add_blob_references([blob])
+                document_id = self.db.add_document(
+                    upload.filename, upload.storage_key, upload.file_hash,
+                    upload.encrypted_key_b64, owner_id, blob[2]  # codec
+                )
+                self.db.index_documents([(document_id, upload.filename, upload.text)])
+        except Exception:
+            self.discard_payloads([upload.staged_key], published)
+            raise
+
+        self.access.invalidate(document_id)
+        return document_id
+
+    def staging_key(self, storage_key):
+        """Return a fresh key to write a payload to before it is published under storage_key"""
+        return f"{storage_key}.{uuid.uuid4().hex}.part"
+
+    def publish_blobs(self, blobs, published):
+        """Move staged payloads into the blob store, returning the blob references to record
+
+        blobs are (hash, size, codec, cipher_hash, cipher_size, staged_key),
+        with staged_key None when nothing was written. This must run inside
+        the transaction that records the references: the blob rows are read
+        under the database write lock, so of several uploads of the same new
+        content exactly one moves its payload into place and records its
+        digest and codec, and the others discard theirs and reference it.
+        Storage keys moved into place are appended to published.
+
+        Returns (hash, size, codec, cipher_hash, cipher_size) rows for
+        add_blob_references, each with the codec of the payload actually
+        stored.
+        """
+        blobs = list(blobs)
+        rows = self.db.lock_blobs({blob[0] for blob in blobs})
+        codecs = {file_hash: row[4] for file_hash, row in rows.items()}  # codec
+        moved = set()
+        references = []
+
+        for file_hash, size, codec, cipher_hash, cipher_size, staged_key in blobs:
+            storage_key = self.blob_key(file_hash)
+            if staged_key is None:
+                references.append((file_hash, size, codecs.get(file_hash, codec), None, None))
+            elif file_hash in moved or (file_hash in rows and self.storage.exists(storage_key)):
+                # Another upload stored this content first
+                self.storage.delete(staged_key)
+                references.append((file_hash, size, codecs[file_hash], None, None))
+            else:
+                self.storage.move(staged_key, storage_key)
+                published.append(storage_key)
+                moved.add(file_hash)
+                codecs[file_hash] = codec
+                references.append((file_hash, size, codec, cipher_hash, cipher_size))
+
+        return references
 
-            # Read file content
+    def discard_payloads(self, staged_keys, published):
+        """Clean up after an upload that was not recorded
+
+        Staged payloads are deleted, and so are payloads published by the
+        failed transaction unless a blob row references them by now.
+        """
+        for staged_key in staged_keys:
+            if staged_key is not None:
+                self.storage.delete(staged_key)
+        referenced = self.db.get_blobs(storage_key.rsplit('/', 1)[1] for storage_key in published)
+        for storage_key in published:
+            if storage_key.rsplit('/', 1)[1] not in referenced:
+                self.storage.delete(storage_key)
+
+    def stored_blob(self, file_hash):
+        """Return the blob row if its payload is already in the store, else None"""
+        blob = self.db.get_blob(file_hash)
+        if blob is not None and self.storage.exists(self.blob_key(file_hash)):
+            return blob
+        return None
+
+    def choose_codec(self, filename, sample):
+        """Pick the compression codec for new content per self.compression"""
+        if self.compression == 'auto':
+            return choose_codec(filename, sample)
+        return self.compression
+
+    @metrics.timed('document.prepare_upload')
+    def prepare_upload(self, file_path, owner_public_key, filename=None):
+        """Store a file's encrypted content without recording a document
+
+        The file is hashed first; content that is already in the blob store
+        is not compressed, encrypted or written again. New content is written
+        to a staging key and only published into the blob store by
+        record_upload. The AES key is derived
+        from the content, so every copy of the same plaintext maps to the same
+        blob, and is wrapped with the owner's RSA key as before.
+
+        Returns a PreparedUpload with everything add_document needs plus the
+        plaintext size. filename defaults to the file's base name.
+        """
+        file_hash, aes_key = self.crypto.calculate_content_hash_and_key(file_path)
+
+        filename = filename or os.path.basename(file_path)
+        storage_key = self.blob_key(file_hash)
+
+        blob = self.stored_blob(file_hash)
+        cipher_hash = cipher_size = staged_key = None
+        if blob:
+            codec = blob[4]  # codec
+        else:
             with open(file_path, 'rb') as f:
-                file_data = f.read()
+                codec = self.choose_codec(filename, f.read(SAMPLE_SIZE))
+
+            # Published under storage_key when the document is recorded
+            staged_key = self.staging_key(storage_key)
+            stored_hash, cipher_hash, cipher_size = self.encrypt_file_to_storage(
+                file_path, staged_key, aes_key, codec
+            )
+            if stored_hash != file_hash:
+                self.storage.delete(staged_key)
+                raise ValueError("File changed while it was being uploaded")
+
+        # Encrypt AES key with owner's RSA public key
+        encrypted_aes_key = self.crypto.encrypt_with_rsa(owner_public_key, aes_key)
+        encrypted_key_b64 = base64.b64encode(encrypted_aes_key).decode('utf-8')
+
+        text = extract_file_text(file_path) if self.index_content else ''
+        return PreparedUpload(filename, storage_key, file_hash, encrypted_key_b64,
+                              os.path.getsize(file_path), codec, text, cipher_hash, cipher_size,
+                              staged_key)
+
+    def collect_upload_paths(self, source):
+        """Expand a directory or a manifest file into a list of file paths
+
+        A directory is walked recursively; any other file is read as a
+        manifest with one path per line (blank lines and # comments ignored).
+        """
+        if os.path.isdir(source):
+            paths = []
+            for root, _, files in os.walk(source):
+                for name in sorted(files):
+                    paths.append(os.path.join(root, name))
+            return paths
+
+        with open(source, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f
+                    if line.strip() and not line.lstrip().startswith('#')]
 
-            # Encrypt file content with AES
-            encrypted_data = self.crypto.encrypt_with_aes(file_data, aes_key)
+    @metrics.timed('document.batch_upload')
+    def batch_upload(self, file_paths, owner_id, owner_public_key, workers=None, batch_size=500):
+        """Upload many documents, encrypting them in parallel
 
-            # Encrypt AES key with owner's RSA public key
-            encrypted_aes_key = self.crypto.encrypt_with_rsa(owner_public_key, aes_key)
+        Files are encrypted and hashed on a thread pool (pycryptodome and
+        hashlib release the GIL on large buffers) and their metadata is
+        committed in batches of batch_size rows. Returns a report dict with
+        per-file results as (path, success, message) and aggregate
+        throughput.
+        """
+        started = time.perf_counter()
+        results = []
+        pending_rows = []
+        pending_blobs = []
+        pending_paths = []
+        pending_text = []
+        total_bytes = 0
 
-            # Calculate file hash for integrity verification
-            file_hash = self.crypto.calculate_data_hash(file_data)
+        def flush():
+            published = []
+            try:
+                with self.db.connection():
+                    blobs = self.publish_blobs(pending_blobs, published)
+                    self.db.add_blob_references(blobs)
+                    # Record each document with the codec of the payload actually stored
+                    rows = [row[:5] + (blob[2],) for row, blob in zip(pending_rows, blobs)]
+                    document_ids = self.db.add_documents(rows)
+                    self.db.index_documents(
+                        (document_id, row[0], text)  # filename
+                        for document_id, row, text in zip(document_ids, pending_rows, pending_text)
+                    )
+                for path, document_id in zip(pending_paths, document_ids):
+                    self.access.invalidate(document_id)
+                    results.append((path, True, f"Uploaded (ID: {document_id})"))
+            except Exception as e:
+                self.discard_payloads([blob[5] for blob in pending_blobs], published)  # staged_key
+                for path in pending_paths:
+                    results.append((path, False, f"Upload failed: {str(e)}"))
+            pending_rows.clear()
+            pending_blobs.clear()
+            pending_paths.clear()
+            pending_text.clear()
 
-            # Save encrypted file
-            filename = os.path.basename(file_path)
-            encrypted_filename = f"encrypted_{filename}"
-            encrypted_file_path = os.path.join(self.upload_dir, encrypted_filename)
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = {
+                executor.submit(self.prepare_upload, path, owner_public_key): path
+                for path in file_paths
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    upload = future.result()
+                except Exception as e:
+                    results.append((path, False, f"Upload failed: {str(e)}"))
+                    continue
 
-            with open(encrypted_file_path, 'wb') as f:
-                f.write(encrypted_data)
+                total_bytes += upload.size
+                pending_rows.append((upload.filename, upload.storage_key, upload.file_hash,
+                                     upload.encrypted_key_b64, owner_id, upload.codec))
+                pending_blobs.append(staged_blob(upload))
+                pending_paths.append(path)
+                pending_text.append(upload.text)
+                if len(pending_rows) >= batch_size:
+                    flush()
 
-            # Store document metadata in database
-            encrypted_key_b64 = base64.b64encode(encrypted_aes_key).decode('utf-8')
-            document_id = self.db.add_document(
-                filename, encrypted_file_path, file_hash, encrypted_key_b64, owner_id
+        if pending_rows:
+            flush()
+
+        elapsed = time.perf_counter() - started
+        succeeded = sum(1 for _, ok, _ in results if ok)
+        return {
+            'results': results,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'bytes': total_bytes,
+            'seconds': elapsed,
+            'mb_per_sec': total_bytes / (1024 * 1024) / elapsed if elapsed else 0.0,
+        }
+
+    def encrypt_file_to_storage(self, file_path, storage_key, aes_key, codec=CODEC_NONE):
+        """Stream-encrypt a file into the storage backend
+
+        The file is compressed with codec and written in the segmented
+        AES-GCM container format; the plaintext and ciphertext hashes are
+        computed in the same pass. Ciphertext is produced while the backend
+        writes it, so encryption overlaps with storage I/O. Returns
+        (plaintext SHA-256, ciphertext SHA-256, ciphertext size).
+        """
+        sha256_hash = hashlib.sha256()
+        cipher_hash = hashlib.sha256()
+        chunks = metrics.timed_iter('file.read', self.crypto.read_file_chunks(file_path, sha256_hash))
+        chunks = metrics.timed_iter('compression.compress', compress_stream(chunks, codec))
+        chunks = metrics.timed_iter('crypto.encrypt', self.crypto.encrypt_stream_segmented(chunks, aes_key))
+        with metrics.span('storage.put'):
+            cipher_size = self.storage.put(storage_key, hash_chunks(chunks, cipher_hash))
+        return sha256_hash.hexdigest(), cipher_hash.hexdigest(), cipher_size
+
+    def decrypted_chunks(self, storage_key, aes_key, codec=CODEC_NONE):
+        """Yield the plaintext of a stored payload: read, decrypt and decompress as one pipeline
+
+        A version manifest is followed to its chunks, which carry their own codecs.
+        """
+        if self.is_manifest_key(storage_key):
+            return self.manifest_chunks(storage_key, aes_key)
+        chunks = metrics.timed_iter('storage.read', self.storage.stream(storage_key))
+        chunks = metrics.timed_iter('crypto.decrypt', self.crypto.decrypt_stream(chunks, aes_key))
+        return metrics.timed_iter('compression.decompress', decompress_stream(chunks, codec))
+
+    def is_manifest_key(self, storage_key):
+        """Check whether a storage key holds a chunked version's manifest"""
+        return storage_key.startswith(MANIFEST_PREFIX)
+
+    def payload_key(self, document, document_key):
+        """Return the AES key of a document's current payload from its unwrapped key
+
+        Until a document has a second version the wrapped key is the
+        payload key itself; after that the payload key is sealed under it.
+        """
+        if document[8] is None:  # sealed_key
+            return document_key
+        return self.crypto.open_sealed_key(document[8], document_key, document[2])  # file_path
+
+    def read_manifest(self, storage_key, aes_key):
+        """Return the [chunk hash, base64 key, size, codec] entries of a version manifest"""
+        with metrics.span('storage.read') as current:
+            data = self.storage.get(storage_key)
+            current.bytes = len(data)
+        body = b"".join(decompress_stream([self.crypto.decrypt_with_aes(data, aes_key)], CODEC_ZLIB))
+        manifest = json.loads(body)
+        if manifest.get('format') != MANIFEST_FORMAT:
+            raise ValueError("Unsupported manifest format")
+        return manifest['chunks']
+
+    def write_manifest(self, storage_key, entries, aes_key):
+        """Compress, encrypt and store a version manifest, returning (ciphertext SHA-256, size)"""
+        body = json.dumps({'format': MANIFEST_FORMAT, 'chunks': entries},
+                          separators=(',', ':')).encode('utf-8')
+        cipher_hash = hashlib.sha256()
+        chunks = self.crypto.encrypt_stream_segmented(compress_stream([body], CODEC_ZLIB), aes_key)
+        with metrics.span('storage.put'):
+            size = self.storage.put(storage_key, hash_chunks(chunks, cipher_hash))
+        return cipher_hash.hexdigest(), size
+
+    def manifest_chunks(self, storage_key, aes_key):
+        """Yield the plaintext of a chunked version, fetching chunks ahead on a small pool"""
+        entries = self.read_manifest(storage_key, aes_key)
+
+        def fetch(chunk_hash):
+            with metrics.span('storage.read') as current:
+                data = self.storage.get(self.blob_key(chunk_hash))
+                current.bytes = len(data)
+            return data
+
+        def open_chunk(entry, fetched):
+            _, key, _, codec = entry
+            chunks = metrics.timed_iter(
+                'crypto.decrypt', self.crypto.decrypt_stream([fetched.result()], base64.b64decode(key))
             )
+            return metrics.timed_iter('compression.decompress', decompress_stream(chunks, codec))
 
-            return True, f"Document uploaded successfully (ID: {document_id})"
+        with ThreadPoolExecutor(max_workers=self.chunk_readahead) as executor:
+            fetches = deque()
+            for entry in entries:
+                fetches.append((entry, executor.submit(fetch, entry[0])))
+                if len(fetches) > self.chunk_readahead:
+                    yield from open_chunk(*fetches.popleft())
+            while fetches:
+                yield from open_chunk(*fetches.popleft())
 
-        except Exception as e:
-            return False, f"Upload failed: {str(e)}"
+    def read_manifest_range(self, storage_key, aes_key, offset, length):
+        """Decrypt plaintext[offset:offset + length] of a chunked version
+
+        Only the chunks covering the range are read, and each is checked
+        against its hash. Returns None if one does not match.
+        """
+        data = bytearray()
+        position = 0
+        for chunk_hash, key, size, codec in self.read_manifest(storage_key, aes_key):
+            if position >= offset + length:
+                break
+            if position + size > offset:
+                chunk = b"".join(self.decrypted_chunks(self.blob_key(chunk_hash), base64.b64decode(key), codec))
+                if hashlib.sha256(chunk).hexdigest() != chunk_hash:
+                    return None
+                data += chunk[max(offset - position, 0):offset + length - position]
+            position += size
+        return bytes(data)
+
+    def wrapped_key(self, document, user_id):
+        """Return the document's base64 AES key wrapped for user_id, or None
+
+        The owner's copy lives on the document row; each share recipient has
+        their own copy in document_keys.
+        """
+        if document[5] == user_id:  # owner_id
+            return document[4]  # encrypted_key
+        return self.db.get_document_key(document[0], user_id)
+
+    @metrics.timed('document.download', status_result=True)
+    def download_document(self, document_id, user_id, user_private_key, stream=True):
+        """Download and decrypt a document the user owns or has been shared
+
+        With stream=True the ciphertext is decrypted and hashed chunk by chunk
+        into a temporary file, which is renamed into place only after the hash
+        matches the stored one.
+        """
+        if not self.access.can_read(user_id, document_id):
+            return False, "Document not found or access denied"
 
-    def download_document(self, document_id, user_private_key):
-        """Download and decrypt a document"""
         document = self.db.get_document(document_id)
         if not document:
             return False, "Document not found"
 
+        encrypted_key_b64 = self.wrapped_key(document, user_id)
+        if encrypted_key_b64 is None:
+            return False, MISSING_KEY_MESSAGE
+
         try:
             # Extract document data
-            encrypted_file_path = document[2]  # file_path
-            encrypted_key_b64 = document[4]  # encrypted_key
+            storage_key = document[2]  # file_path
             original_filename = document[1]  # filename
+            stored_hash = document[3]  # file_hash
+            codec = document[7]  # codec
 
             # Decode encrypted AES key
             encrypted_aes_key = base64.b64decode(encrypted_key_b64)
 
             # Decrypt AES key with user's RSA private key
-            aes_key = self.crypto.decrypt_with_rsa(user_private_key, encrypted_aes_key)
+            aes_key = self.payload_key(
+                document, self.crypto.decrypt_with_rsa(user_private_key, encrypted_aes_key)
+            )
+
+            # Save decrypted file to downloads directory
+            download_dir = "downloads"
+            if not os.path.exists(download_dir):
+                os.makedirs(download_dir)
+
+            download_path = os.path.join(download_dir, f"decrypted_{original_filename}")
+
+            if stream or self.is_manifest_key(storage_key):
+                if not self.decrypt_file_to_download(
+                        storage_key, download_path, aes_key, stored_hash, codec):
+                    return False, "Integrity check failed: File may have been tampered with"
+                return True, f"Document downloaded to: {download_path}"
 
             # Read encrypted file content
-            with open(encrypted_file_path, 'rb') as f:
-                encrypted_data = f.read()
+            encrypted_data = self.storage.get(storage_key)
 
             # Decrypt file content with AES
             decrypted_data = self.crypto.decrypt_with_aes(encrypted_data, aes_key)
+            decrypted_data = b"".join(decompress_stream([decrypted_data], codec))
 
             # Verify integrity
             calculated_hash = self.crypto.calculate_data_hash(decrypted_data)
-            stored_hash = document[3]  # file_hash
 
             if calculated_hash != stored_hash:
                 return False, "Integrity check failed: File may have been tampered with"
 
-            # Save decrypted file to downloads directory
-            download_dir = "downloads"
-            if not os.path.exists(download_dir):
-                os.makedirs(download_dir)
-
-            download_path = os.path.join(download_dir, f"decrypted_{original_filename}")
             with open(download_path, 'wb') as f:
                 f.write(decrypted_data)
 
@@ -103,11 +563,558 @@ class DocumentManager:
         except Exception as e:
             return False, f"Download failed: {str(e)}"
 
-    def share_document_with_user(self, document_id, owner_id, target_username):
-        """Share a document with another user"""
-        # Check if document exists and belongs to owner
+    @metrics.timed('document.decrypt_to_file')
+    def decrypt_file_to_download(self, storage_key, download_path, aes_key, expected_hash,
+                                 codec=CODEC_NONE):
+        """Stream-decrypt and decompress a stored file, publishing it only if its hash matches
+
+        Returns False (leaving nothing behind) when the integrity check fails,
+        including when a segment fails authentication or the data is
+        truncated.
+        """
+        sha256_hash = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(download_path) or ".", prefix=".download_", suffix=".part"
+        )
+
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                try:
+                    for chunk in self.decrypted_chunks(storage_key, aes_key, codec):
+                        with metrics.span('hash.sha256', len(chunk)):
+                            sha256_hash.update(chunk)
+                        with metrics.span('file.write', len(chunk)):
+                            out.write(chunk)
+                except ValueError:
+                    verified = False
+                else:
+                    verified = sha256_hash.hexdigest() == expected_hash
+
+            if not verified:
+                os.remove(temp_path)
+                return False
+
+            os.replace(temp_path, download_path)
+            return True
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def open_document_stream(self, document_id, user_id, user_private_key):
+        """Open a document for streaming without writing it to disk
+
+        Returns (True, (filename, size, chunks)) where chunks is a generator of
+        plaintext pieces. The generator raises ValueError after the last piece
+        if a segment fails authentication or the hash does not match, so a
+        consumer must not treat the data as verified until it is exhausted.
+        """
+        if not self.access.can_read(user_id, document_id):
+            return False, "Document not found or access denied"
+
+        document = self.db.get_document(document_id)
+        if not document:
+            return False, "Document not found"
+
+        encrypted_key_b64 = self.wrapped_key(document, user_id)
+        if encrypted_key_b64 is None:
+            return False, MISSING_KEY_MESSAGE
+
+        try:
+            encrypted_aes_key = base64.b64decode(encrypted_key_b64)
+            aes_key = self.payload_key(
+                document, self.crypto.decrypt_with_rsa(user_private_key, encrypted_aes_key)
+            )
+        except Exception as e:
+            return False, f"Download failed: {str(e)}"
+
+        if self.is_manifest_key(document[2]):  # file_path
+            version = self.db.get_document_version(document_id)
+            size = version.size if version else None
+        else:
+            blob = self.db.get_blob(document[3])  # file_hash
+            size = blob[1] if blob else None  # size
+
+        def chunks():
+            sha256_hash = hashlib.sha256()
+            for chunk in self.decrypted_chunks(document[2], aes_key, document[7]):  # file_path, codec
+                with metrics.span('hash.sha256', len(chunk)):
+                    sha256_hash.update(chunk)
+                yield chunk
+            if sha256_hash.hexdigest() != document[3]:  # file_hash
+                raise ValueError("Integrity check failed: File may have been tampered with")
+
+        return True, (document[1], size, metrics.timed_iter('document.stream', chunks()))  # filename
+
+    def export_document_ids(self, user_id, scope):
+        """Lazily yield the IDs of a user's documents for a bulk export
+
+        scope is 'owned' for the user's own documents or 'shared' for those
+        shared with them.
+        """
+        if scope == 'owned':
+            rows = self.db.iter_user_documents(user_id)
+        elif scope == 'shared':
+            rows = self.db.iter_shared_documents(user_id)
+        else:
+            raise ValueError(f"Unknown export scope: {scope}")
+        return (row.id for row in rows)
+
+    @metrics.timed('document.batch_download')
+    def batch_download(self, document_ids, user_id, user_private_key, workers=None,
+                       archive_path=None):
+        """Decrypt and verify many documents in parallel
+
+        Access is checked for all documents up front, the private key is
+        imported once and the readable document rows are fetched in one
+        query. Each AES key is unwrapped up front, then the decryption and
+        hash checks run on a thread pool. Output goes to the downloads
+        directory as decrypted_<id>_<filename>. If archive_path is given,
+        the files are streamed into a single tar archive there instead.
+        Returns a report dict with per-document results as
+        (document_id, success, message) and aggregate throughput.
+        """
+        started = time.perf_counter()
+        download_dir = "downloads"
+        if not os.path.exists(download_dir):
+            os.makedirs(download_dir)
+
+        document_ids = list(document_ids)
+        levels = self.access.access_levels(user_id, document_ids)
+        documents = self.db.get_documents(
+            document_id for document_id in document_ids if levels[document_id]
+        )
+        shared_keys = self.db.get_document_keys(
+            user_id, [document_id for document_id in document_ids if levels[document_id] == ACCESS_SHARED]
+        )
+        results = []
+        jobs = []
+
+        try:
+            cipher, key_error = self.crypto.rsa_cipher(user_private_key), None
+        except Exception as e:
+            cipher, key_error = None, f"Download failed: {str(e)}"
+        for document_id in document_ids:
+            document = documents.get(document_id)
+            if not levels[document_id]:
+                results.append((document_id, False, "Document not found or access denied"))
+                continue
+            if not document:
+                results.append((document_id, False, "Document not found"))
+                continue
+            if levels[document_id] == ACCESS_OWNER:
+                encrypted_key_b64 = document[4]  # encrypted_key
+            else:
+                encrypted_key_b64 = shared_keys.get(document_id)
+            if encrypted_key_b64 is None:
+                results.append((document_id, False, MISSING_KEY_MESSAGE))
+                continue
+            if key_error:
+                results.append((document_id, False, key_error))
+                continue
+            try:
+                aes_key = self.payload_key(document, cipher.decrypt(base64.b64decode(encrypted_key_b64)))
+            except Exception as e:
+                results.append((document_id, False, f"Download failed: {str(e)}"))
+                continue
+            jobs.append((document, aes_key))
+
+        archive = staging_dir = None
+        if archive_path:
+            try:
+                archive = tarfile.open(archive_path, 'w|')
+            except OSError as e:
+                results.extend((document[0], False, f"Download failed: {str(e)}") for document, _ in jobs)
+                jobs = []
+        total_bytes = 0
+        integrity_failures = 0
+
+        def export(document, aes_key):
+            name = f"{document[0]}_{document[1]}"  # id, filename
+            target_dir = staging_dir or download_dir
+            target = os.path.join(target_dir, name if archive else f"decrypted_{name}")
+            verified = self.decrypt_file_to_download(
+                document[2], target, aes_key, document[3], document[7]  # file_path, file_hash, codec
+            )
+            return name, target, verified
+
+        try:
+            if archive:
+                staging_dir = tempfile.mkdtemp(dir=download_dir, prefix=".export_")
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+                futures = {executor.submit(export, document, aes_key): document[0]
+                           for document, aes_key in jobs}
+                for future in as_completed(futures):
+                    document_id = futures[future]
+                    try:
+                        name, target, verified = future.result()
+                    except Exception as e:
+                        results.append((document_id, False, f"Download failed: {str(e)}"))
+                        continue
+
+                    if not verified:
+                        integrity_failures += 1
+                        results.append((document_id, False,
+                                        "Integrity check failed: File may have been tampered with"))
+                        continue
+
+                    total_bytes += os.path.getsize(target)
+                    if archive:
+                        archive.add(target, arcname=name)
+                        os.remove(target)
+                        results.append((document_id, True, f"Added to {archive_path} as {name}"))
+                    else:
+                        results.append((document_id, True, f"Downloaded to: {target}"))
+        finally:
+            if archive:
+                archive.close()
+            if staging_dir:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+        elapsed = time.perf_counter() - started
+        succeeded = sum(1 for _, ok, _ in results if ok)
+        return {
+            'results': results,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'integrity_failures': integrity_failures,
+            'bytes': total_bytes,
+            'seconds': elapsed,
+            'mb_per_sec': total_bytes / (1024 * 1024) / elapsed if elapsed else 0.0,
+        }
+
+    @metrics.timed('document.read_range', status_result=True)
+    def read_document_range(self, document_id, user_id, user_private_key, offset, length):
+        """Decrypt part of a document without decrypting the whole file
+
+        For uncompressed segmented containers only the segments covering the
+        range are read, each authenticated on its own, and for chunked
+        versions only the chunks covering it. Compressed documents and
+        legacy CBC files are decrypted from the start and checked against
+        the stored hash instead.
+        """
+        if not self.access.can_read(user_id, document_id):
+            return False, "Document not found or access denied"
+
+        document = self.db.get_document(document_id)
+        if not document:
+            return False, "Document not found"
+
+        encrypted_key_b64 = self.wrapped_key(document, user_id)
+        if encrypted_key_b64 is None:
+            return False, MISSING_KEY_MESSAGE
+
+        try:
+            storage_key = document[2]  # file_path
+            encrypted_aes_key = base64.b64decode(encrypted_key_b64)
+            aes_key = self.payload_key(
+                document, self.crypto.decrypt_with_rsa(user_private_key, encrypted_aes_key)
+            )
+
+            if self.is_manifest_key(storage_key):
+                data = self.read_manifest_range(storage_key, aes_key, offset, length)
+                if data is None:
+                    return False, "Integrity check failed: File may have been tampered with"
+                return True, data
+
+            codec = document[7]  # codec
+
+            if codec == CODEC_NONE and \
+                    self.crypto.detect_format(self.storage.range(storage_key, 0, 5)) == FORMAT_SEGMENTED:
+                data = self.crypto.decrypt_range_segmented(
+                    lambda position, size: self.storage.range(storage_key, position, size),
+                    self.storage.size(storage_key), aes_key, offset, length
+                )
+                return True, data
+
+            sha256_hash = hashlib.sha256()
+            data = bytearray()
+            position = 0
+            for chunk in self.decrypted_chunks(storage_key, aes_key, codec):
+                sha256_hash.update(chunk)
+                start = max(offset - position, 0)
+                stop = min(offset + length - position, len(chunk))
+                if start < stop:
+                    data += chunk[start:stop]
+                position += len(chunk)
+
+            if sha256_hash.hexdigest() != document[3]:  # file_hash
+                return False, "Integrity check failed: File may have been tampered with"
+
+            return True, bytes(data)
+
+        except Exception as e:
+            return False, f"Read failed: {str(e)}"
+
+    def store_chunk(self, storage_key, chunk, aes_key, codec):
+        """Compress, encrypt and store one chunk, returning (ciphertext SHA-256, size)"""
+        cipher_hash = hashlib.sha256()
+        chunks = metrics.timed_iter('compression.compress', compress_stream([chunk], codec))
+        chunks = metrics.timed_iter('crypto.encrypt', self.crypto.encrypt_stream_segmented(chunks, aes_key))
+        with metrics.span('storage.put'):
+            size = self.storage.put(storage_key, hash_chunks(chunks, cipher_hash))
+        return cipher_hash.hexdigest(), size
+
+    @metrics.timed('document.store_chunks')
+    def store_chunks(self, blocks, filename, stored, staged=None, workers=None):
+        """Split content into content-defined chunks and stage the ones not in the blob store yet
+
+        blocks is the content as an iterable of byte strings. Each chunk is
+        a content-addressed blob with a key derived from its content, like a
+        whole upload, so a chunk already stored for any version or document
+        is neither encrypted nor written again. The blob table is trusted
+        for that; the scrubber reports chunks whose payload has gone
+        missing. New chunks are encrypted and written to staging keys on a
+        thread pool while the content is still being read, and are
+        published when the version is recorded. The staging keys are
+        appended to stored, so the caller can clean up if it is not.
+
+        staged maps chunk hash -> codec for chunks an earlier call in the
+        same upload already staged; they are not staged again, and new
+        chunks are added to it. Returns a StoredChunks.
+        """
+        file_hash = hashlib.sha256()
+        entries = []  # Manifest entries in file order
+        blobs = {}  # chunk hash -> [hash, size, codec, cipher_hash, cipher_size, staged_key]
+        pending = []  # (chunk hash, key, chunk) awaiting a blob store lookup
+        writes = deque()  # (chunk hash, future) for chunks being stored
+        staged = {} if staged is None else staged
+        workers = workers or os.cpu_count()
+        codec = None
+        size = 0
+
+        def finish_write():
+            chunk_hash, future = writes.popleft()
+            blobs[chunk_hash][3:5] = future.result()  # cipher_hash, cipher_size
+
+        def store_pending(executor):
+            existing = self.db.get_blobs({chunk_hash for chunk_hash, _, _ in pending
+                                          if chunk_hash not in blobs and chunk_hash not in staged})
+            for chunk_hash, key, chunk in pending:
+                if chunk_hash not in blobs:
+                    blob = existing.get(chunk_hash)
+                    if chunk_hash in staged:
+                        blobs[chunk_hash] = [chunk_hash, len(chunk), staged[chunk_hash], None, None, None]
+                    elif blob is not None:
+                        blobs[chunk_hash] = [chunk_hash, len(chunk), blob[4], None, None, None]  # codec
+                    else:
+                        staged_key = self.staging_key(self.blob_key(chunk_hash))
+                        staged[chunk_hash] = codec
+                        blobs[chunk_hash] = [chunk_hash, len(chunk), codec, None, None, staged_key]
+                        stored.append(staged_key)
+                        writes.append((chunk_hash, executor.submit(
+                            self.store_chunk, staged_key, chunk, key, codec)))
+                entries.append([chunk_hash, base64.b64encode(key).decode('utf-8'), len(chunk),
+                                blobs[chunk_hash][2]])  # codec
+            pending.clear()
+            # Bound the chunks held in memory while they wait to be written
+            while len(writes) > workers * 2:
+                finish_write()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for chunk in metrics.timed_iter('chunking.split', chunk_stream(hash_chunks(blocks, file_hash))):
+                if codec is None:
+                    codec = self.choose_codec(filename, chunk[:SAMPLE_SIZE])
+                size += len(chunk)
+                with metrics.span('hash.sha256', len(chunk)):
+                    chunk_hash = hashlib.sha256(chunk).hexdigest()
+                    key = self.crypto.calculate_data_content_key(chunk)
+                pending.append((chunk_hash, key, chunk))
+                if len(pending) >= CHUNK_LOOKUP_BATCH:
+                    store_pending(executor)
+            store_pending(executor)
+            while writes:
+                finish_write()
+
+        return StoredChunks(entries, file_hash.hexdigest(), size, codec or CODEC_NONE,
+                            [tuple(blob) for blob in blobs.values()])
+
+    def first_version(self, document):
+        """Describe the original upload of a document that has no versions yet as its version 1"""
+        storage_key = document[2]  # file_path
+        file_hash = document[3]  # file_hash
+        blob = self.db.get_blob(file_hash) if storage_key == self.blob_key(file_hash) else None
+        return DocumentVersion(
+            document[0], 1, storage_key, file_hash,
+            blob[1] if blob else None, document[7], None, 0,  # size, codec
+            blob[6] if blob else None, None, None, document[6]  # cipher_size, uploaded_at
+        )
+
+    @metrics.timed('document.upload_version', status_result=True)
+    def upload_version(self, document_id, file_path, owner_id, owner_private_key):
+        """Store a file as the next version of a document the user owns
+
+        The new version is split into content-defined chunks and only the
+        chunks that no stored version already has are encrypted and written,
+        so a small edit to a large file costs about one chunk per edit plus
+        a manifest listing the chunks (encrypted under a fresh version key).
+        Earlier versions are kept and stay readable with download_version.
+
+        The first new version also splits the original upload into chunks,
+        which replace its whole-file payload, so that version already only
+        stores what changed. It turns the document key into a random key of
+        its own as well, rewrapped for the owner and every recipient, with
+        each version's key sealed under it: a key derived from one version's
+        content then never opens another. Sharing is unchanged, and gives
+        access to every version.
+        """
+        if not os.path.exists(file_path):
+            return False, "File not found"
+
+        if not self.access.is_owner(owner_id, document_id):
+            return False, "Document not found or access denied"
+
         document = self.db.get_document(document_id)
-        if not document or document[5] != owner_id:  # owner_id is at index 5
+        if not document:
+            return False, "Document not found or access denied"
+
+        stored = []  # Staging and manifest keys written, removed if the version is not recorded
+        published = []
+        staged = {}
+        removed = []
+        try:
+            document_key = self.crypto.decrypt_with_rsa(owner_private_key, base64.b64decode(document[4]))
+            versions = []  # (StoredChunks, manifest key, version key) for each version to record
+            if document[8] is None:  # sealed_key: only the original upload so far
+                original = self.store_chunks(
+                    self.decrypted_chunks(document[2], document_key, document[7]),  # file_path, codec
+                    document[1], stored, staged  # filename
+                )
+                if original.file_hash != document[3]:  # file_hash
+                    raise ValueError("Integrity check failed: the original upload may have been tampered with")
+                versions.append((original, f"{MANIFEST_PREFIX}{document_id}/{uuid.uuid4().hex}",
+                                 self.crypto.generate_aes_key()))
+
+                document_key = self.crypto.generate_aes_key()
+                owner = self.db.get_user_by_id(owner_id)
+                wrapped_key = base64.b64encode(
+                    self.crypto.encrypt_with_rsa(owner[4], document_key)  # public_key
+                ).decode('utf-8')
+                recipient_keys = [
+                    (user_id, base64.b64encode(self.crypto.encrypt_with_rsa(public_key, document_key)).decode('utf-8'))
+                    for user_id, public_key in self.db.get_key_recipients(document_id)
+                ]
+
+            chunks = self.store_chunks(metrics.timed_iter('file.read', read_blocks(file_path)),
+                                       document[1], stored, staged)  # filename
+            versions.append((chunks, f"{MANIFEST_PREFIX}{document_id}/{uuid.uuid4().hex}",
+                             self.crypto.generate_aes_key()))
+            text = extract_file_text(file_path) if self.index_content else ''
+
+            with self.db.connection():
+                blobs = self.publish_blobs([blob for version in versions for blob in version[0].blobs],
+                                           published)
+                self.db.add_blob_references(blobs)
+                codecs = {blob[0]: blob[2] for blob in blobs}
+
+                for stored_chunks, manifest_key, version_key in versions:
+                    version_blobs = blobs[:len(stored_chunks.blobs)]
+                    blobs = blobs[len(stored_chunks.blobs):]
+                    # The manifest names the codec of each chunk actually stored
+                    for entry in stored_chunks.entries:
+                        entry[3] = codecs[entry[0]]
+                    stored.append(manifest_key)
+                    cipher_hash, cipher_size = self.write_manifest(manifest_key, stored_chunks.entries,
+                                                                   version_key)
+                    new_blobs = [blob for blob in version_blobs if blob[3] is not None]  # cipher_hash
+                    stored_bytes = sum(blob[4] for blob in new_blobs) + cipher_size  # cipher_size
+                    sealed_key = self.crypto.seal_key(version_key, document_key, manifest_key)
+                    version = self.db.add_document_version(
+                        document_id, manifest_key, stored_chunks.file_hash, stored_chunks.size,
+                        stored_chunks.codec, sealed_key, [blob[0] for blob in version_blobs],
+                        len(stored_chunks.entries), stored_bytes, cipher_hash, cipher_size,
+                        created_at=document[6] if stored_chunks is not chunks else None  # uploaded_at
+                    )
+
+                if len(versions) > 1:
+                    # The original upload is now stored as chunks
+                    self.db.rekey_document(document_id, wrapped_key, recipient_keys)
+                self.db.set_current_version(document_id, manifest_key, chunks.file_hash, chunks.codec,
+                                            sealed_key)
+                if len(versions) > 1:
+                    storage_key, file_hash = document[2], document[3]  # file_path, file_hash
+                    if storage_key == self.blob_key(file_hash):
+                        if self.db.release_blob(file_hash):
+                            removed.append(storage_key)
+                    elif self.db.count_documents_with_path(storage_key) == 0:
+                        # Pre-blob-store upload: the file may still back another row
+                        removed.append(storage_key)
+                self.db.reindex_document(document_id, document[1], text)  # filename
+        except Exception as e:
+            self.discard_payloads(stored, published)
+            return False, f"Upload failed: {str(e)}"
+
+        self.access.invalidate(document_id)
+        for storage_key in removed:
+            self.storage.delete(storage_key)
+        return True, (f"Version {version} uploaded: {len(new_blobs)} of {len(chunks.entries)} chunks "
+                      f"were new, {stored_bytes / 1024:.1f} KB stored")
+
+    def list_versions(self, document_id, user_id):
+        """List the versions of a document the user can read, oldest first"""
+        if not self.access.can_read(user_id, document_id):
+            return False, "Document not found or access denied"
+
+        document = self.db.get_document(document_id)
+        if not document:
+            return False, "Document not found"
+
+        if document[8] is None:  # sealed_key
+            return True, [self.first_version(document)]
+        return True, self.db.get_document_versions(document_id)
+
+    @metrics.timed('document.download_version', status_result=True)
+    def download_version(self, document_id, version, user_id, user_private_key):
+        """Download and decrypt one version of a document the user owns or has been shared
+
+        The file is written to downloads/decrypted_v<version>_<filename>.
+        """
+        if not self.access.can_read(user_id, document_id):
+            return False, "Document not found or access denied"
+
+        document = self.db.get_document(document_id)
+        if not document:
+            return False, "Document not found"
+
+        encrypted_key_b64 = self.wrapped_key(document, user_id)
+        if encrypted_key_b64 is None:
+            return False, MISSING_KEY_MESSAGE
+
+        if document[8] is None:  # sealed_key
+            stored_version = self.first_version(document) if version == 1 else None
+        else:
+            stored_version = self.db.get_document_version(document_id, version)
+        if stored_version is None:
+            return False, "Version not found"
+
+        try:
+            aes_key = self.crypto.decrypt_with_rsa(user_private_key, base64.b64decode(encrypted_key_b64))
+            if stored_version.sealed_key is not None:
+                aes_key = self.crypto.open_sealed_key(stored_version.sealed_key, aes_key,
+                                                      stored_version.file_path)
+
+            download_dir = "downloads"
+            if not os.path.exists(download_dir):
+                os.makedirs(download_dir)
+            download_path = os.path.join(download_dir, f"decrypted_v{version}_{document[1]}")  # filename
+
+            if not self.decrypt_file_to_download(stored_version.file_path, download_path, aes_key,
+                                                 stored_version.file_hash, stored_version.codec):
+                return False, "Integrity check failed: File may have been tampered with"
+            return True, f"Version {version} downloaded to: {download_path}"
+
+        except Exception as e:
+            return False, f"Download failed: {str(e)}"
+
+    @metrics.timed('document.share', status_result=True)
+    def share_document_with_user(self, document_id, owner_id, target_username, owner_private_key):
+        """Share a document with another user
+
+        The owner's copy of the document key is unwrapped and rewrapped for
+        the recipient's public key; the stored file is not touched, so this
+        costs one RSA decryption whatever the document size.
+        """
+        if not self.access.is_owner(owner_id, document_id):
             return False, "Document not found or access denied"
 
         # Get target user
@@ -115,16 +1122,172 @@ class DocumentManager:
         if not target_user:
             return False, "Target user not found"
 
+        document = self.db.get_document(document_id)
+        if not document:
+            return False, "Document not found or access denied"
+
+        try:
+            aes_key = self.crypto.decrypt_with_rsa(
+                owner_private_key, base64.b64decode(document[4])  # encrypted_key
+            )
+            recipient_key = self.crypto.encrypt_with_rsa(target_user[4], aes_key)  # public_key
+        except Exception as e:
+            return False, f"Share failed: {str(e)}"
+
         # Share document
-        if self.db.share_document(document_id, target_user[0]):  # user_id is at index 0
+        encrypted_key_b64 = base64.b64encode(recipient_key).decode('utf-8')
+        if self.db.share_document(document_id, target_user[0], encrypted_key_b64):  # user_id is at index 0
+            self.access.invalidate(document_id, target_user[0])
             return True, f"Document shared successfully with {target_username}"
         else:
             return False, "Document already shared with this user"
 
+    @metrics.timed('document.bulk_share')
+    def share_documents_with_users(self, document_ids, owner_id, target_usernames,
+                                   owner_private_key):
+        """Share many documents with many users in one transaction
+
+        Each document key is unwrapped once with the owner's key imported
+        once, then rewrapped for every recipient. Returns a report dict with
+        per-pair results as (document_id, username, success, message).
+        """
+        document_ids = list(dict.fromkeys(document_ids))
+        results = []
+        shares = []
+
+        recipients = []
+        for username in dict.fromkeys(target_usernames):
+            user = self.db.get_user(username)
+            if user is None:
+                results.extend((document_id, username, False, "Target user not found")
+                               for document_id in document_ids)
+            elif user[0] == owner_id:  # id
+                results.extend((document_id, username, False, "Cannot share a document with its owner")
+                               for document_id in document_ids)
+            else:
+                recipients.append(user)
+
+        levels = self.access.access_levels(owner_id, document_ids)
+        documents = self.db.get_documents(
+            document_id for document_id in document_ids if levels[document_id] == ACCESS_OWNER
+        )
+        try:
+            cipher, key_error = self.crypto.rsa_cipher(owner_private_key), None
+        except Exception as e:
+            cipher, key_error = None, f"Share failed: {str(e)}"
+
+        for document_id in document_ids:
+            document = documents.get(document_id)
+            if document is None:
+                results.extend((document_id, user[1], False, "Document not found or access denied")
+                               for user in recipients)  # username
+                continue
+            if key_error:
+                results.extend((document_id, user[1], False, key_error) for user in recipients)
+                continue
+            try:
+                aes_key = cipher.decrypt(base64.b64decode(document[4]))  # encrypted_key
+            except Exception as e:
+                results.extend((document_id, user[1], False, f"Share failed: {str(e)}")
+                               for user in recipients)
+                continue
+
+            for user in recipients:
+                try:
+                    recipient_key = self.crypto.encrypt_with_rsa(user[4], aes_key)  # public_key
+                except Exception as e:
+                    results.append((document_id, user[1], False, f"Share failed: {str(e)}"))
+                    continue
+                shares.append((document_id, user[0],
+                               base64.b64encode(recipient_key).decode('utf-8')))
+                results.append((document_id, user[1], True, f"Shared with {user[1]}"))
+
+        if shares:
+            try:
+                self.db.share_documents(shares)
+            except Exception as e:
+                results = [(document_id, username, False, f"Share failed: {str(e)}")
+                           if ok else (document_id, username, ok, message)
+                           for document_id, username, ok, message in results]
+            for document_id, user_id, _ in shares:
+                self.access.invalidate(document_id, user_id)
+
+        shared = sum(1 for _, _, ok, _ in results if ok)
+        return {'results': results, 'shared': shared, 'failed': len(results) - shared}
+
+    @metrics.timed('document.unshare', status_result=True)
+    def unshare_document_with_user(self, document_id, owner_id, target_username):
+        """Stop sharing a document with another user"""
+        if not self.access.is_owner(owner_id, document_id):
+            return False, "Document not found or access denied"
+
+        target_user = self.db.get_user(target_username)
+        if not target_user:
+            return False, "Target user not found"
+
+        removed = self.db.unshare_document(document_id, target_user[0])  # user_id is at index 0
+        self.access.invalidate(document_id, target_user[0])
+        if removed:
+            return True, f"Document is no longer shared with {target_username}"
+        return False, "Document is not shared with this user"
+
+    @metrics.timed('document.delete', status_result=True)
+    def delete_document(self, document_id, owner_id):
+        """Delete a document owned by owner_id with all its versions
+
+        Each stored payload or chunk is removed once no other document or
+        version references it; version manifests always are.
+        """
+        if not self.access.is_owner(owner_id, document_id):
+            return False, "Document not found or access denied"
+
+        document = self.db.get_document(document_id)
+        if not document:
+            return False, "Document not found or access denied"
+
+        # Once versioned, the version rows hold the references, the current one included
+        payloads = [(version.file_path, version.file_hash)
+                    for version in self.db.get_document_versions(document_id)]
+        payloads = payloads or [(document[2], document[3])]  # file_path, file_hash
+        chunk_hashes = self.db.get_version_chunk_hashes(document_id)
+        removed = []
+
+        with self.db.connection():
+            self.db.delete_document(document_id)
+            for storage_key, file_hash in payloads:
+                if self.is_manifest_key(storage_key):
+                    removed.append(storage_key)
+                elif storage_key == self.blob_key(file_hash):
+                    if self.db.release_blob(file_hash):
+                        removed.append(storage_key)
+                elif self.db.count_documents_with_path(storage_key) == 0:
+                    # Pre-blob-store upload: the file may still back another row
+                    removed.append(storage_key)
+            removed.extend(self.blob_key(chunk_hash) for chunk_hash in self.db.release_blobs(chunk_hashes))
+
+        self.access.invalidate(document_id)
+        for storage_key in dict.fromkeys(removed):
+            self.storage.delete(storage_key)
+
+        return True, "Document deleted successfully"
+
     def list_user_documents(self, user_id):
         """List all documents owned by user"""
         return self.db.get_user_documents(user_id)
 
     def list_shared_documents(self, user_id):
         """List all documents shared with user"""
-        return self.db.get_shared_documents(user_id)
\ No newline at end of file
+        return self.db.get_shared_documents(user_id)
+
+    def page_user_documents(self, user_id, page_size=50, after=None):
+        """Get one page of documents owned by user and the next-page cursor"""
+        return self.db.page_user_documents(user_id, page_size, after)
+
+    def page_shared_documents(self, user_id, page_size=50, after=None):
+        """Get one page of documents shared with user and the next-page cursor"""
+        return self.db.page_shared_documents(user_id, page_size, after)
+
+    @metrics.timed('document.search')
+    def search_documents(self, user_id, query, page_size=20, after=None):
+        """Get one page of ranked search results visible to user and the next-page cursor"""
+        return self.search_index.search(user_id, query, page_size, after)
\ No newline at end of file
@@ -0,0 +1,108 @@
+import os
+import queue
+import threading
+from crypto import CryptoManager
+
+
+class KeyPairPool:
+    """Pool of pre-generated RSA keypairs refilled in the background
+
+    Worker threads keep up to `size` keypairs ready so that registration only
+    has to take one off the queue. If the pool is ever drained, take() falls
+    back to generating a keypair inline rather than failing. A size of 0 or
+    less means no pool: no workers run and every keypair is generated inline.
+    """
+
+    def __init__(self, size=4, key_size=2048, workers=1):
+        self.size = size
+        self.key_size = key_size
+        self.workers = workers
+        self.served_from_pool = 0
+        self.generated_inline = 0
+        self._ready = queue.Queue(maxsize=max(size, 1))  # maxsize 0 would be unbounded
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _generate(self):
+        """Generate one keypair as (public_pem, private_pem) bytes"""
+        crypto = CryptoManager()
+        crypto.key_size = self.key_size
+        return crypto.generate_rsa_keypair()
+
+    def _refill(self):
+        """Worker loop: generate keypairs whenever there is room in the pool"""
+        while not self._stop.is_set():
+            keypair = self._generate()
+            while not self._stop.is_set():
+                try:
+                    self._ready.put(keypair, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def start(self):
+        """Start the background workers (no-op if already running)"""
+        with self._lock:
+            if self._threads or self.size <= 0:
+                return self
+            self._stop.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(
+                    target=self._refill, name=f"keypool-{number}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stop the background workers"""
+        self._stop.set()
+        with self._lock:
+            for thread in self._threads:
+                thread.join(timeout=5)
+            self._threads = []
+
+    def take(self):
+        """Return a ready keypair as (public_pem, private_pem) bytes"""
+        try:
+            keypair = self._ready.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.generated_inline += 1
+            return self._generate()
+
+        with self._lock:
+            self.served_from_pool += 1
+        return keypair
+
+    def stats(self):
+        """Return pool occupancy and how requests were served"""
+        with self._lock:
+            return {
+                'ready': self._ready.qsize(),
+                'size': self.size,
+                'key_size': self.key_size,
+                'served_from_pool': self.served_from_pool,
+                'generated_inline': self.generated_inline,
+            }
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """Return the process-wide keypair pool, starting it on first use
+
+    Pool size and key length come from SDMS_KEYPOOL_SIZE (0 turns the pool
+    off) and SDMS_KEY_SIZE.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = KeyPairPool(
+                size=int(os.environ.get('SDMS_KEYPOOL_SIZE', 4)),
+                key_size=int(os.environ.get('SDMS_KEY_SIZE', 2048)),
+            ).start()
+        return _default_pool
@@ -0,0 +1,226 @@
+"""
+Private keys encrypted at rest under a key derived from the user's password
+
+A sealed key is stored in users.private_key as
+
+    vault1$<kdf spec>$<salt>$<nonce>$<AES-GCM ciphertext + tag>
+
+where the kdf spec is the password hasher's "<algorithm>$<params>" string,
+so keys sealed under older parameters still open. The username is bound in
+as associated data, so a sealed key copied onto another account will not
+open there.
+"""
+
+import os
+import time
+import base64
+import secrets
+import threading
+from collections import OrderedDict
+from Crypto.Cipher import AES
+from Crypto.PublicKey import RSA
+from Crypto.Math.Numbers import Integer
+from passwords import PasswordHasher
+import metrics
+
+VAULT_PREFIX = 'vault1'
+SALT_SIZE = 16
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+# Private components of a pycryptodome RsaKey
+PRIVATE_COMPONENTS = ('_d', '_p', '_q', '_u', '_dp', '_dq', '_invq')
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def is_sealed(value):
+    """Check whether a stored private key is vault-encrypted rather than plaintext PEM"""
+    return isinstance(value, str) and value.startswith(VAULT_PREFIX + '$')
+
+
+def zeroize(buffer):
+    """Overwrite a bytearray in place"""
+    buffer[:] = bytes(len(buffer))
+
+
+def zeroize_key(key):
+    """Overwrite an RSA key's private components in place
+
+    Best effort: this clears the key object the vault handed out, but not
+    copies the interpreter or GMP may have made while it was in use.
+    """
+    for name in PRIVATE_COMPONENTS:
+        value = getattr(key, name, None)
+        if isinstance(value, Integer):
+            value.set(0)
+
+
+class _Unlocked:
+    """An unlocked private key and when it was last used"""
+
+    __slots__ = ('key', 'last_used')
+
+    def __init__(self, key, last_used):
+        self.key = key
+        self.last_used = last_used
+
+
+class KeyVault:
+    """Seal private keys under the user's password and hold unlocked ones per session
+
+    Opening a sealed key costs one password-strength KDF run, so it is done
+    once at login: unlock() returns a handle and the imported key stays in
+    a bounded in-memory cache, where every document operation picks it up
+    with key(handle) for the price of a dict lookup. An entry idle for
+    longer than idle_timeout is zeroized and dropped (the user then has to
+    log in again), as is the least recently used one when max_entries is
+    exceeded. lock() zeroizes a key on logout.
+    """
+
+    def __init__(self, hasher=None, idle_timeout=None, max_entries=10000):
+        self.hasher = hasher or PasswordHasher()
+        self.idle_timeout = idle_timeout or int(os.environ.get('SDMS_VAULT_IDLE_TIMEOUT', 30 * 60))
+        self.max_entries = max_entries
+        self.unlocks = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # handle -> _Unlocked, least recently used first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _associated_data(username):
+        return f"sdms-vault:{username}".encode('utf-8')
+
+    def seal(self, password, private_key, username):
+        """Encrypt a PEM private key (bytes) for storage"""
+        salt = os.urandom(SALT_SIZE)
+        spec, kek = self.hasher.derive_key(password, salt)
+        nonce = os.urandom(NONCE_SIZE)
+        cipher = AES.new(kek, AES.MODE_GCM, nonce=nonce)
+        cipher.update(self._associated_data(username))
+        ciphertext, tag = cipher.encrypt_and_digest(private_key)
+        return '$'.join([VAULT_PREFIX, spec, _b64encode(salt), _b64encode(nonce),
+                         _b64encode(ciphertext + tag)])
+
+    def open(self, password, sealed, username):
+        """Decrypt a sealed key, returning the PEM as a bytearray the caller should zeroize
+
+        Raises ValueError for a wrong password or a damaged or foreign key.
+        """
+        try:
+            prefix, *fields = sealed.split('$')
+            spec = '$'.join(fields[:-3])
+            salt, nonce, data = (_b64decode(field) for field in fields[-3:])
+        except (AttributeError, ValueError):
+            raise ValueError("Malformed sealed private key")
+        if prefix != VAULT_PREFIX or not spec or len(data) <= TAG_SIZE:
+            raise ValueError("Malformed sealed private key")
+
+        _, kek = self.hasher.derive_key(password, salt, spec)
+        cipher = AES.new(kek, AES.MODE_GCM, nonce=nonce)
+        cipher.update(self._associated_data(username))
+        pem = bytearray(len(data) - TAG_SIZE)
+        try:
+            cipher.decrypt_and_verify(data[:-TAG_SIZE], data[-TAG_SIZE:], output=pem)
+        except ValueError:
+            zeroize(pem)
+            raise ValueError("Wrong password or damaged private key")
+        return pem
+
+    def needs_reseal(self, sealed):
+        """Check whether a key was sealed under other than the current KDF parameters"""
+        return not sealed.startswith(f"{VAULT_PREFIX}${self.hasher.current_spec()}$")
+
+    @metrics.timed('vault.unlock')
+    def unlock(self, password, sealed, username):
+        """Open a sealed key and cache it for the session
+
+        Returns (handle, resealed): resealed is the key sealed again under
+        the current KDF parameters if the stored one is outdated, else None.
+        Raises ValueError if the key does not open.
+        """
+        pem = self.open(password, sealed, username)
+        try:
+            key = RSA.import_key(pem)
+            resealed = self.seal(password, pem, username) if self.needs_reseal(sealed) else None
+        finally:
+            zeroize(pem)
+
+        handle = secrets.token_urlsafe(18)
+        now = time.monotonic()
+        with self._lock:
+            self.unlocks += 1
+            self._entries[handle] = _Unlocked(key, now)
+            dropped = self._evict_locked(now)
+        for old in dropped:
+            zeroize_key(old)
+        return handle, resealed
+
+    def key(self, handle):
+        """Return the unlocked RsaKey for a handle, or None once it has been locked or evicted"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                return None
+            if now - entry.last_used >= self.idle_timeout:
+                del self._entries[handle]
+                self.evictions += 1
+                dropped = [entry.key]
+            else:
+                entry.last_used = now
+                self._entries.move_to_end(handle)
+                return entry.key
+        for old in dropped:
+            zeroize_key(old)
+        return None
+
+    def lock(self, handle):
+        """Zeroize and forget an unlocked key (on logout)"""
+        with self._lock:
+            entry = self._entries.pop(handle, None)
+        if entry is not None:
+            zeroize_key(entry.key)
+
+    def _evict_locked(self, now):
+        """Remove idle entries and any beyond max_entries; returns their keys for zeroizing"""
+        dropped = []
+        while self._entries:
+            handle, entry = next(iter(self._entries.items()))
+            if now - entry.last_used < self.idle_timeout and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[handle]
+            self.evictions += 1
+            dropped.append(entry.key)
+        return dropped
+
+    def evict_idle(self):
+        """Zeroize keys that have been idle past the timeout"""
+        with self._lock:
+            dropped = self._evict_locked(time.monotonic())
+        for old in dropped:
+            zeroize_key(old)
+
+    def clear(self):
+        """Zeroize every unlocked key"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            zeroize_key(entry.key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'unlocked': len(self._entries),
+                'max_entries': self.max_entries,
+                'idle_timeout': self.idle_timeout,
+                'unlocks': self.unlocks,
+                'evictions': self.evictions,
+            }
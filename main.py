@@ -4,17 +4,40 @@ Secure Document Management System (SDMS)
 Main entry point for the application
 """
 
+import argparse
+import metrics
 from cli import CLI
+from profiling import Profiler
 
 
 def main():
     """Main function to start the SDMS application"""
+    parser = argparse.ArgumentParser(description="Secure Document Management System")
+    parser.add_argument('--metrics', action='store_true',
+                        help="record operation timings from startup (or set SDMS_METRICS=1)")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="profile each menu action with cProfile and tracemalloc into DIR "
+                             "(or set SDMS_PROFILE=DIR)")
+    parser.add_argument('--profile-no-memory', action='store_true',
+                        help="skip tracemalloc, which slows allocation-heavy operations")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable()
+
+    if args.profile:
+        profiler = Profiler(args.profile, memory=not args.profile_no_memory)
+    else:
+        profiler = Profiler.from_env()
+
     print("Initializing Secure Document Management System...")
+    if profiler:
+        print(f"Profiling to {profiler.run_dir} (summarize with: python profiling.py summary {profiler.run_dir})")
 
     # Create and run CLI interface
-    cli = CLI()
+    cli = CLI(profiler)
     cli.run()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
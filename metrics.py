@@ -0,0 +1,288 @@
+"""
+In-process timers and counters for the document, crypto, auth and database paths
+
+Instrumentation is off unless SDMS_METRICS=1 is set or enable() is called;
+while off, span() returns a shared no-op object, timed() adds one flag check
+per call and timed_iter() hands back the iterable untouched.
+
+Every operation keeps a latency histogram, error and byte counters, and its
+self time: time not spent in a nested span or stage on the same thread. For
+a streaming pipeline (read -> decrypt -> decompress -> hash) the self times
+say which stage the wall time actually went to.
+"""
+
+import os
+import json
+import time
+import bisect
+import inspect
+import functools
+import threading
+
+# Histogram bucket upper bounds in seconds: 50us doubling up to ~26s
+BUCKETS = tuple(0.00005 * 2 ** i for i in range(20))
+
+_enabled = os.environ.get('SDMS_METRICS', '') not in ('', '0')
+_lock = threading.Lock()
+_metrics = {}
+_local = threading.local()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+class _Metric:
+    """Aggregated observations for one operation name"""
+
+    __slots__ = ('count', 'errors', 'total', 'self_total', 'bytes', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.self_total = 0.0
+        self.bytes = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+
+    def percentile(self, fraction):
+        """Estimate a latency percentile from the histogram, in seconds"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if seen + count >= rank and count:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1] * 2
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+def record(name, elapsed, self_time=None, nbytes=0, error=False):
+    """Add one observation for an operation"""
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = _Metric()
+        metric.count += 1
+        metric.total += elapsed
+        metric.self_total += elapsed if self_time is None else self_time
+        metric.bytes += nbytes
+        if error:
+            metric.errors += 1
+        metric.buckets[bisect.bisect_left(BUCKETS, elapsed)] += 1
+
+
+def _frames():
+    frames = getattr(_local, 'frames', None)
+    if frames is None:
+        frames = _local.frames = []
+    return frames
+
+
+class _Frame:
+    """Timing for the span currently open on this thread"""
+
+    __slots__ = ('child_time',)
+
+    def __init__(self):
+        self.child_time = 0.0
+
+
+class Span:
+    """Context manager timing one operation; set .bytes to count data processed"""
+
+    __slots__ = ('name', 'bytes', 'error', '_frame', '_started')
+
+    def __init__(self, name, nbytes=0):
+        self.name = name
+        self.bytes = nbytes
+        self.error = False
+
+    def __enter__(self):
+        self._frame = _Frame()
+        _frames().append(self._frame)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        frames = _frames()
+        frames.pop()
+        if frames:
+            frames[-1].child_time += elapsed
+        record(self.name, elapsed, elapsed - self._frame.child_time, self.bytes,
+               self.error or exc_type is not None)
+        return False
+
+
+class _NullSpan:
+    """Stand-in returned by span() while metrics are disabled"""
+
+    __slots__ = ()
+    bytes = 0
+    error = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name, nbytes=0):
+    """Time a block: with metrics.span('storage.put') as s: ..."""
+    return Span(name, nbytes) if _enabled else NULL_SPAN
+
+
+def timed(name, status_result=False):
+    """Decorator timing every call of a function under name
+
+    Exceptions count as errors. With status_result=True a returned
+    (False, ...) tuple, the repo's failure convention, counts as one too.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(name) as current:
+                result = func(*args, **kwargs)
+                if status_result and isinstance(result, tuple) and result and result[0] is False:
+                    current.error = True
+                return result
+        return wrapper
+    return decorator
+
+
+def timed_iter(name, iterable):
+    """Time a pipeline stage by the work done inside each next() call
+
+    Records one observation when the stage is exhausted or closed, with
+    the byte count of the chunks it produced. A stage's self time excludes
+    the time spent in the stages it pulls from.
+    """
+    if not _enabled:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+
+def _timed_iter(name, iterator):
+    elapsed = 0.0
+    self_time = 0.0
+    nbytes = 0
+    error = False
+    try:
+        while True:
+            # Look the stack up each time: a consumer may resume us on another thread
+            frames = _frames()
+            frame = _Frame()
+            frames.append(frame)
+            started = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            except BaseException:
+                error = True
+                raise
+            finally:
+                step = time.perf_counter() - started
+                frames.pop()
+                if frames:
+                    frames[-1].child_time += step
+                elapsed += step
+                self_time += step - frame.child_time
+            nbytes += len(chunk)
+            yield chunk
+    finally:
+        record(name, elapsed, self_time, nbytes, error)
+
+
+def instrument(prefix, exclude=(), status_result=False):
+    """Class decorator timing every public method as '<prefix>.<method>'"""
+    def decorator(cls):
+        for attribute, value in list(vars(cls).items()):
+            if attribute.startswith('_') or attribute in exclude or not inspect.isfunction(value):
+                continue
+            setattr(cls, attribute, timed(f"{prefix}.{attribute}", status_result)(value))
+        return cls
+    return decorator
+
+
+def reset():
+    with _lock:
+        _metrics.clear()
+
+
+def snapshot():
+    """Return every metric as a plain dict, keyed by operation name"""
+    with _lock:
+        items = sorted(_metrics.items())
+        return {
+            name: {
+                'count': metric.count,
+                'errors': metric.errors,
+                'total_seconds': metric.total,
+                'self_seconds': metric.self_total,
+                'bytes': metric.bytes,
+                'mean_ms': metric.total / metric.count * 1000 if metric.count else 0.0,
+                'p50_ms': metric.percentile(0.5) * 1000,
+                'p90_ms': metric.percentile(0.9) * 1000,
+                'p99_ms': metric.percentile(0.99) * 1000,
+                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], metric.buckets)),
+            }
+            for name, metric in items
+        }
+
+
+def to_json():
+    return json.dumps({'enabled': _enabled, 'metrics': snapshot()}, indent=2)
+
+
+def to_prometheus():
+    """Render the metrics in the Prometheus text exposition format"""
+    lines = [
+        '# HELP sdms_operation_seconds Latency of SDMS operations',
+        '# TYPE sdms_operation_seconds histogram',
+    ]
+    with _lock:
+        items = sorted(_metrics.items())
+        for name, metric in items:
+            cumulative = 0
+            for bound, count in zip(BUCKETS, metric.buckets):
+                cumulative += count
+                lines.append(f'sdms_operation_seconds_bucket{{op="{name}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'sdms_operation_seconds_bucket{{op="{name}",le="+Inf"}} {metric.count}')
+            lines.append(f'sdms_operation_seconds_sum{{op="{name}"}} {metric.total:.9f}')
+            lines.append(f'sdms_operation_seconds_count{{op="{name}"}} {metric.count}')
+
+        for metric_name, kind, help_text, field in (
+                ('sdms_operation_self_seconds_total', 'counter',
+                 'Time spent in an operation outside nested operations', 'self_total'),
+                ('sdms_operation_errors_total', 'counter', 'Failed SDMS operations', 'errors'),
+                ('sdms_operation_bytes_total', 'counter', 'Bytes processed by SDMS operations', 'bytes')):
+            lines.append(f'# HELP {metric_name} {help_text}')
+            lines.append(f'# TYPE {metric_name} {kind}')
+            for name, metric in items:
+                lines.append(f'{metric_name}{{op="{name}"}} {getattr(metric, field)}')
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Password hashing with tunable, memory-hard parameters
+
+Hashes are self-describing strings, so the parameters travel with each
+hash and can be raised without invalidating existing ones:
+
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+
+Run "python passwords.py calibrate" to measure this host and store
+parameters that hit a target login latency.
+"""
+
+import os
+import json
+import time
+import hmac
+import base64
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+SCRYPT = 'scrypt'
+PBKDF2 = 'pbkdf2_sha256'
+HAS_SCRYPT = hasattr(hashlib, 'scrypt')
+
+SETTINGS_KEY = 'password_hash_params'
+SALT_SIZE = 16
+HASH_SIZE = 32
+
+# Used until a calibration has been stored
+DEFAULT_PARAMS = {
+    'algorithm': SCRYPT if HAS_SCRYPT else PBKDF2,
+    'n': 2 ** 14, 'r': 8, 'p': 1,
+    'iterations': 600000,
+}
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class PasswordHasher:
+    """Hash and verify passwords with per-user salts
+
+    Only max_concurrent hashes run at once; further logins queue instead of
+    all slowing down together, which keeps scrypt's memory use bounded and
+    login latency predictable under load. Legacy unsalted SHA-256 hashes
+    still verify and are reported by needs_rehash.
+    """
+
+    def __init__(self, params=None, max_concurrent=None):
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        if self.params['algorithm'] == SCRYPT and not HAS_SCRYPT:
+            self.params['algorithm'] = PBKDF2
+        self._slots = threading.BoundedSemaphore(max_concurrent or os.cpu_count() or 1)
+
+    @classmethod
+    def from_settings(cls, db, max_concurrent=None):
+        """Build a hasher with the calibrated parameters stored in the database"""
+        stored = db.get_setting(SETTINGS_KEY)
+        return cls(json.loads(stored) if stored else None, max_concurrent)
+
+    @staticmethod
+    def _derive(password, salt, algorithm, params):
+        password = password.encode('utf-8')
+        if algorithm == SCRYPT:
+            n, r, p = params
+            # OpenSSL's default 32 MiB cap is too low for larger n
+            return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                                  maxmem=256 * n * r * p + 1024 * 1024, dklen=HASH_SIZE)
+        if algorithm == PBKDF2:
+            (iterations,) = params
+            return hashlib.pbkdf2_hmac('sha256', password, salt, iterations, HASH_SIZE)
+        raise ValueError(f"Unsupported password hash algorithm: {algorithm}")
+
+    def _current(self):
+        """Return (algorithm, params tuple) for new hashes"""
+        if self.params['algorithm'] == SCRYPT:
+            return SCRYPT, (self.params['n'], self.params['r'], self.params['p'])
+        return PBKDF2, (self.params['iterations'],)
+
+    def hash(self, password):
+        """Hash a password with a fresh salt and the current parameters"""
+        algorithm, params = self._current()
+        salt = os.urandom(SALT_SIZE)
+        with self._slots, metrics.span('auth.password_hash'):
+            digest = self._derive(password, salt, algorithm, params)
+        fields = [algorithm] + [str(value) for value in params] + [_b64encode(salt), _b64encode(digest)]
+        return '$'.join(fields)
+
+    def verify(self, password, encoded):
+        """Check a password against an encoded hash (or a legacy SHA-256 hex digest)"""
+        if '$' not in encoded:
+            legacy = hashlib.sha256(password.encode('utf-8')).hexdigest()
+            return hmac.compare_digest(legacy, encoded)
+
+        try:
+            algorithm, *fields = encoded.split('$')
+            params = tuple(int(value) for value in fields[:-2])
+            salt, expected = _b64decode(fields[-2]), _b64decode(fields[-1])
+        except (ValueError, IndexError):
+            return False
+
+        try:
+            with self._slots, metrics.span('auth.password_verify'):
+                digest = self._derive(password, salt, algorithm, params)
+        except ValueError:
+            return False  # Unknown algorithm or parameters it cannot take
+        return hmac.compare_digest(digest, expected)
+
+    def derive_key(self, password, salt, spec=None):
+        """Derive a HASH_SIZE-byte encryption key from a password
+
+        spec is the "<algorithm>$<params>" string recorded alongside data
+        encrypted earlier; None uses the current parameters. Returns
+        (spec, key).
+        """
+        if spec is None:
+            algorithm, params = self._current()
+        else:
+            algorithm, *fields = spec.split('$')
+            params = tuple(int(value) for value in fields)
+        with self._slots, metrics.span('auth.key_derive'):
+            key = self._derive(password, salt, algorithm, params)
+        return '$'.join([algorithm] + [str(value) for value in params]), key
+
+    def current_spec(self):
+        """Return the "<algorithm>$<params>" string derive_key uses by default"""
+        algorithm, params = self._current()
+        return '$'.join([algorithm] + [str(value) for value in params])
+
+    def needs_rehash(self, encoded):
+        """Check whether a hash was made with other than the current parameters"""
+        return not encoded.startswith(self.current_spec() + '$')
+
+
+def measure(params, samples=20, concurrency=1):
+    """Time hashing with the given parameters, returning latencies in seconds
+
+    With concurrency > 1 that many logins run at once, as they would on a
+    busy server, so the figures include contention for CPU and memory.
+    """
+    hasher = PasswordHasher(params, max_concurrent=concurrency)
+
+    def timed(_):
+        started = time.perf_counter()
+        hasher.hash('calibration password')
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sorted(executor.map(timed, range(samples)))
+
+
+def percentile(latencies, fraction):
+    """Return the given percentile of sorted latencies"""
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def calibrate(target_ms=250, concurrency=1, samples=20, max_memory=64 * 1024 * 1024,
+              algorithm=None):
+    """Pick the strongest parameters whose p99 latency stays within target_ms
+
+    For scrypt, n is doubled (up to max_memory per hash) while the p99
+    holds; for PBKDF2 the iteration count is scaled towards the target.
+    Returns (params, p50 seconds, p99 seconds) for the chosen setting.
+    Raises ValueError if max_memory is below scrypt's smallest setting.
+    """
+    algorithm = algorithm or (SCRYPT if HAS_SCRYPT else PBKDF2)
+    target = target_ms / 1000.0
+
+    if algorithm == SCRYPT:
+        r, p = 8, 1
+        best = None
+        n = 2 ** 12
+        if 128 * n * r > max_memory:
+            raise ValueError(f"scrypt needs at least {128 * n * r // (1024 * 1024)} MiB per hash; "
+                             f"raise the memory cap or use {PBKDF2}")
+        while 128 * n * r <= max_memory:
+            params = {'algorithm': SCRYPT, 'n': n, 'r': r, 'p': p}
+            latencies = measure(params, samples, concurrency)
+            if best is not None and percentile(latencies, 0.99) > target:
+                break
+            best = (params, percentile(latencies, 0.5), percentile(latencies, 0.99))
+            n *= 2
+        return best
+
+    iterations = 100000
+    for _ in range(4):
+        params = {'algorithm': PBKDF2, 'iterations': iterations}
+        latencies = measure(params, samples, concurrency)
+        p99 = percentile(latencies, 0.99)
+        iterations = max(100000, int(iterations * target / p99))
+    params = {'algorithm': PBKDF2, 'iterations': iterations}
+    latencies = measure(params, samples, concurrency)
+    return params, percentile(latencies, 0.5), percentile(latencies, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Password hashing parameters for SDMS")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    calibrate_parser = commands.add_parser('calibrate', help="measure this host and pick parameters")
+    calibrate_parser.add_argument('--target-ms', type=float, default=250,
+                                  help="p99 login hashing latency to aim for (default 250)")
+    calibrate_parser.add_argument('--concurrency', type=int, default=1,
+                                  help="simultaneous logins to measure under (default 1)")
+    calibrate_parser.add_argument('--samples', type=int, default=20)
+    calibrate_parser.add_argument('--max-memory-mib', type=int, default=64,
+                                  help="scrypt memory cap per hash (default 64)")
+    calibrate_parser.add_argument('--algorithm', choices=[SCRYPT, PBKDF2])
+    calibrate_parser.add_argument('--save', action='store_true',
+                                  help="store the parameters in the database")
+
+    commands.add_parser('show', help="print the stored parameters")
+    args = parser.parse_args()
+
+    from database import Database
+    db = Database()
+
+    if args.command == 'show':
+        print(db.get_setting(SETTINGS_KEY) or f"Not calibrated; using {json.dumps(DEFAULT_PARAMS)}")
+        return
+
+    try:
+        params, p50, p99 = calibrate(args.target_ms, args.concurrency, args.samples,
+                                     args.max_memory_mib * 1024 * 1024, args.algorithm)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Parameters: {json.dumps(params)}")
+    print(f"Latency at concurrency {args.concurrency}: p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms")
+
+    if args.save:
+        db.set_setting(SETTINGS_KEY, json.dumps(params))
+        print("Saved. Existing passwords are rehashed on each user's next login.")
+
+
+if __name__ == "__main__":
+    main()
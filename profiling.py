@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Opt-in CPU and memory profiling of whole operations
+
+With profiling on, each operation (a CLI menu action, a benchmark suite)
+runs under cProfile and tracemalloc, and leaves behind in the run
+directory:
+
+    003-batch-upload.prof        cProfile stats (open with pstats or snakeviz)
+    003-batch-upload.alloc.txt   peak traced memory and top allocation sites
+    index.jsonl                  one line per operation: wall/CPU time, memory
+
+Turn it on with "python main.py --profile DIR" or SDMS_PROFILE=DIR, then
+rank the hot functions and allocation sites of a run with:
+
+    python profiling.py summary DIR
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import time
+import pstats
+import cProfile
+import argparse
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Allocation sites kept per operation in the report and the index
+TOP_ALLOCATIONS = 25
+
+
+def _slug(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-') or 'operation'
+
+
+def _format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class Profiler:
+    """Profile operations one at a time into a run directory
+
+    cProfile only sees the thread that enabled it, so while an operation
+    runs every thread it starts (e.g. a batch upload's worker pool) gets a
+    profiler of its own, stopped in that thread when its target returns,
+    and the stats of those that have finished are merged into the
+    operation's .prof file. Threads that were already running, that are
+    still running when the operation ends, or that override run() are not
+    profiled. Operations nested inside a profiled one are part of its
+    profile.
+    """
+
+    def __init__(self, output_dir, memory=True, frames=1):
+        run = time.strftime('run-%Y%m%d-%H%M%S') + f"-{os.getpid()}"
+        self.run_dir = os.path.join(os.path.abspath(output_dir), run)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.memory = memory
+        self.frames = frames  # Stack depth recorded per allocation by tracemalloc
+        self.operations = 0
+        self._active = False
+        self._lock = threading.Lock()
+        self._thread_profiles = []
+
+    @classmethod
+    def from_env(cls):
+        """Return a Profiler if SDMS_PROFILE names an output directory, else None"""
+        output_dir = os.environ.get('SDMS_PROFILE')
+        if not output_dir:
+            return None
+        return cls(output_dir, memory=os.environ.get('SDMS_PROFILE_MEMORY', '1') != '0')
+
+    def _profile_thread(self, *_):
+        """threading.setprofile hook: runs once in each new thread, as it enters run()"""
+        sys.setprofile(None)
+        thread = threading.current_thread()
+        target = getattr(thread, '_target', None)
+        if target is None:
+            # run() is overridden, so there is nowhere to stop a profiler in this thread
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Newer Pythons allow one active profiler, which already sees every thread
+            return
+
+        def profiled_target(*args, **kwargs):
+            try:
+                return target(*args, **kwargs)
+            finally:
+                profile.disable()  # Only takes effect in the thread that enabled it
+
+        thread._target = profiled_target
+        with self._lock:
+            self._thread_profiles.append((thread, profile))
+
+    @contextmanager
+    def profile(self, name):
+        """Profile the block as operation name; a no-op inside another profiled block"""
+        if self._active:
+            yield
+            return
+
+        self._active = True
+        self.operations += 1
+        base = os.path.join(self.run_dir, f"{self.operations:03d}-{_slug(name)}")
+        self._thread_profiles = []
+
+        before = None
+        started_tracing = self.memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(self.frames)
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+        profile = cProfile.Profile()
+        threading.setprofile(self._profile_thread)
+        wall_started, cpu_started = time.perf_counter(), time.process_time()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            wall, cpu = time.perf_counter() - wall_started, time.process_time() - cpu_started
+            threading.setprofile(None)
+            try:
+                self._write_operation(name, base, profile, wall, cpu, before, started_tracing)
+            finally:
+                self._active = False
+
+    def _write_operation(self, name, base, profile, wall, cpu, before, started_tracing):
+        """Write an operation's .prof file, allocation report and index line"""
+        # Take the memory snapshot before pstats allocates anything
+        memory = self._memory_report(base + '.alloc.txt', name, before) if self.memory else {}
+        if started_tracing:
+            tracemalloc.stop()
+
+        stats = pstats.Stats(profile)
+        with self._lock:
+            # A thread still running may still be adding to its profile
+            for thread, thread_profile in self._thread_profiles:
+                if not thread.is_alive():
+                    stats.add(thread_profile)
+            self._thread_profiles = []
+        stats.dump_stats(base + '.prof')
+
+        entry = {
+            'operation': name,
+            'sequence': self.operations,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'profile': os.path.basename(base + '.prof'),
+        }
+        entry.update(memory)
+
+        with open(os.path.join(self.run_dir, 'index.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def _memory_report(self, path, name, before):
+        """Write the allocation report for an operation and return its index fields"""
+        _, peak = tracemalloc.get_traced_memory()
+        ignored = [tracemalloc.Filter(False, module.__file__)
+                   for module in (tracemalloc, cProfile, pstats, threading)]
+        ignored.append(tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+        after = tracemalloc.take_snapshot().filter_traces(ignored)
+        growth = after.compare_to(before.filter_traces(ignored), 'lineno')
+        top = [stat for stat in growth if stat.size_diff > 0][:TOP_ALLOCATIONS]
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"Operation: {name}\n")
+            f.write(f"Peak traced memory: {_format_size(peak)}\n")
+            f.write(f"Retained after the operation: "
+                    f"{_format_size(sum(stat.size_diff for stat in growth))}\n\n")
+            f.write(f"Top {len(top)} allocation sites by memory still held:\n")
+            for stat in top:
+                frame = stat.traceback[0]
+                f.write(f"  {_format_size(stat.size_diff):>12}  {stat.count_diff:>+8} blocks  "
+                        f"{frame.filename}:{frame.lineno}\n")
+
+        return {
+            'peak_bytes': peak,
+            'retained_bytes': sum(stat.size_diff for stat in growth),
+            'allocation_report': os.path.basename(path),
+            'top_allocations': [
+                {'site': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 'bytes': stat.size_diff, 'blocks': stat.count_diff}
+                for stat in top
+            ],
+        }
+
+
+@contextmanager
+def _not_profiled(name):
+    yield
+
+
+def operation(profiler, name):
+    """Return a context manager profiling name if profiler is set, else a no-op"""
+    return profiler.profile(name) if profiler else _not_profiled(name)
+
+
+def find_run(path):
+    """Resolve a run directory, or the latest run inside an output directory"""
+    if os.path.exists(os.path.join(path, 'index.jsonl')):
+        return path
+    runs = sorted(glob.glob(os.path.join(path, 'run-*')), key=os.path.getmtime)
+    if not runs:
+        raise FileNotFoundError(f"No profiling runs found in {path}")
+    return runs[-1]
+
+
+def summarize(run_dir, sort='tottime', limit=30, out=None):
+    """Print a run's operations, hottest functions and largest allocation sites"""
+    out = out or sys.stdout
+    with open(os.path.join(run_dir, 'index.jsonl'), 'r', encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    print(f"Run: {run_dir}", file=out)
+    print(f"\nOperations by wall time ({len(entries)}):", file=out)
+    print(f"  {'#':>3}  {'Operation':<28} {'Wall s':>9} {'CPU s':>9} {'Peak':>12} {'Retained':>12}",
+          file=out)
+    for entry in sorted(entries, key=lambda entry: -entry['wall_seconds']):
+        memory = (f"{_format_size(entry['peak_bytes']):>12} {_format_size(entry['retained_bytes']):>12}"
+                  if 'peak_bytes' in entry else f"{'-':>12} {'-':>12}")
+        print(f"  {entry['sequence']:>3}  {entry['operation']:<28} {entry['wall_seconds']:>9.3f} "
+              f"{entry['cpu_seconds']:>9.3f} {memory}", file=out)
+
+    profiles = [os.path.join(run_dir, entry['profile']) for entry in entries
+                if os.path.exists(os.path.join(run_dir, entry['profile']))]
+    if profiles:
+        print(f"\nHot functions across the run (by {sort}):", file=out)
+        stats = pstats.Stats(*profiles, stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+
+    sites = {}
+    for entry in entries:
+        for allocation in entry.get('top_allocations', []):
+            total = sites.setdefault(allocation['site'], [0, 0, 0])
+            total[0] += allocation['bytes']
+            total[1] += allocation['blocks']
+            total[2] += 1
+    if sites:
+        print("Allocation sites retaining the most memory across operations:", file=out)
+        for site, (size, blocks, operations) in sorted(sites.items(), key=lambda item: -item[1][0])[:limit]:
+            print(f"  {_format_size(size):>12}  {blocks:>+8} blocks  {operations:>3} ops  {site}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect SDMS profiling runs")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    summary_parser = commands.add_parser('summary', help="rank hot functions across a run")
+    summary_parser.add_argument('path', help="a run directory, or the output directory for its latest run")
+    summary_parser.add_argument('--sort', default='tottime',
+                                choices=['tottime', 'cumulative', 'ncalls'],
+                                help="function ranking (default tottime, time in the function itself)")
+    summary_parser.add_argument('--limit', type=int, default=30, help="rows per table (default 30)")
+    args = parser.parse_args()
+
+    try:
+        summarize(find_run(args.path), args.sort, args.limit)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
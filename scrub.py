@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Background integrity scrubber for stored document payloads
+
+Walks every stored payload (documents and their older versions in storage
+key order, then the chunk blobs of chunked versions by hash), re-reads its
+ciphertext and compares the SHA-256 with the digest recorded when it was
+stored, so bit rot, truncation or tampering is found without waiting for
+a download, and without any user's private key. Reads are spread over a
+few workers and held to an I/O rate limit. Progress is checkpointed after
+each batch, so a restarted scrubber picks up where it stopped.
+
+    python scrub.py run                 # finish the current pass
+    python scrub.py run --loop          # keep scrubbing, one pass per interval
+    python scrub.py report              # corrupt and missing payloads
+
+Payloads stored before ciphertext digests were recorded get a structural
+check on their first scrub (container header, size) and their digest is
+kept from then on.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from crypto import CONTAINER_HEADER, FORMAT_SEGMENTED
+from compression import CODEC_NONE
+import metrics
+
+STATUS_OK = 'ok'
+STATUS_BASELINED = 'baselined'  # First scrub of a payload with no recorded digest
+STATUS_CORRUPT = 'corrupt'
+STATUS_MISSING = 'missing'
+STATUS_ERROR = 'error'  # The payload could not be read
+FAILURE_STATUSES = (STATUS_CORRUPT, STATUS_MISSING, STATUS_ERROR)
+
+CHECKPOINT_KEY = 'scrub_checkpoint'
+
+# A pass walks document payloads first, then version chunks
+PHASE_PAYLOADS = 'payloads'
+PHASE_CHUNKS = 'chunks'
+
+
+class RateLimiter:
+    """Token bucket limiting the bytes per second read by all workers together
+
+    A rate of None or 0 means unlimited. Tokens are taken before a chunk is
+    processed, and a worker that overdraws the bucket sleeps off its debt
+    outside the lock, so the others keep going.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.burst = rate  # Up to one second's worth after an idle spell
+        self._tokens = rate or 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Scrubber:
+    """Verify stored payloads in resumable, rate-limited batches
+
+    Each payload is checked once per pass however many documents share it.
+    Results go to the scrub_results table, and the checkpoint (the phase,
+    the last storage key or chunk hash of the last committed batch, plus
+    pass counters) is stored in settings in the same transaction.
+    """
+
+    def __init__(self, doc_manager=None, workers=None, rate_mb=None, batch_size=100):
+        if doc_manager is None:
+            from document_manager import DocumentManager
+            doc_manager = DocumentManager()
+        self.doc_manager = doc_manager
+        self.db = doc_manager.db
+        self.storage = doc_manager.storage
+        self.crypto = doc_manager.crypto
+        self.workers = workers or int(os.environ.get('SDMS_SCRUB_WORKERS', 2))
+        if rate_mb is None:
+            rate_mb = float(os.environ.get('SDMS_SCRUB_RATE_MB', 20))
+        self.limiter = RateLimiter(rate_mb * 1024 * 1024)
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load_checkpoint(self):
+        checkpoint = {
+            'pass': 1, 'phase': PHASE_PAYLOADS, 'after': '', 'pass_started_at': None, 'checked': 0, 'bytes': 0,
+            'failures': 0, 'last_pass_completed_at': None, 'last_pass_failures': None,
+        }
+        stored = self.db.get_setting(CHECKPOINT_KEY)
+        if stored:
+            checkpoint.update(json.loads(stored))
+        return checkpoint
+
+    def save_checkpoint(self, checkpoint):
+        self.db.set_setting(CHECKPOINT_KEY, json.dumps(checkpoint))
+
+    def reset(self):
+        """Forget the checkpoint so the next run starts a fresh pass"""
+        self.save_checkpoint({})
+
+    def expected_digest(self, storage_key, file_hash, blob, previous, recorded=(None, None)):
+        """Return (ciphertext SHA-256, size) a payload should have, or (None, None) if unknown
+
+        recorded is the digest and size stored with a version manifest.
+        """
+        if recorded[0]:
+            return recorded
+        if blob is not None and blob[5] and storage_key == self.doc_manager.blob_key(file_hash):
+            return blob[5], blob[6]  # cipher_hash, cipher_size
+        if previous is not None and previous[3]:  # cipher_hash
+            return previous[3], previous[4]  # size
+        return None, None
+
+    def check_structure(self, head, size, blob):
+        """Look for damage visible without a digest; returns a description or None"""
+        if self.crypto.detect_format(head) == FORMAT_SEGMENTED:
+            try:
+                plaintext_size, _ = self.crypto.segmented_plaintext_size(head, size)
+            except ValueError as e:
+                return str(e)
+            if blob is not None and blob[4] == CODEC_NONE and plaintext_size != blob[1]:  # codec, size
+                return f"Container holds {plaintext_size} plaintext bytes, expected {blob[1]}"
+            return None
+        # Legacy CBC: IV plus at least one padded block
+        if size < 32 or size % 16:
+            return f"CBC payload of {size} bytes is not a whole number of blocks"
+        return None
+
+    def verify(self, storage_key, file_hash, blob, previous, recorded=(None, None)):
+        """Check one payload, returning its scrub_results row"""
+        expected, expected_size = self.expected_digest(storage_key, file_hash, blob, previous, recorded)
+        with metrics.span('scrub.verify') as current:
+            try:
+                if not self.storage.exists(storage_key):
+                    return (storage_key, STATUS_MISSING, "Payload not found in storage",
+                            expected, expected_size, time.time())
+
+                digest = hashlib.sha256()
+                head = b""
+                size = 0
+                for chunk in self.storage.stream(storage_key):
+                    self.limiter.consume(len(chunk))
+                    if len(head) < CONTAINER_HEADER.size:
+                        head += chunk[:CONTAINER_HEADER.size - len(head)]
+                    digest.update(chunk)
+                    size += len(chunk)
+                current.bytes = size
+            except Exception as e:
+                current.error = True
+                return (storage_key, STATUS_ERROR, f"Read failed: {str(e)}",
+                        expected, expected_size, time.time())
+
+            observed = digest.hexdigest()
+            if expected is not None:
+                if observed == expected and (expected_size is None or size == expected_size):
+                    return storage_key, STATUS_OK, None, expected, expected_size, time.time()
+                current.error = True
+                recorded = expected[:16] + (f" ({expected_size} bytes)" if expected_size is not None else "")
+                return (storage_key, STATUS_CORRUPT,
+                        f"Ciphertext SHA-256 {observed[:16]} ({size} bytes) does not match "
+                        f"the recorded {recorded}",
+                        expected, expected_size, time.time())
+
+            problem = self.check_structure(head, size, blob)
+            if problem:
+                current.error = True
+                return storage_key, STATUS_CORRUPT, problem, None, None, time.time()
+            return storage_key, STATUS_BASELINED, None, observed, size, time.time()
+
+    def next_batch(self, checkpoint):
+        """Return the next (storage_key, file_hash, cipher_hash, cipher_size) rows to verify
+
+        Moves the checkpoint on to the chunk phase when the payloads are done.
+        """
+        if checkpoint['phase'] == PHASE_PAYLOADS:
+            rows = self.db.page_stored_payloads(checkpoint['after'], self.batch_size)
+            if rows:
+                return rows
+            checkpoint['phase'] = PHASE_CHUNKS
+            checkpoint['after'] = ''
+        return [(self.doc_manager.blob_key(chunk_hash), chunk_hash, None, None)
+                for chunk_hash in self.db.page_chunk_hashes(checkpoint['after'], self.batch_size)]
+
+    def run_batch(self, checkpoint, executor):
+        """Verify the next batch and advance the checkpoint; returns the number checked
+
+        Returns 0 once the pass is complete, after starting the next one.
+        """
+        rows = self.next_batch(checkpoint)
+        if not rows:
+            self.db.prune_scrub_results()
+            checkpoint.update({
+                'pass': checkpoint['pass'] + 1, 'phase': PHASE_PAYLOADS, 'after': '',
+                'pass_started_at': None,
+                'checked': 0, 'bytes': 0, 'failures': 0,
+                'last_pass_completed_at': time.time(),
+                'last_pass_failures': checkpoint['failures'],
+            })
+            self.save_checkpoint(checkpoint)
+            return 0
+
+        if checkpoint['pass_started_at'] is None:
+            checkpoint['pass_started_at'] = time.time()
+        blobs = self.db.get_blobs({row[1] for row in rows})  # file_hash
+        previous = self.db.get_scrub_results(row[0] for row in rows)  # storage_key
+
+        results = list(executor.map(
+            lambda row: self.verify(row[0], row[1], blobs.get(row[1]), previous.get(row[0]), row[2:4]),
+            rows
+        ))
+
+        # Payloads are walked by storage key, chunks by hash
+        checkpoint['after'] = rows[-1][0] if checkpoint['phase'] == PHASE_PAYLOADS else rows[-1][1]
+        checkpoint['checked'] += len(results)
+        checkpoint['bytes'] += sum(result[4] or 0 for result in results
+                                   if result[1] in (STATUS_OK, STATUS_BASELINED))
+        checkpoint['failures'] += sum(1 for result in results if result[1] in FAILURE_STATUSES)
+        with self.db.connection():
+            self.db.record_scrub_results(results)
+            self.save_checkpoint(checkpoint)
+        return len(results)
+
+    def run_pass(self, max_payloads=None):
+        """Scrub from the checkpoint to the end of the pass (or max_payloads); returns the checkpoint"""
+        checkpoint = self.load_checkpoint()
+        checked = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stop.is_set():
+                count = self.run_batch(checkpoint, executor)
+                checked += count
+                if count == 0 or (max_payloads is not None and checked >= max_payloads):
+                    break
+        return checkpoint
+
+    def run_forever(self, interval=3600):
+        """Run passes back to back, pausing interval seconds after each, until stop()"""
+        while not self._stop.is_set():
+            self.run_pass()
+            self._stop.wait(interval)
+
+    def start(self, interval=3600):
+        """Scrub on a background daemon thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, args=(interval,),
+                                        name="sdms-scrubber", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop after the batch in progress"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def report(self, limit=100):
+        """Return the checkpoint, result counts by status and the failed payloads"""
+        return {
+            'checkpoint': self.load_checkpoint(),
+            'counts': self.db.count_scrub_results(),
+            'failures': [
+                {'storage_key': storage_key, 'status': status, 'detail': detail,
+                 'checked_at': checked_at, 'document_count': document_count,
+                 'document_ids': [int(document_id) for document_id in document_ids.split(',')]}
+                for storage_key, status, detail, checked_at, document_count, document_ids
+                in self.db.get_scrub_failures(FAILURE_STATUSES, limit)
+            ],
+        }
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else 'never'
+
+
+def print_report(report, out=None):
+    """Print an integrity report as returned by Scrubber.report"""
+    out = out or sys.stdout
+    checkpoint = report['checkpoint']
+    print(f"Pass {checkpoint['pass']}: {checkpoint['checked']} payloads checked so far "
+          f"({checkpoint['bytes'] / (1024 * 1024):.1f} MB), {checkpoint['failures']} failures", file=out)
+    print(f"Last complete pass: {format_time(checkpoint['last_pass_completed_at'])}"
+          + (f" ({checkpoint['last_pass_failures']} failures)"
+             if checkpoint['last_pass_failures'] is not None else ""), file=out)
+
+    counts = report['counts']
+    print("Results: " + (", ".join(f"{status} {count}" for status, count in sorted(counts.items()))
+                         or "none yet"), file=out)
+
+    if not report['failures']:
+        print("\nNo corrupt or missing payloads.", file=out)
+        return
+    print("\nCorrupt or missing payloads:", file=out)
+    for failure in report['failures']:
+        ids = ', '.join(str(document_id) for document_id in failure['document_ids'])
+        print(f"  {failure['status'].upper():<8} {failure['storage_key']}  "
+              f"(documents: {ids}; checked {format_time(failure['checked_at'])})", file=out)
+        if failure['detail']:
+            print(f"           {failure['detail']}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify the integrity of stored SDMS payloads")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="scrub from the last checkpoint")
+    run_parser.add_argument('--workers', type=int, help="parallel readers (default 2)")
+    run_parser.add_argument('--rate-mb', type=float,
+                            help="read limit in MB/s across all workers, 0 for none (default 20)")
+    run_parser.add_argument('--batch-size', type=int, default=100,
+                            help="payloads per checkpointed batch (default 100)")
+    run_parser.add_argument('--max', type=int, help="stop after about this many payloads")
+    run_parser.add_argument('--loop', action='store_true', help="keep running passes")
+    run_parser.add_argument('--interval', type=float, default=3600,
+                            help="seconds between passes with --loop (default 3600)")
+
+    report_parser = commands.add_parser('report', help="list corrupt and missing payloads")
+    report_parser.add_argument('--json', action='store_true')
+    report_parser.add_argument('--limit', type=int, default=100)
+
+    commands.add_parser('reset', help="start the next run with a fresh pass")
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        report = Scrubber(workers=1, rate_mb=0).report(args.limit)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+        return 1 if report['failures'] else 0
+
+    if args.command == 'reset':
+        Scrubber(workers=1, rate_mb=0).reset()
+        print("Checkpoint cleared; the next run starts a new pass.")
+        return 0
+
+    scrubber = Scrubber(workers=args.workers, rate_mb=args.rate_mb, batch_size=args.batch_size)
+    try:
+        if args.loop:
+            scrubber.run_forever(args.interval)
+        else:
+            scrubber.run_pass(args.max)
+    except KeyboardInterrupt:
+        pass
+    print_report(scrubber.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import re
+from database import Database
+from compression import COMPRESSED_SIGNATURES
+
+# Only the start of large documents is indexed
+MAX_INDEX_BYTES = 1024 * 1024
+TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def extract_text(data):
+    """Return indexable text from the leading bytes of a document, or '' if binary
+
+    Data is treated as text if it has no NUL bytes, is not a known
+    compressed format and decodes as UTF-8 (a character cut off at the
+    MAX_INDEX_BYTES boundary is tolerated).
+    """
+    data = data[:MAX_INDEX_BYTES]
+    if not data or b'\x00' in data or data.startswith(COMPRESSED_SIGNATURES):
+        return ''
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        if e.start < len(data) - 3:
+            return ''
+        return data[:e.start].decode('utf-8')
+
+
+def extract_file_text(file_path):
+    """Read and extract indexable text from a file"""
+    with open(file_path, 'rb') as f:
+        return extract_text(f.read(MAX_INDEX_BYTES))
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query matching documents with every term
+
+    Each term is quoted so user input cannot inject FTS5 syntax; the last
+    term also matches as a prefix, so results appear while typing.
+    Returns None if the text has no searchable terms.
+    """
+    terms = TERM_PATTERN.findall(text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+class DocumentSearch:
+    """Ranked full-text search over document names and contents
+
+    Text is extracted from the plaintext at upload time, before encryption,
+    and goes into an FTS5 index (contentless where SQLite supports deleting
+    from one), so queries never decrypt anything. Visibility is resolved at query time against documents and
+    document_shares, so a new share is searchable as soon as it is
+    committed without touching the index.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or Database()
+
+    def search(self, user_id, text, page_size=20, offset=None):
+        """Get one page of results for a user and the offset of the next page
+
+        Returns (results, next_offset); next_offset is None on the last page.
+        """
+        match = build_match_query(text)
+        if match is None:
+            return [], None
+
+        offset = offset or 0
+        # Ask for one extra row to learn whether another page exists
+        rows = self.db.search_documents(user_id, match, page_size + 1, offset)
+        if len(rows) <= page_size:
+            return rows, None
+        return rows[:page_size], offset + page_size
@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+"""
+Asyncio HTTP/JSON service exposing the document operations
+
+Many clients can be logged in and transferring documents at once. Requests
+are parsed on the event loop; password checks, database calls and all
+encryption work run on a thread pool so one slow upload never stalls the
+others. Run with: python service.py --host 127.0.0.1 --port 8080
+"""
+
+import os
+import re
+import json
+import base64
+import asyncio
+import argparse
+import time
+import tempfile
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from urllib.parse import urlsplit, parse_qsl, quote, unquote
+from auth import AuthManager
+from document_manager import DocumentManager
+from database import Database
+from sessions import SessionManager
+from scrub import Scrubber
+import metrics
+
+
+# What a route handler hands back; chunks is an async iterator for streamed bodies
+Response = namedtuple('Response', ['status', 'payload', 'chunks', 'headers'],
+                      defaults=(None, None, None))
+
+REASONS = {
+    200: 'OK', 201: 'Created', 204: 'No Content', 400: 'Bad Request',
+    401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict', 411: 'Length Required',
+    413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+
+# Characters a filename may not contain: it ends up in a quoted header value
+UNSAFE_FILENAME = re.compile(r'[\x00-\x1f\x7f"]')
+
+
+def content_disposition(filename):
+    """Build an attachment Content-Disposition header value for a stored filename
+
+    filename= carries an ASCII-only stand-in for older clients, filename*
+    the real name percent-encoded as UTF-8 (RFC 5987).
+    """
+    fallback = ''.join(c if ' ' <= c <= '~' and c not in '"\\' else '_' for c in filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+class HTTPError(Exception):
+    """Error that maps directly onto an HTTP error response"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    """One parsed HTTP request whose body is read from the socket on demand"""
+
+    def __init__(self, method, target, version, headers, reader):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = dict(parse_qsl(url.query))
+        self.version = version
+        self.headers = headers
+        self.reader = reader
+        try:
+            self.remaining = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    async def chunks(self, chunk_size=64 * 1024):
+        """Yield the request body in pieces as it arrives"""
+        while self.remaining > 0:
+            chunk = await self.reader.read(min(chunk_size, self.remaining))
+            if not chunk:
+                raise HTTPError(400, "Request body ended early")
+            self.remaining -= len(chunk)
+            yield chunk
+
+    async def json(self, limit=1024 * 1024):
+        """Read and decode a JSON object body"""
+        if self.remaining > limit:
+            raise HTTPError(413, "Request body too large")
+        body = b"".join([chunk async for chunk in self.chunks()])
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Request body is not valid JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return payload
+
+
+def status_for(message):
+    """Pick an HTTP status for a failed (success, message) result"""
+    message = message.lower()
+    if 'access denied' in message:
+        return 403
+    if 'not found' in message:
+        return 404
+    if 'already' in message:
+        return 409
+    return 400
+
+
+def encode_cursor(after):
+    """Turn a keyset cursor into an opaque URL-safe string"""
+    if after is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(list(after)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Reverse encode_cursor, rejecting anything malformed"""
+    try:
+        timestamp, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(timestamp), int(document_id)
+    except Exception:
+        raise HTTPError(400, "Invalid cursor")
+
+
+class DocumentService:
+    """HTTP/JSON front end over AuthManager, DocumentManager and Database
+
+    Clients log in once and send the returned token as
+    "Authorization: Bearer <token>" on every other request. Routes:
+
+        POST   /register               {"username", "password"}
+        POST   /login                  {"username", "password"} -> {"token"}
+        POST   /logout
+        GET    /documents              ?scope=owned|shared&limit=&cursor=
+        GET    /search                 ?q=&limit=&cursor=
+        POST   /documents?filename=    raw document bytes as the body
+        GET    /documents/<id>         plaintext, streamed (?offset=&length= for a range)
+        DELETE /documents/<id>
+        POST   /documents/<id>/share   {"username"}
+        DELETE /documents/<id>/share/<username>
+        POST   /shares                 {"document_ids": [...], "usernames": [...]}
+        GET    /metrics                operation stats, Prometheus text (?format=json); admin only
+        GET    /integrity              scrubber report of corrupt or missing payloads; admin only
+    """
+
+    ROUTES = [
+        ('POST', re.compile(r'^/register$'), 'register'),
+        ('POST', re.compile(r'^/login$'), 'login'),
+        ('POST', re.compile(r'^/logout$'), 'logout'),
+        ('GET', re.compile(r'^/documents$'), 'list_documents'),
+        ('GET', re.compile(r'^/search$'), 'search'),
+        ('POST', re.compile(r'^/documents$'), 'upload'),
+        ('GET', re.compile(r'^/documents/(\d+)$'), 'download'),
+        ('DELETE', re.compile(r'^/documents/(\d+)$'), 'delete'),
+        ('POST', re.compile(r'^/documents/(\d+)/share$'), 'share'),
+        ('DELETE', re.compile(r'^/documents/(\d+)/share/([^/]+)$'), 'unshare'),
+        ('POST', re.compile(r'^/shares$'), 'bulk_share'),
+        ('GET', re.compile(r'^/metrics$'), 'metrics_report'),
+        ('GET', re.compile(r'^/integrity$'), 'integrity_report'),
+    ]
+
+    def __init__(self, auth=None, doc_manager=None, db=None, sessions=None, workers=None,
+                 max_upload_size=1024 * 1024 * 1024):
+        self.auth = auth or AuthManager()
+        self.doc_manager = doc_manager or DocumentManager()
+        self.db = db or Database()
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self.max_upload_size = max_upload_size
+        self.max_page_size = 200
+        self.spool_dir = None  # Where upload bodies are spooled; None for the system temp dir
+        self.sessions = sessions or SessionManager(self.db, vault=self.auth.vault)
+        self.eviction_interval = 60  # Seconds between expired-session sweeps
+        self.scrubber = None  # Set to a scrub.Scrubber to verify payloads in the background
+        self.scrub_interval = 3600  # Seconds between scrub passes
+        self.server = None
+        self._sweeper = None
+
+    async def run(self, func, *args, **kwargs):
+        """Run blocking work on the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """Start listening; returns the asyncio server"""
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        self._sweeper = asyncio.ensure_future(self.sweep_sessions())
+        if self.scrubber:
+            self.scrubber.start(self.scrub_interval)
+        return self.server
+
+    async def sweep_sessions(self):
+        """Periodically drop expired sessions"""
+        while True:
+            await asyncio.sleep(self.eviction_interval)
+            await self.run(self.sessions.evict_expired)
+
+    async def serve_forever(self, host='127.0.0.1', port=8080):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def close(self):
+        """Stop accepting connections and release the thread pool"""
+        if self._sweeper:
+            self._sweeper.cancel()
+        if self.scrubber:
+            await asyncio.get_running_loop().run_in_executor(None, self.scrubber.stop)
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def read_request(self, reader):
+        """Parse the request line and headers, or return None at end of stream"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise HTTPError(400, "Incomplete request")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "Request headers too large")
+
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HTTPError(411, "Chunked request bodies are not supported")
+        return Request(method, target, version, headers, reader)
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one connection until the client closes it"""
+        try:
+            while True:
+                request = None
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    response = await self.dispatch(request)
+                except HTTPError as e:
+                    response = Response(e.status, {'error': e.message})
+
+                # A body the handler did not read would be parsed as the next request
+                keep_alive = request is not None and request.keep_alive and request.remaining == 0
+                if not await self.send(writer, response, keep_alive) or not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def dispatch(self, request):
+        """Route a request to its handler"""
+        allowed = False
+        for method, pattern, name in self.ROUTES:
+            match = pattern.match(request.path)
+            if not match:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            started = time.perf_counter()
+            failed = True
+            try:
+                response = await getattr(self, name)(request, *match.groups())
+                failed = response.status >= 400
+                return response
+            except HTTPError:
+                raise
+            except Exception as e:
+                return Response(500, {'error': f"Internal error: {str(e)}"})
+            finally:
+                if metrics.is_enabled():
+                    # Handlers interleave on the event loop, so this is wall
+                    # time up to the response headers, with no self time split
+                    metrics.record(f"http.{name}", time.perf_counter() - started, error=failed)
+
+        if allowed:
+            raise HTTPError(405, "Method not allowed")
+        raise HTTPError(404, "No such endpoint")
+
+    async def send(self, writer, response, keep_alive):
+        """Write a response; returns False if a streamed body was cut short"""
+        headers = {'Connection': 'keep-alive' if keep_alive else 'close'}
+        headers.update(response.headers or {})
+
+        if response.chunks is None:
+            body = b""
+            if response.payload is not None:
+                body = json.dumps(response.payload).encode('utf-8')
+                headers['Content-Type'] = 'application/json'
+            headers['Content-Length'] = str(len(body))
+            writer.write(self.status_line(response.status, headers) + body)
+            await writer.drain()
+            return True
+
+        headers['Transfer-Encoding'] = 'chunked'
+        try:
+            head = self.status_line(response.status, headers)
+        except Exception:
+            await response.chunks.aclose()
+            raise
+        writer.write(head)
+        try:
+            async for chunk in response.chunks:
+                if not chunk:
+                    continue  # A zero-length chunk would end the body early
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()  # Backpressure: wait for slow clients
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception:
+            # Integrity or storage failure after part of the body went out:
+            # drop the connection without the terminating chunk so the client
+            # sees a truncated transfer rather than a complete document
+            return False
+        finally:
+            await response.chunks.aclose()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    @staticmethod
+    def status_line(status, headers):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    @staticmethod
+    def bearer_token(request):
+        scheme, _, token = request.headers.get('authorization', '').partition(' ')
+        return token if scheme.lower() == 'bearer' else None
+
+    async def current_session(self, request):
+        """Return the request's Session or raise 401
+
+        In-memory sessions are checked on the event loop; a persisted
+        session costs a database read when this process has not seen it, or
+        has not rechecked it for SessionManager.recheck seconds.
+        """
+        token = self.bearer_token(request)
+        session = None
+        if token:
+            if self.sessions.persist:
+                session = await self.run(self.sessions.validate, token)
+            else:
+                session = self.sessions.validate(token)
+        if session is None:
+            raise HTTPError(401, "Login required")
+        return session
+
+    async def user_keys(self, session, need_private=True):
+        """Return (public_key, private_key) for a session
+
+        The private key is the one unlocked in the key vault at login. Once
+        the vault has locked it (idle timeout), or for a session started by
+        another process, the client has to log in again.
+        """
+        if session.public_key is not None:
+            public_key, private_key = self.sessions.user_keys(session)
+        else:
+            public_key, private_key = await self.run(self.sessions.user_keys, session)
+        if need_private and private_key is None:
+            raise HTTPError(401, "Private key is locked; log in again")
+        return public_key, private_key
+
+    async def register(self, request):
+        payload = await request.json()
+        username, password = payload.get('username'), payload.get('password')
+        if not username or not password:
+            raise HTTPError(400, "username and password are required")
+
+        success, message = await self.run(self.auth.register_user, username, password)
+        if not success:
+            return Response(status_for(message), {'error': message})
+        return Response(201, {'message': message})
+
+    async def login(self, request):
+        payload = await request.json()
+        success, message, user_data = await self.run(
+            self.auth.login_user, payload.get('username', ''), payload.get('password', '')
+        )
+        if not success:
+            # Same answer for unknown users and wrong passwords
+            return Response(401, {'error': "Invalid username or password"})
+
+        token, session = await self.run(self.sessions.create, user_data)
+        return Response(200, {'token': token, 'username': session.username,
+                              'role': session.role, 'expires_at': session.expires_at})
+
+    async def logout(self, request):
+        await self.current_session(request)
+        await self.run(self.sessions.revoke, self.bearer_token(request))
+        return Response(204)
+
+    async def list_documents(self, request):
+        session = await self.current_session(request)
+        scope = request.query.get('scope', 'owned')
+        try:
+            page_size = min(int(request.query.get('limit', 50)), self.max_page_size)
+        except ValueError:
+            raise HTTPError(400, "limit must be an integer")
+        if page_size < 1:
+            raise HTTPError(400, "limit must be positive")
+        after = decode_cursor(request.query['cursor']) if request.query.get('cursor') else None
+
+        if scope == 'owned':
+            fetch = self.doc_manager.page_user_documents
+        elif scope == 'shared':
+            fetch = self.doc_manager.page_shared_documents
+        else:
+            raise HTTPError(400, "scope must be 'owned' or 'shared'")
+
+        rows, after = await self.run(fetch, session.user_id, page_size, after)
+        return Response(200, {
+            'documents': [row._asdict() for row in rows],
+            'next_cursor': encode_cursor(after),
+        })
+
+    async def search(self, request):
+        session = await self.current_session(request)
+        try:
+            page_size = min(int(request.query.get('limit', 20)), self.max_page_size)
+            offset = int(request.query.get('cursor', 0))
+        except ValueError:
+            raise HTTPError(400, "limit and cursor must be integers")
+        if page_size < 1 or offset < 0:
+            raise HTTPError(400, "limit must be positive and cursor not negative")
+
+        rows, next_offset = await self.run(self.doc_manager.search_documents, session.user_id,
+                                           request.query.get('q', ''), page_size, offset)
+        return Response(200, {
+            'documents': [row._asdict() for row in rows],
+            'next_cursor': None if next_offset is None else str(next_offset),
+        })
+
+    async def upload(self, request):
+        """Spool the body to a temporary file, then encrypt it on the thread pool
+
+        The content key is derived from the whole plaintext, so the body has
+        to be on disk before encryption can start.
+        """
+        session = await self.current_session(request)
+        filename = os.path.basename(request.query.get('filename', '').replace('\\', '/'))
+        if not filename:
+            raise HTTPError(400, "filename is required")
+        if UNSAFE_FILENAME.search(filename):
+            raise HTTPError(400, "filename must not contain control characters or quotes")
+        if 'content-length' not in request.headers:
+            raise HTTPError(411, "Content-Length is required")
+        if request.remaining > self.max_upload_size:
+            raise HTTPError(413, "Document too large")
+
+        fd, spool_path = tempfile.mkstemp(dir=self.spool_dir, prefix=".service_", suffix=".part")
+        try:
+            with os.fdopen(fd, 'wb') as spool:
+                pending = []
+                pending_size = 0
+                async for chunk in request.chunks():
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    # Hand writes to the pool in batches rather than per socket read
+                    if pending_size >= 1024 * 1024:
+                        await self.run(spool.writelines, pending)
+                        pending, pending_size = [], 0
+                await self.run(spool.writelines, pending)
+
+            public_key, _ = await self.user_keys(session, need_private=False)
+            upload = await self.run(self.doc_manager.prepare_upload, spool_path,
+                                    public_key, filename)
+            document_id = await self.run(self.doc_manager.record_upload, upload, session.user_id)
+        finally:
+            os.remove(spool_path)
+
+        return Response(201, {'id': document_id, 'filename': upload.filename,
+                              'file_hash': upload.file_hash, 'size': upload.size})
+
+    async def download(self, request, document_id):
+        session = await self.current_session(request)
+        document_id = int(document_id)
+        _, private_key = await self.user_keys(session)
+
+        if 'offset' in request.query or 'length' in request.query:
+            try:
+                offset = int(request.query.get('offset', 0))
+                length = int(request.query['length'])
+            except (KeyError, ValueError):
+                raise HTTPError(400, "offset and length must be integers")
+            if offset < 0 or length < 0:
+                raise HTTPError(400, "offset and length must not be negative")
+
+            success, result = await self.run(self.doc_manager.read_document_range, document_id,
+                                             session.user_id, private_key, offset, length)
+            if not success:
+                return Response(status_for(result), {'error': result})
+            return Response(200, chunks=self.iterate_async(iter([result])),
+                            headers={'Content-Type': 'application/octet-stream'})
+
+        success, result = await self.run(self.doc_manager.open_document_stream, document_id,
+                                         session.user_id, private_key)
+        if not success:
+            if result.startswith("Download failed"):
+                # The stored key could not be unwrapped with this user's key
+                return Response(403, {'error': "Document not found or access denied"})
+            return Response(status_for(result), {'error': result})
+
+        filename, size, chunks = result
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'Content-Disposition': content_disposition(filename),
+        }
+        if size is not None:
+            headers['X-Document-Size'] = str(size)
+        return Response(200, chunks=self.iterate_async(chunks), headers=headers)
+
+    async def iterate_async(self, chunks):
+        """Drive a blocking chunk generator on the thread pool"""
+        try:
+            while True:
+                chunk = await self.run(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            if hasattr(chunks, 'close'):
+                await self.run(chunks.close)
+
+    async def delete(self, request, document_id):
+        session = await self.current_session(request)
+        success, message = await self.run(self.doc_manager.delete_document,
+                                          int(document_id), session.user_id)
+        if not success:
+            return Response(status_for(message), {'error': message})
+        return Response(200, {'message': message})
+
+    async def share(self, request, document_id):
+        session = await self.current_session(request)
+        payload = await request.json()
+        if not payload.get('username'):
+            raise HTTPError(400, "username is required")
+
+        _, private_key = await self.user_keys(session)
+        success, message = await self.run(self.doc_manager.share_document_with_user,
+                                          int(document_id), session.user_id, payload['username'],
+                                          private_key)
+        if not success:
+            return Response(status_for(message), {'error': message})
+        return Response(200, {'message': message})
+
+    async def bulk_share(self, request):
+        session = await self.current_session(request)
+        payload = await request.json()
+        document_ids = payload.get('document_ids')
+        usernames = payload.get('usernames')
+        if not isinstance(document_ids, list) or not isinstance(usernames, list):
+            raise HTTPError(400, "document_ids and usernames must be lists")
+        try:
+            document_ids = [int(document_id) for document_id in document_ids]
+        except (TypeError, ValueError):
+            raise HTTPError(400, "document_ids must be integers")
+
+        _, private_key = await self.user_keys(session)
+        report = await self.run(self.doc_manager.share_documents_with_users, document_ids,
+                                session.user_id, [str(name) for name in usernames], private_key)
+        return Response(200, {
+            'shared': report['shared'],
+            'failed': report['failed'],
+            'results': [{'document_id': document_id, 'username': username,
+                         'success': ok, 'message': message}
+                        for document_id, username, ok, message in report['results']],
+        })
+
+    async def unshare(self, request, document_id, username):
+        session = await self.current_session(request)
+        success, message = await self.run(self.doc_manager.unshare_document_with_user,
+                                          int(document_id), session.user_id, unquote(username))
+        if not success:
+            return Response(status_for(message), {'error': message})
+        return Response(200, {'message': message})
+
+    async def require_admin(self, request):
+        session = await self.current_session(request)
+        if not session.is_admin:
+            raise HTTPError(403, "Admin privileges required")
+        return session
+
+    async def integrity_report(self, request):
+        await self.require_admin(request)
+        scrubber = self.scrubber or Scrubber(self.doc_manager)
+        return Response(200, await self.run(scrubber.report))
+
+    async def metrics_report(self, request):
+        await self.require_admin(request)
+        if request.query.get('format') == 'json':
+            return Response(200, {'enabled': metrics.is_enabled(), 'metrics': metrics.snapshot()})
+        body = metrics.to_prometheus().encode('utf-8')
+        return Response(200, chunks=self.iterate_async(iter([body])),
+                        headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SDMS HTTP/JSON service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="threads for crypto and database work (default: CPU count)")
+    parser.add_argument('--metrics', action='store_true',
+                        help="record operation timings for GET /metrics (or set SDMS_METRICS=1)")
+    parser.add_argument('--scrub', action='store_true',
+                        help="verify stored payloads in the background (see scrub.py)")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable()
+
+    service = DocumentService(workers=args.workers)
+    if args.scrub:
+        service.scrubber = Scrubber(service.doc_manager)
+    print(f"SDMS service listening on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
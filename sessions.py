@@ -0,0 +1,218 @@
+import os
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from database import Database
+
+
+class Session:
+    """An authenticated login, as seen by every request made with its token
+
+    Holds identity, the public key and the key vault handle of the private
+    key unlocked at login. Neither key is ever persisted; a session loaded
+    from the database by another process has no vault handle.
+    """
+
+    __slots__ = ('id', 'user_id', 'username', 'role', 'expires_at', 'public_key', 'vault_handle',
+                 'checked_at')
+
+    def __init__(self, session_id, user_id, username, role, expires_at,
+                 public_key=None, vault_handle=None):
+        self.id = session_id
+        self.user_id = user_id
+        self.username = username
+        self.role = role
+        self.expires_at = expires_at
+        self.public_key = public_key  # PEM string, once loaded
+        self.vault_handle = vault_handle
+        self.checked_at = time.time()  # Last time the session was known not to be revoked
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+
+class SessionManager:
+    """Issue and validate signed, expiring session tokens
+
+    A token is "<session id>.<expiry>.<signature>", signed with HMAC-SHA256,
+    so forged or expired tokens are rejected before any lookup. Live
+    sessions sit in an in-memory table, so validating a token is a
+    signature check and a dict lookup. Sessions all share one TTL, so the
+    table is kept in expiry order and sweeping it only touches expired
+    entries.
+
+    With persist=True sessions are also written to the sessions table and
+    the signing secret to settings, so a token issued by one process is
+    accepted by another using the same database. A session missing from
+    memory is then loaded from that table and cached, and a cached one is
+    checked against the table again once it is more than `recheck` seconds
+    old, so a revocation in another process takes effect within that time.
+
+    Ending a session, by revocation, expiry or eviction, locks its private
+    key in the vault.
+    """
+
+    def __init__(self, db=None, ttl=None, persist=None, max_sessions=100000, vault=None,
+                 recheck=None):
+        self.db = db or Database()
+        self.ttl = ttl or int(os.environ.get('SDMS_SESSION_TTL', 8 * 60 * 60))
+        if recheck is None:
+            recheck = float(os.environ.get('SDMS_SESSION_RECHECK', 5))
+        self.recheck = recheck  # Seconds a persisted session is trusted from memory
+        if persist is None:
+            persist = os.environ.get('SDMS_SESSION_STORE', 'memory') == 'sqlite'
+        self.persist = persist
+        self.max_sessions = max_sessions
+        self.vault = vault  # keyvault.KeyVault holding the keys unlocked at login
+        self.secret = self._load_secret()
+        self._sessions = OrderedDict()  # session id -> Session, in expiry order
+        self._lock = threading.Lock()
+
+    def _load_secret(self):
+        """Use SDMS_SESSION_SECRET, the stored secret when persisting, or a fresh one"""
+        secret = os.environ.get('SDMS_SESSION_SECRET')
+        if secret:
+            return secret.encode('utf-8')
+        if self.persist:
+            return self.db.setdefault_setting('session_secret', secrets.token_hex(32)).encode('utf-8')
+        return secrets.token_bytes(32)
+
+    def _sign(self, session_id, expires_at):
+        digest = hmac.new(self.secret, f"{session_id}.{expires_at}".encode('ascii'),
+                          hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode('ascii')
+
+    def create(self, user_data):
+        """Start a session for a logged-in user, returning (token, Session)
+
+        user_data is the dict returned by AuthManager.login_user; its public
+        key and vault handle are kept on the in-memory session.
+        """
+        session_id = secrets.token_urlsafe(18)
+        expires_at = int(time.time()) + self.ttl
+        session = Session(session_id, user_data['id'], user_data['username'],
+                          user_data['role'], expires_at, user_data.get('public_key'),
+                          user_data.get('vault_handle'))
+
+        if self.persist:
+            self.db.add_session(session_id, session.user_id, session.username,
+                                session.role, expires_at)
+
+        with self._lock:
+            self._sessions[session_id] = session
+            ended = self._evict_locked(time.time())
+        self._lock_keys(ended)
+
+        return f"{session_id}.{expires_at}.{self._sign(session_id, expires_at)}", session
+
+    def validate(self, token):
+        """Return the Session for a token, or None if it is forged, expired or revoked"""
+        try:
+            session_id, expires, signature = token.split('.')
+            expires_at = int(expires)
+        except (AttributeError, ValueError):
+            return None
+
+        if not hmac.compare_digest(signature, self._sign(session_id, expires_at)):
+            return None
+        if expires_at <= time.time():
+            self.revoke(token)
+            return None
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is not None:
+            if not self.persist or time.time() - session.checked_at <= self.recheck:
+                return session
+            if self.db.get_session(session_id) is None:
+                # Revoked by another process sharing the database
+                with self._lock:
+                    self._sessions.pop(session_id, None)
+                self._lock_keys([session])
+                return None
+            session.checked_at = time.time()
+            return session
+
+        if not self.persist:
+            return None
+        row = self.db.get_session(session_id)
+        if row is None or row[4] != expires_at:  # expires_at
+            return None
+
+        session = Session(*row)
+        with self._lock:
+            # Sessions loaded late may be out of expiry order; eviction still
+            # catches them when max_sessions is reached or they fail validate()
+            self._sessions.setdefault(session_id, session)
+        return session
+
+    def revoke(self, token):
+        """End the session a token belongs to"""
+        session_id = token.split('.')[0] if isinstance(token, str) else None
+        if not session_id:
+            return
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._lock_keys([session])
+        if self.persist:
+            self.db.delete_session(session_id)
+
+    def user_keys(self, session):
+        """Return (public_key, private_key) for a session's user
+
+        The public key is loaded once. private_key is the key unlocked at
+        login, or None if the vault has locked it (idle timeout) or this
+        process never unlocked it; the user then has to log in again.
+        """
+        if session.public_key is None:
+            user = self.db.get_user_by_id(session.user_id)
+            session.public_key = user[4]  # public_key
+        private_key = None
+        if self.vault is not None and session.vault_handle is not None:
+            private_key = self.vault.key(session.vault_handle)
+        return session.public_key, private_key
+
+    def _lock_keys(self, sessions):
+        """Zeroize the private keys of ended sessions"""
+        if self.vault is not None:
+            for session in sessions:
+                self.vault.lock(session.vault_handle)
+
+    def _evict_locked(self, now):
+        """Drop expired sessions from the front of the table, and the oldest beyond max_sessions
+
+        Returns the dropped sessions.
+        """
+        dropped = []
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.expires_at > now and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+            dropped.append(session)
+        return dropped
+
+    def evict_expired(self):
+        """Remove expired sessions from memory and, when persisting, the database
+
+        Keys idle past the vault's timeout are zeroized at the same time.
+        """
+        now = time.time()
+        with self._lock:
+            ended = self._evict_locked(now)
+        self._lock_keys(ended)
+        if self.vault is not None:
+            self.vault.evict_idle()
+        if self.persist:
+            self.db.delete_expired_sessions(now)
+
+    def stats(self):
+        """Return the number of live in-memory sessions and settings"""
+        with self._lock:
+            return {'active': len(self._sessions), 'ttl': self.ttl, 'persist': self.persist}
@@ -0,0 +1,370 @@
+import os
+import io
+import uuid
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StorageBackend:
+    """Where encrypted payloads live, addressed by '/'-separated string keys
+
+    Implementations store opaque bytes; all encryption happens before put()
+    and after get()/stream()/range().
+    """
+
+    def put(self, key, chunks):
+        """Store an iterable of byte chunks under key, returning the size written"""
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return the whole object stored under key"""
+        return b"".join(self.stream(key))
+
+    def stream(self, key, chunk_size=64 * 1024):
+        """Yield the object stored under key in pieces"""
+        raise NotImplementedError
+
+    def range(self, key, offset, length):
+        """Return up to length bytes of the object starting at offset"""
+        raise NotImplementedError
+
+    def size(self, key):
+        """Return the size of the object stored under key"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove the object stored under key, if any"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        """Check whether an object is stored under key"""
+        raise NotImplementedError
+
+    def move(self, source, key):
+        """Move the object stored under source to key, replacing any object there"""
+        self.put(key, self.stream(source))
+        self.delete(source)
+
+
+class LocalStorage(StorageBackend):
+    """Storage backend on the local filesystem under a root directory"""
+
+    def __init__(self, root="uploads"):
+        self.root = root
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def path(self, key):
+        """Map a key to its file path, refusing keys that escape the root"""
+        parts = key.replace('\\', '/').split('/')
+        if not key or os.path.isabs(key) or any(part in ('', '.', '..') for part in parts):
+            raise ValueError(f"Invalid storage key: {key}")
+        return os.path.join(self.root, *parts)
+
+    def put(self, key, chunks):
+        """Write chunks to a temporary file and move it into place when complete"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload_", suffix=".part")
+
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return size
+
+    def stream(self, key, chunk_size=64 * 1024):
+        with open(self.path(key), 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+
+    def range(self, key, offset, length):
+        with open(self.path(key), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def move(self, source, key):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.path(source), path)
+
+
+class ObjectStorage(StorageBackend):
+    """Storage backend for an S3-compatible object store
+
+    client must offer the subset of the boto3 S3 client API used here
+    (put_object, get_object with Range, head_object, copy_object,
+    delete_object and the multipart upload calls), so a real boto3 client or InMemoryObjectStore
+    can be passed in. Large objects are uploaded as multipart uploads whose
+    parts are sent in parallel while the caller keeps producing data, and
+    reads are issued as ranged GETs with the next range prefetched.
+    """
+
+    def __init__(self, client, bucket, part_size=8 * 1024 * 1024, max_workers=4,
+                 read_size=1024 * 1024):
+        self.client = client
+        self.bucket = bucket
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.read_size = read_size
+
+    @staticmethod
+    def _is_missing(error):
+        """Check whether a client error means the object does not exist"""
+        code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def put(self, key, chunks):
+        buffer = bytearray()
+        chunks = iter(chunks)
+
+        # Objects that fit in one part go up in a single request
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) > self.part_size:
+                break
+        else:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=bytes(buffer))
+            return len(buffer)
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+        futures = []
+        size = 0
+
+        def upload_part(number, body):
+            response = self.client.upload_part(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body
+            )
+            return {'ETag': response['ETag'], 'PartNumber': number}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                def flush(final):
+                    nonlocal size
+                    # Every part but the last is exactly part_size bytes
+                    while len(buffer) > self.part_size or (final and buffer):
+                        part = bytes(buffer[:self.part_size])
+                        del buffer[:self.part_size]
+                        size += len(part)
+
+                        # Bound the parts held in memory to two per worker
+                        in_flight = [future for future in futures if not future.done()]
+                        if len(in_flight) >= self.max_workers * 2:
+                            in_flight[0].result()
+                        futures.append(executor.submit(upload_part, len(futures) + 1, part))
+
+                flush(False)
+                for chunk in chunks:
+                    buffer += chunk
+                    flush(False)
+                flush(True)
+
+                parts = [future.result() for future in futures]
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+        return size
+
+    def _get_range(self, key, offset, length):
+        """Issue one ranged GET"""
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}"
+        )
+        return response['Body'].read()
+
+    def stream(self, key, chunk_size=None):
+        total = self.size(key)
+        read_size = chunk_size or self.read_size
+        if total == 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self._get_range, key, 0, min(read_size, total))
+            offset = read_size
+            while pending is not None:
+                current = pending
+                if offset < total:
+                    # Prefetch the next range while the caller works on this one
+                    pending = executor.submit(self._get_range, key, offset, min(read_size, total - offset))
+                    offset += read_size
+                else:
+                    pending = None
+                yield current.result()
+
+    def range(self, key, offset, length):
+        if length <= 0:
+            return b""
+        return self._get_range(key, offset, length)
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def move(self, source, key):
+        # S3 copies objects server side in one request only up to 5 GB
+        if self.size(source) > 5 * 1024 ** 3:
+            return super().move(source, key)
+        self.client.copy_object(Bucket=self.bucket, Key=key,
+                                CopySource={'Bucket': self.bucket, 'Key': source})
+        self.client.delete_object(Bucket=self.bucket, Key=source)
+
+
+class ObjectStoreError(Exception):
+    """Error raised by InMemoryObjectStore, shaped like botocore's ClientError"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+class InMemoryObjectStore:
+    """In-process stand-in for an S3-compatible object store client
+
+    Implements the subset of the boto3 S3 client API that ObjectStorage
+    uses, keeping objects in memory. Useful for tests and local runs without
+    a real object store.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _object(self, bucket, key):
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise ObjectStoreError('NoSuchKey', f"No such key: {key}")
+
+    def put_object(self, Bucket, Key, Body):
+        with self._lock:
+            self.requests += 1
+            self.objects[(Bucket, Key)] = bytes(Body)
+        return {'ETag': hashlib.md5(Body).hexdigest()}
+
+    def get_object(self, Bucket, Key, Range=None):
+        with self._lock:
+            self.requests += 1
+            data = self._object(Bucket, Key)
+
+        if Range:
+            start, end = Range.replace('bytes=', '').split('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key):
+        with self._lock:
+            self.requests += 1
+            return {'ContentLength': len(self._object(Bucket, Key))}
+
+    def copy_object(self, Bucket, Key, CopySource):
+        with self._lock:
+            self.requests += 1
+            self.objects[(Bucket, Key)] = self._object(CopySource['Bucket'], CopySource['Key'])
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        with self._lock:
+            self.requests += 1
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.requests += 1
+            self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self._lock:
+            self.requests += 1
+            self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': hashlib.md5(Body).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        with self._lock:
+            self.requests += 1
+            parts = self.uploads.pop(UploadId)
+            numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+            self.objects[(Bucket, Key)] = b"".join(parts[number] for number in sorted(numbers))
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._lock:
+            self.requests += 1
+            self.uploads.pop(UploadId, None)
+        return {}
+
+
+def create_storage(upload_dir="uploads"):
+    """Build the storage backend selected by SDMS_STORAGE
+
+    'local' (default) stores files under upload_dir. 'memory' uses the
+    in-process object store stand-in (contents are lost on exit). 's3' uses
+    boto3 with SDMS_S3_BUCKET and, optionally, SDMS_S3_ENDPOINT.
+    """
+    kind = os.environ.get('SDMS_STORAGE', 'local')
+
+    if kind == 'local':
+        return LocalStorage(upload_dir)
+    if kind == 'memory':
+        return ObjectStorage(InMemoryObjectStore(), 'sdms')
+    if kind == 's3':
+        import boto3  # optional dependency, only needed for this backend
+        client = boto3.client('s3', endpoint_url=os.environ.get('SDMS_S3_ENDPOINT'))
+        return ObjectStorage(client, os.environ['SDMS_S3_BUCKET'])
+
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+def blob_key(file_hash):
+    """Return the content-addressed storage key for a blob
+
+    Blobs are sharded two levels deep by hash prefix so no directory
+    grows too large: ab/cd/abcd....
+    """
+    return f"{file_hash[:2]}/{file_hash[2:4]}/{file_hash}"
+
+
+# Length of the shard directories blob_key puts in front of the hash
+BLOB_KEY_PREFIX_LENGTH = len(blob_key('0' * 64)) - 64
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import access  # noqa: E402
+from auth import AuthManager  # noqa: E402
+from database import Database  # noqa: E402
+from document_manager import DocumentManager  # noqa: E402
+from keypool import KeyPairPool  # noqa: E402
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run a test in an empty directory with its own sdms.db, uploads/ and downloads/"""
+    monkeypatch.chdir(tmp_path)
+    Database.close_all()
+    access._shared.clear()
+    yield tmp_path
+    Database.close_all()
+    access._shared.clear()
+
+
+@pytest.fixture
+def auth(workdir):
+    # An unstarted pool generates small keys inline, with no background threads
+    return AuthManager(key_pool=KeyPairPool(key_size=1024))
+
+
+@pytest.fixture
+def doc_manager(workdir):
+    return DocumentManager()
+
+
+@pytest.fixture
+def login(auth):
+    """Register and log in a user, returning the login_user dict"""
+    def login(username, role='user'):
+        auth.register_user(username, 'pw', role)
+        success, _, user = auth.login_user(username, 'pw')
+        assert success
+        return user
+    return login
+
+
+@pytest.fixture
+def make_file(workdir):
+    """Write bytes to a file in the test directory and return its path"""
+    def make_file(name, data):
+        path = workdir / name
+        path.write_bytes(data)
+        return str(path)
+    return make_file
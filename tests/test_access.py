@@ -0,0 +1,84 @@
+from access import ACCESS_OWNER, ACCESS_SHARED
+
+
+def upload(doc_manager, make_file, user, name="a.txt", data=b"secret contents"):
+    success, message = doc_manager.upload_document(make_file(name, data), user['id'],
+                                                   user['public_key'].encode('utf-8'))
+    assert success, message
+    return int(message.rsplit(' ', 1)[1].rstrip(')'))
+
+
+def test_share_and_unshare_update_cached_access(auth, doc_manager, login, make_file):
+    alice, bob = login('alice'), login('bob')
+    document_id = upload(doc_manager, make_file, alice)
+    access = doc_manager.access
+
+    assert access.access_level(alice['id'], document_id) == ACCESS_OWNER
+    assert not access.can_read(bob['id'], document_id)  # Now cached as no access
+
+    success, message = doc_manager.share_document_with_user(document_id, alice['id'], 'bob',
+                                                            auth.private_key(alice))
+    assert success, message
+    assert access.access_level(bob['id'], document_id) == ACCESS_SHARED
+    success, _ = doc_manager.download_document(document_id, bob['id'], auth.private_key(bob))
+    assert success
+
+    success, message = doc_manager.unshare_document_with_user(document_id, alice['id'], 'bob')
+    assert success, message
+    assert not access.can_read(bob['id'], document_id)
+    success, _ = doc_manager.download_document(document_id, bob['id'], auth.private_key(bob))
+    assert not success
+
+
+def test_repeat_checks_are_served_from_cache(doc_manager, login, make_file):
+    alice = login('alice')
+    document_id = upload(doc_manager, make_file, alice)
+    access = doc_manager.access
+    access.clear()
+
+    before = access.stats()
+    for _ in range(5):
+        assert access.is_owner(alice['id'], document_id)
+    after = access.stats()
+    assert after['misses'] - before['misses'] == 1
+    assert after['hits'] - before['hits'] == 4
+
+
+def test_lookup_racing_an_invalidation_is_not_cached(auth, doc_manager, login, make_file, monkeypatch):
+    alice, bob = login('alice'), login('bob')
+    document_id = upload(doc_manager, make_file, alice)
+    doc_manager.share_document_with_user(document_id, alice['id'], 'bob', auth.private_key(alice))
+    access = doc_manager.access
+    access.clear()
+
+    lookup = access.db.get_access_levels
+
+    def unshare_during_lookup(user_id, document_ids):
+        # The lookup sees the share; the unshare lands before its result is cached
+        levels = lookup(user_id, document_ids)
+        monkeypatch.undo()
+        doc_manager.unshare_document_with_user(document_id, alice['id'], 'bob')
+        return levels
+
+    monkeypatch.setattr(access.db, 'get_access_levels', unshare_during_lookup)
+    assert access.access_level(bob['id'], document_id) == ACCESS_SHARED
+    assert access.access_level(bob['id'], document_id) is None
+
+
+def test_bulk_share_fails_only_the_broken_pairs(auth, doc_manager, login, make_file):
+    alice, bob, carol = login('alice'), login('bob'), login('carol')
+    first = upload(doc_manager, make_file, alice, "a.txt", b"first")
+    second = upload(doc_manager, make_file, alice, "b.txt", b"second")
+    with doc_manager.db.connection() as conn:
+        conn.execute("UPDATE users SET public_key = 'not a key' WHERE username = 'carol'")
+
+    report = doc_manager.share_documents_with_users([first, second], alice['id'], ['bob', 'carol'],
+                                                    auth.private_key(alice))
+    assert sorted((document_id, username, ok) for document_id, username, ok, _ in report['results']) == \
+        [(first, 'bob', True), (first, 'carol', False), (second, 'bob', True), (second, 'carol', False)]
+    assert doc_manager.access.can_read(bob['id'], second)
+    assert not doc_manager.access.can_read(carol['id'], first)
+
+    report = doc_manager.share_documents_with_users([first], alice['id'], ['bob'], None)
+    assert report['failed'] == 1
+    assert report['results'][0][3].startswith("Share failed")
@@ -0,0 +1,36 @@
+import os
+import tarfile
+
+
+def upload_two(doc_manager, make_file, user):
+    for name in ('a.txt', 'b.txt'):
+        success, message = doc_manager.upload_document(make_file(name, name.encode('utf-8') * 100), user['id'],
+                                                       user['public_key'].encode('utf-8'))
+        assert success, message
+
+
+def test_bad_private_key_fails_each_document(doc_manager, login, make_file):
+    alice = login('alice')
+    upload_two(doc_manager, make_file, alice)
+
+    for private_key in (None, b"not a key"):
+        report = doc_manager.batch_download([1, 2, 3], alice['id'], private_key)
+        assert [(document_id, success) for document_id, success, _ in report['results']] == \
+            [(1, False), (2, False), (3, False)]
+        assert report['results'][0][2].startswith("Download failed")
+
+
+def test_archive_export_and_unwritable_archive(auth, doc_manager, login, make_file):
+    alice = login('alice')
+    private_key = auth.private_key(alice)
+    upload_two(doc_manager, make_file, alice)
+
+    report = doc_manager.batch_download([1, 2], alice['id'], private_key, archive_path='out.tar')
+    assert report['succeeded'] == 2
+    with tarfile.open('out.tar') as archive:
+        assert sorted(archive.getnames()) == ['1_a.txt', '2_b.txt']
+
+    report = doc_manager.batch_download([1, 2], alice['id'], private_key,
+                                        archive_path=os.path.join('missing', 'out.tar'))
+    assert report['failed'] == 2
+    assert not [name for name in os.listdir('downloads') if name.startswith('.export_')]
@@ -0,0 +1,60 @@
+import hashlib
+import os
+
+from compression import CODEC_NONE, CODEC_ZLIB
+
+
+def stored_files(root="uploads"):
+    return sorted(os.path.relpath(os.path.join(directory, name), root)
+                  for directory, _, names in os.walk(root) for name in names)
+
+
+def test_identical_uploads_share_one_blob(auth, doc_manager, login, make_file):
+    alice = login('alice')
+    public_key = alice['public_key'].encode('utf-8')
+    data = os.urandom(50000)
+    first = doc_manager.upload_document(make_file('a.bin', data), alice['id'], public_key)
+    second = doc_manager.upload_document(make_file('b.bin', data), alice['id'], public_key)
+    assert first[0] and second[0]
+
+    file_hash = hashlib.sha256(data).hexdigest()
+    assert doc_manager.db.get_blob(file_hash)[2] == 2  # ref_count
+    assert stored_files() == [doc_manager.blob_key(file_hash)]
+
+    success, _ = doc_manager.delete_document(1, alice['id'])
+    assert success
+    assert doc_manager.db.get_blob(file_hash)[2] == 1
+    assert stored_files() == [doc_manager.blob_key(file_hash)]
+
+    success, _ = doc_manager.delete_document(2, alice['id'])
+    assert success
+    assert doc_manager.db.get_blob(file_hash) is None
+    assert stored_files() == []
+
+
+def test_racing_uploads_record_the_payload_that_was_stored(auth, doc_manager, login, make_file):
+    alice = login('alice')
+    public_key = alice['public_key'].encode('utf-8')
+    path = make_file('a.txt', b"the same new content " * 5000)
+
+    # Both uploads encrypt the content before either is recorded, with different codecs
+    doc_manager.compression = CODEC_ZLIB
+    first = doc_manager.prepare_upload(path, public_key)
+    doc_manager.compression = CODEC_NONE
+    second = doc_manager.prepare_upload(path, public_key)
+    assert first.staged_key and second.staged_key
+
+    second_id = doc_manager.record_upload(second, alice['id'])
+    first_id = doc_manager.record_upload(first, alice['id'])
+
+    blob = doc_manager.db.get_blob(first.file_hash)
+    assert blob[2] == 2  # ref_count
+    assert blob[4] == CODEC_NONE  # codec of the payload published first
+    payload = doc_manager.storage.get(doc_manager.blob_key(first.file_hash))
+    assert hashlib.sha256(payload).hexdigest() == blob[5]  # cipher_hash
+    assert stored_files() == [doc_manager.blob_key(first.file_hash)]
+
+    for document_id in (first_id, second_id):
+        assert doc_manager.db.get_document(document_id)[7] == CODEC_NONE  # codec
+        success, message = doc_manager.download_document(document_id, alice['id'], auth.private_key(alice))
+        assert success, message
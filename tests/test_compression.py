@@ -0,0 +1,27 @@
+import pytest
+
+from compression import CODEC_NONE, available_codecs, compress_stream, decompress_stream
+
+CODECS = [codec for codec in available_codecs() if codec != CODEC_NONE]
+
+
+def compress(data, codec):
+    return b"".join(compress_stream([data[i:i + 65536] for i in range(0, len(data), 65536)], codec))
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_output_is_capped_per_piece(codec):
+    data = b"\0" * (20 * 1024 * 1024)
+    pieces = list(decompress_stream([compress(data, codec)], codec, max_chunk=64 * 1024))
+    assert b"".join(pieces) == data
+    assert max(len(piece) for piece in pieces) <= 64 * 1024
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_truncated_input_is_rejected(codec):
+    data = bytes(range(256)) * 4000
+    compressed = compress(data, codec)
+    for cut in (0, 10, len(compressed) // 2, len(compressed) - 1):
+        with pytest.raises(ValueError):
+            b"".join(decompress_stream([compressed[:cut]], codec))
+    assert b"".join(decompress_stream([compressed[i:i + 5] for i in range(0, len(compressed), 5)], codec)) == data
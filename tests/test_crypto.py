@@ -0,0 +1,134 @@
+import os
+
+import pytest
+
+from compression import CODEC_NONE
+from crypto import (CONTAINER_HEADER, DEFAULT_SEGMENT_SIZE, FORMAT_CBC, FORMAT_SEGMENTED, SEGMENT_TAG_SIZE,
+                    CryptoManager)
+from test_versions import text_file
+
+SEGMENT = 1024
+SEGMENT_LENGTH = SEGMENT + SEGMENT_TAG_SIZE
+
+
+@pytest.fixture
+def crypto():
+    return CryptoManager()
+
+
+@pytest.fixture
+def key(crypto):
+    return crypto.generate_aes_key()
+
+
+def encrypt(crypto, key, data):
+    pieces = [data[i:i + 700] for i in range(0, len(data), 700)]
+    return b"".join(crypto.encrypt_stream_segmented(pieces, key, segment_size=SEGMENT))
+
+
+def decrypt(crypto, key, stored):
+    return b"".join(crypto.decrypt_stream([stored[i:i + 333] for i in range(0, len(stored), 333)], key))
+
+
+@pytest.mark.parametrize('size', [0, 1, SEGMENT, SEGMENT + 1, 5 * SEGMENT + 17])
+def test_segmented_round_trip(crypto, key, size):
+    data = os.urandom(size)
+    stored = encrypt(crypto, key, data)
+    assert crypto.detect_format(stored) == FORMAT_SEGMENTED
+    assert decrypt(crypto, key, stored) == data
+    assert crypto.decrypt_with_aes(stored, key) == data
+
+
+def test_truncation_is_detected(crypto, key):
+    stored = encrypt(crypto, key, os.urandom(3 * SEGMENT + 10))
+    # Dropping the final segment leaves a stream of whole, valid segments
+    for cut in (len(stored) - 1, CONTAINER_HEADER.size + 3 * SEGMENT_LENGTH, CONTAINER_HEADER.size + 5):
+        with pytest.raises(ValueError):
+            decrypt(crypto, key, stored[:cut])
+
+
+def test_reordered_or_tampered_segments_are_detected(crypto, key):
+    stored = encrypt(crypto, key, os.urandom(3 * SEGMENT + 10))
+    header, body = stored[:CONTAINER_HEADER.size], stored[CONTAINER_HEADER.size:]
+    first, second = body[:SEGMENT_LENGTH], body[SEGMENT_LENGTH:2 * SEGMENT_LENGTH]
+    swapped = header + second + first + body[2 * SEGMENT_LENGTH:]
+    with pytest.raises(ValueError):
+        decrypt(crypto, key, swapped)
+
+    flipped = bytearray(stored)
+    flipped[CONTAINER_HEADER.size + SEGMENT_LENGTH + 5] ^= 1
+    with pytest.raises(ValueError):
+        decrypt(crypto, key, bytes(flipped))
+
+    with pytest.raises(ValueError):
+        decrypt(crypto, crypto.generate_aes_key(), stored)
+
+
+def test_legacy_cbc_payloads_still_decrypt(crypto, key):
+    data = os.urandom(5000)
+    whole = crypto.encrypt_with_aes(data, key)
+    streamed = b"".join(crypto.encrypt_stream_with_aes([data[:1234], data[1234:]], key))
+    for stored in (whole, streamed):
+        assert crypto.detect_format(stored) == FORMAT_CBC
+        assert decrypt(crypto, key, stored) == data
+        assert crypto.decrypt_with_aes(stored, key) == data
+    with pytest.raises(ValueError):
+        decrypt(crypto, key, whole[:-16])
+
+
+def test_range_reads_only_the_covering_segments(crypto, key):
+    data = os.urandom(6 * SEGMENT + 100)
+    stored = encrypt(crypto, key, data)
+    reads = []
+
+    def read_at(position, size):
+        reads.append(size)
+        return stored[position:position + size]
+
+    for offset, length in ((0, 10), (SEGMENT - 5, 10), (3 * SEGMENT, SEGMENT), (6 * SEGMENT + 90, 500),
+                           (len(data), 10)):
+        reads.clear()
+        assert crypto.decrypt_range_segmented(read_at, len(stored), key, offset, length) == \
+            data[offset:offset + length]
+        assert sum(reads) <= CONTAINER_HEADER.size + 2 * SEGMENT_LENGTH
+
+
+@pytest.mark.parametrize('data, compressed', [(os.urandom(300 * 1024), False), (text_file(300 * 1024), True)],
+                         ids=['uncompressed', 'compressed'])
+def test_read_document_range(auth, doc_manager, login, make_file, data, compressed):
+    alice = login('alice')
+    private_key = auth.private_key(alice)
+    success, _ = doc_manager.upload_document(make_file('doc.bin', data), alice['id'],
+                                             alice['public_key'].encode('utf-8'))
+    assert success
+    assert (doc_manager.db.get_document(1)[7] != CODEC_NONE) == compressed  # codec
+
+    for offset, length in ((0, 100), (65530, 20), (200000, 70000), (len(data) - 5, 100)):
+        success, chunk = doc_manager.read_document_range(1, alice['id'], private_key, offset, length)
+        assert success, chunk
+        assert chunk == data[offset:offset + length]
+
+    bob = login('bob')
+    success, _ = doc_manager.read_document_range(1, bob['id'], auth.private_key(bob), 0, 10)
+    assert not success
+
+
+def test_read_document_range_detects_tampering(auth, doc_manager, login, make_file):
+    alice = login('alice')
+    private_key = auth.private_key(alice)
+    data = os.urandom(300 * 1024)
+    success, _ = doc_manager.upload_document(make_file('doc.bin', data), alice['id'],
+                                             alice['public_key'].encode('utf-8'))
+    assert success
+
+    path = doc_manager.storage.path(doc_manager.db.get_document(1)[2])  # file_path
+    with open(path, 'r+b') as f:
+        f.seek(CONTAINER_HEADER.size + 3 * (DEFAULT_SEGMENT_SIZE + SEGMENT_TAG_SIZE) + 10)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 1]))
+
+    success, chunk = doc_manager.read_document_range(1, alice['id'], private_key, 0, 100)
+    assert success and chunk == data[:100]
+    success, _ = doc_manager.read_document_range(1, alice['id'], private_key, 3 * DEFAULT_SEGMENT_SIZE, 100)
+    assert not success
@@ -0,0 +1,11 @@
+from keypool import KeyPairPool
+
+
+def test_zero_size_pool_generates_inline_without_workers():
+    pool = KeyPairPool(size=0, key_size=1024).start()
+    assert pool._threads == []
+    public_pem, private_pem = pool.take()
+    assert b"PUBLIC KEY" in public_pem and b"PRIVATE KEY" in private_pem
+    assert pool.stats()['ready'] == 0
+    assert pool.stats()['generated_inline'] == 1
+    pool.stop()
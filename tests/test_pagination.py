@@ -0,0 +1,58 @@
+def upload(doc_manager, make_file, user, name):
+    success, message = doc_manager.upload_document(make_file(name, name.encode('utf-8') * 10), user['id'],
+                                                   user['public_key'].encode('utf-8'))
+    assert success, message
+
+
+def pages(fetch, user_id, page_size):
+    seen, after = [], None
+    while True:
+        rows, after = fetch(user_id, page_size, after)
+        assert len(rows) <= page_size
+        seen.append([row.filename for row in rows])
+        if after is None:
+            return seen
+
+
+def test_owned_pages_are_newest_first_without_gaps_or_repeats(doc_manager, login, make_file):
+    alice = login('alice')
+    names = [f"doc{i}.txt" for i in range(7)]
+    for name in names:
+        upload(doc_manager, make_file, alice, name)  # Mostly within the same second: ties break by id
+
+    assert pages(doc_manager.page_user_documents, alice['id'], 3) == \
+        [names[6:3:-1], names[3:0:-1], names[:1]]
+    assert pages(doc_manager.page_user_documents, alice['id'], 7) == [names[::-1]]
+    assert pages(doc_manager.page_user_documents, login('bob')['id'], 3) == [[]]
+
+
+def test_cursor_is_stable_across_new_uploads(doc_manager, login, make_file):
+    alice = login('alice')
+    for i in range(5):
+        upload(doc_manager, make_file, alice, f"doc{i}.txt")
+
+    first, after = doc_manager.page_user_documents(alice['id'], 2)
+    upload(doc_manager, make_file, alice, "late.txt")
+    second, after = doc_manager.page_user_documents(alice['id'], 2, after)
+    third, after = doc_manager.page_user_documents(alice['id'], 2, after)
+    assert [row.filename for row in first + second + third] == [f"doc{i}.txt" for i in range(4, -1, -1)]
+    assert after is None
+
+
+def test_shared_pages(auth, doc_manager, login, make_file):
+    alice, bob = login('alice'), login('bob')
+    private_key = auth.private_key(alice)
+    for i in range(5):
+        upload(doc_manager, make_file, alice, f"doc{i}.txt")
+    for document_id in (2, 4, 5, 1):
+        success, message = doc_manager.share_document_with_user(document_id, alice['id'], 'bob', private_key)
+        assert success, message
+
+    with doc_manager.db.connection() as conn:
+        conn.execute("UPDATE document_shares SET shared_at = '2024-01-01 00:00:00'")
+
+    # Ties on shared_at are ordered by document id
+    shared = pages(doc_manager.page_shared_documents, bob['id'], 3)
+    assert shared == [["doc4.txt", "doc3.txt", "doc1.txt"], ["doc0.txt"]]
+    rows, _ = doc_manager.page_shared_documents(bob['id'], 1)
+    assert rows[0].owner_name == 'alice'
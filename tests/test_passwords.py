@@ -0,0 +1,45 @@
+import hashlib
+
+import pytest
+
+from passwords import PBKDF2, SCRYPT, HAS_SCRYPT, PasswordHasher, calibrate
+
+FAST_PARAMS = [{'algorithm': PBKDF2, 'iterations': 1000}]
+if HAS_SCRYPT:
+    FAST_PARAMS.append({'algorithm': SCRYPT, 'n': 2 ** 10, 'r': 8, 'p': 1})
+
+
+@pytest.mark.parametrize('params', FAST_PARAMS, ids=lambda params: params['algorithm'])
+def test_hash_and_verify(params):
+    hasher = PasswordHasher(params)
+    encoded = hasher.hash('correct horse')
+    assert encoded.startswith(params['algorithm'] + '$')
+    assert hasher.verify('correct horse', encoded)
+    assert not hasher.verify('wrong horse', encoded)
+    assert hasher.hash('correct horse') != encoded  # Fresh salt each time
+    assert not hasher.needs_rehash(encoded)
+
+
+def test_legacy_sha256_hash_verifies_and_needs_rehash():
+    hasher = PasswordHasher(FAST_PARAMS[0])
+    legacy = hashlib.sha256(b'old password').hexdigest()
+    assert hasher.verify('old password', legacy)
+    assert not hasher.verify('other password', legacy)
+    assert hasher.needs_rehash(legacy)
+
+
+@pytest.mark.parametrize('encoded', [
+    'md5$1000$c2FsdA$ZGlnZXN0',  # Unknown algorithm tag
+    'scrypt$1000$8$1$c2FsdA$ZGlnZXN0',  # n not a power of two
+    'pbkdf2_sha256$1$2$c2FsdA$ZGlnZXN0',  # Wrong parameter count
+    'pbkdf2_sha256$many$c2FsdA$ZGlnZXN0',
+    'pbkdf2_sha256$',
+])
+def test_malformed_hash_does_not_verify(encoded):
+    assert PasswordHasher(FAST_PARAMS[0]).verify('password', encoded) is False
+
+
+@pytest.mark.skipif(not HAS_SCRYPT, reason="hashlib.scrypt is not available")
+def test_calibrate_rejects_memory_cap_below_scrypt_minimum():
+    with pytest.raises(ValueError):
+        calibrate(max_memory=2 * 1024 * 1024, algorithm=SCRYPT)
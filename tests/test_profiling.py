@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import pstats
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from profiling import Profiler
+
+
+def _work(n):
+    return sum(range(n))
+
+
+def _entries(profiler):
+    with open(os.path.join(profiler.run_dir, 'index.jsonl'), encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_worker_threads_are_merged_and_stopped_in_their_thread(tmp_path):
+    profiler = Profiler(str(tmp_path), memory=False)
+    with profiler.profile('pool'):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(_work, [1000] * 4))
+
+    entry, = _entries(profiler)
+    stats = pstats.Stats(os.path.join(profiler.run_dir, entry['profile']))
+    assert any(func[2] == '_work' for func in stats.stats)
+
+    # Once the operation is over, new threads run unprofiled
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(sys.getprofile()))
+    thread.start()
+    thread.join()
+    assert seen == [None]
+
+
+def test_failed_write_does_not_block_later_operations(tmp_path, monkeypatch):
+    profiler = Profiler(str(tmp_path), memory=False)
+
+    def fail(*_):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pstats.Stats, 'dump_stats', fail)
+        with pytest.raises(OSError):
+            with profiler.profile('first'):
+                _work(10)
+
+    with profiler.profile('second'):
+        _work(10)
+    assert [entry['operation'] for entry in _entries(profiler)] == ['second']
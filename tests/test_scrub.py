@@ -0,0 +1,36 @@
+from scrub import STATUS_CORRUPT, Scrubber
+from test_versions import text_file
+
+
+def test_scrub_reports_corrupted_chunk_with_its_document(auth, doc_manager, login, make_file):
+    alice = login('alice')
+    original = text_file(256 * 1024)
+    success, _ = doc_manager.upload_document(make_file('doc.txt', original), alice['id'],
+                                             alice['public_key'].encode('utf-8'))
+    assert success
+    success, message = doc_manager.upload_version(
+        1, make_file('v2.txt', original + b"more"), alice['id'], auth.private_key(alice))
+    assert success, message
+
+    chunk_hash = doc_manager.db.get_version_chunk_hashes(1)[0]
+    storage_key = doc_manager.blob_key(chunk_hash)
+    with open(doc_manager.storage.path(storage_key), 'r+b') as f:
+        f.seek(40)
+        byte = f.read(1)
+        f.seek(40)
+        f.write(bytes([byte[0] ^ 1]))
+
+    scrubber = Scrubber(doc_manager, workers=2, rate_mb=0, batch_size=4)
+    scrubber.run_pass()
+    report = scrubber.report()
+    assert report['counts'][STATUS_CORRUPT] == 1
+    failure, = report['failures']
+    assert failure['storage_key'] == storage_key
+    assert failure['document_ids'] == [1]
+
+    # Results for chunks still in use survive pruning, and go with the document
+    assert doc_manager.db.prune_scrub_results() == 0
+    success, _ = doc_manager.delete_document(1, alice['id'])
+    assert success
+    assert doc_manager.db.prune_scrub_results() > 0
+    assert scrubber.report()['failures'] == []
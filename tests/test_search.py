@@ -0,0 +1,69 @@
+import sqlite3
+
+import access
+from database import Database
+from document_manager import DocumentManager
+
+
+def search(doc_manager, user, text):
+    results, _ = doc_manager.search_index.search(user['id'], text)
+    return [result.id for result in results]
+
+
+def index_rows(doc_manager):
+    with doc_manager.db.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM document_search').fetchone()[0]
+
+
+def test_search_finds_own_and_shared_documents(auth, doc_manager, login, make_file):
+    alice, bob = login('alice'), login('bob')
+    doc_manager.upload_document(make_file('notes.txt', b"quarterly budget forecast"), alice['id'],
+                                alice['public_key'].encode('utf-8'))
+    assert search(doc_manager, alice, 'budget') == [1]
+    assert search(doc_manager, bob, 'budget') == []
+
+    doc_manager.share_document_with_user(1, alice['id'], 'bob', auth.private_key(alice))
+    assert search(doc_manager, bob, 'budg') == [1]  # Prefix match on the last term
+
+
+def test_new_version_replaces_and_delete_removes_index_entry(auth, doc_manager, login, make_file):
+    alice = login('alice')
+    doc_manager.upload_document(make_file('notes.txt', b"first draft about apples"), alice['id'],
+                                alice['public_key'].encode('utf-8'))
+    success, message = doc_manager.upload_version(1, make_file('v2.txt', b"second draft about pears"),
+                                                  alice['id'], auth.private_key(alice))
+    assert success, message
+    assert search(doc_manager, alice, 'apples') == []
+    assert search(doc_manager, alice, 'pears') == [1]
+    assert index_rows(doc_manager) == 1
+
+    doc_manager.delete_document(1, alice['id'])
+    assert search(doc_manager, alice, 'pears') == []
+    assert index_rows(doc_manager) == 0
+
+
+def test_old_contentless_index_is_rebuilt(doc_manager, login, make_file):
+    alice = login('alice')
+    for name, text in (('a.txt', b"red green blue"), ('b.txt', b"cyan magenta")):
+        doc_manager.upload_document(make_file(name, text), alice['id'], alice['public_key'].encode('utf-8'))
+
+    # Recreate the index the way SQLite before 3.43 did, with an entry left by a deleted document
+    Database.close_all()
+    conn = sqlite3.connect('sdms.db')
+    conn.execute('DROP TABLE document_search')
+    conn.execute("CREATE VIRTUAL TABLE document_search USING fts5(filename, body, content='')")
+    conn.executemany('INSERT INTO document_search (rowid, filename, body) VALUES (?, ?, ?)',
+                     [(1, 'a.txt', 'red green blue'), (2, 'b.txt', 'cyan magenta'), (9, 'gone.txt', 'red')])
+    conn.execute('PRAGMA user_version = 10')
+    conn.commit()
+    conn.close()
+    access._shared.clear()
+
+    doc_manager = DocumentManager()
+    assert search(doc_manager, alice, '"green blue"') == [1]
+    assert search(doc_manager, alice, 'magenta') == [2]
+    assert index_rows(doc_manager) == 2
+
+    doc_manager.delete_document(1, alice['id'])
+    assert search(doc_manager, alice, 'red') == []
+    assert index_rows(doc_manager) == 1
@@ -0,0 +1,103 @@
+import asyncio
+import http.client
+import json
+import threading
+
+import pytest
+
+from service import DocumentService
+
+
+@pytest.fixture
+def service(auth, doc_manager):
+    """A DocumentService listening on an ephemeral port, served from a background loop"""
+    svc = DocumentService(auth=auth, doc_manager=doc_manager, workers=2)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(svc.start('127.0.0.1', 0))
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(10)
+    svc.port = svc.server.sockets[0].getsockname()[1]
+    yield svc
+    asyncio.run_coroutine_threadsafe(svc.close(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+    loop.close()
+
+
+def request(connection, method, path, body=None, token=None):
+    headers = {'Authorization': f"Bearer {token}"} if token else {}
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def test_empty_document_keeps_connection_usable(service):
+    connection = http.client.HTTPConnection('127.0.0.1', service.port, timeout=10)
+    request(connection, 'POST', '/register', {'username': 'alice', 'password': 'pw'})
+    _, body = request(connection, 'POST', '/login', {'username': 'alice', 'password': 'pw'})
+    token = json.loads(body)['token']
+
+    response, body = request(connection, 'POST', '/documents?filename=empty.txt', b"", token)
+    assert response.status == 201
+    empty_id = json.loads(body)['id']
+    response, body = request(connection, 'POST', '/documents?filename=a.txt', b"hello" * 1000, token)
+    other_id = json.loads(body)['id']
+
+    # Both downloads go over the same keep-alive connection
+    response, body = request(connection, 'GET', f"/documents/{empty_id}", token=token)
+    assert response.status == 200
+    assert response.getheader('Transfer-Encoding') == 'chunked'
+    assert body == b""
+
+    response, body = request(connection, 'GET', f"/documents/{other_id}", token=token)
+    assert response.status == 200
+    assert body == b"hello" * 1000
+    connection.close()
+
+
+def test_range_download_over_keep_alive(service):
+    connection = http.client.HTTPConnection('127.0.0.1', service.port, timeout=10)
+    request(connection, 'POST', '/register', {'username': 'alice', 'password': 'pw'})
+    _, body = request(connection, 'POST', '/login', {'username': 'alice', 'password': 'pw'})
+    token = json.loads(body)['token']
+    data = bytes(range(256)) * 1000
+    _, body = request(connection, 'POST', '/documents?filename=b.bin', data, token)
+    document_id = json.loads(body)['id']
+
+    for offset, length in ((0, 10), (1000, 5000), (len(data) - 3, 100)):
+        response, body = request(connection, 'GET',
+                                 f"/documents/{document_id}?offset={offset}&length={length}", token=token)
+        assert response.status in (200, 206)
+        assert body == data[offset:offset + length]
+    connection.close()
+
+
+def test_filenames_cannot_inject_headers(service):
+    connection = http.client.HTTPConnection('127.0.0.1', service.port, timeout=10)
+    request(connection, 'POST', '/register', {'username': 'alice', 'password': 'pw'})
+    _, body = request(connection, 'POST', '/login', {'username': 'alice', 'password': 'pw'})
+    token = json.loads(body)['token']
+
+    for name in ('a.txt%0d%0aSet-Cookie:%20x=1', 'a%22b.txt'):
+        response, _ = request(connection, 'POST', f"/documents?filename={name}", b"x", token)
+        assert response.status == 400
+
+    response, body = request(connection, 'POST', '/documents?filename=%E6%8A%A5%E5%91%8A.pdf', b"pdf", token)
+    assert response.status == 201
+    response, body = request(connection, 'GET', f"/documents/{json.loads(body)['id']}", token=token)
+    assert response.status == 200
+    assert body == b"pdf"
+    assert response.getheader('Content-Disposition') == \
+        "attachment; filename=\"__.pdf\"; filename*=UTF-8''%E6%8A%A5%E5%91%8A.pdf"
+    assert response.getheader('Set-Cookie') is None
+    connection.close()
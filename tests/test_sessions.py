@@ -0,0 +1,20 @@
+from database import Database
+from sessions import SessionManager
+
+
+def test_revocation_reaches_other_processes_after_recheck(workdir):
+    # Two managers sharing one database stand in for two service processes
+    first = SessionManager(Database(), persist=True, recheck=0)
+    second = SessionManager(Database(), persist=True, recheck=0)
+    trusting = SessionManager(Database(), persist=True, recheck=3600)
+    token, _ = first.create({'id': 1, 'username': 'alice', 'role': 'user'})
+
+    for manager in (second, trusting):
+        assert manager.validate(token).username == 'alice'  # Loaded from the database and cached
+
+    first.revoke(token)
+    assert first.validate(token) is None
+    assert second.validate(token) is None
+    assert second.stats()['active'] == 0
+    # Within its recheck interval a process still trusts its cached copy
+    assert trusting.validate(token) is not None
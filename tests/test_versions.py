@@ -0,0 +1,103 @@
+import hashlib
+import os
+import random
+
+
+def stored_files(root="uploads"):
+    return [os.path.join(directory, name) for directory, _, names in os.walk(root) for name in names]
+
+
+def text_file(size, seed=1):
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghij') for _ in range(rng.randint(2, 9))) for _ in range(2000)]
+    data = bytearray()
+    while len(data) < size:
+        data += rng.choice(words).encode('ascii') + b" "
+    return bytes(data[:size])
+
+
+def test_small_edit_stores_only_changed_chunks(auth, doc_manager, login, make_file):
+    alice = login('alice')
+    private_key = auth.private_key(alice)
+    original = text_file(1024 * 1024)
+    edited = original[:500000] + b"X" + original[500001:]
+    success, _ = doc_manager.upload_document(make_file('doc.txt', original), alice['id'],
+                                             alice['public_key'].encode('utf-8'))
+    assert success
+
+    success, message = doc_manager.upload_version(1, make_file('v2.txt', edited), alice['id'], private_key)
+    assert success, message
+    success, versions = doc_manager.list_versions(1, alice['id'])
+    assert success
+    assert [version.version for version in versions] == [1, 2]
+    first, second = versions
+    assert first.chunk_count > 4
+    # One edited chunk, or two when the edit moves a boundary
+    new_chunks = int(message.split(': ')[1].split(' of ')[0])
+    assert new_chunks <= 2
+    assert second.stored_bytes < first.stored_bytes / 4
+
+    for version, data in ((1, original), (2, edited)):
+        success, message = doc_manager.download_version(1, version, alice['id'], private_key)
+        assert success, message
+        with open(f"downloads/decrypted_v{version}_doc.txt", 'rb') as f:
+            assert f.read() == data
+
+    success, message = doc_manager.download_document(1, alice['id'], private_key)
+    assert success, message
+    with open("downloads/decrypted_doc.txt", 'rb') as f:
+        assert f.read() == edited
+
+    success, data = doc_manager.read_document_range(1, alice['id'], private_key, 499990, 20)
+    assert success
+    assert data == edited[499990:500010]
+
+
+def test_versions_stay_readable_by_recipients(auth, doc_manager, login, make_file):
+    alice, bob = login('alice'), login('bob')
+    original = text_file(300000, seed=2)
+    doc_manager.upload_document(make_file('doc.txt', original), alice['id'], alice['public_key'].encode('utf-8'))
+    doc_manager.share_document_with_user(1, alice['id'], 'bob', auth.private_key(alice))
+
+    edited = original + b" appended"
+    success, message = doc_manager.upload_version(1, make_file('v2.txt', edited), alice['id'],
+                                                  auth.private_key(alice))
+    assert success, message
+    assert not doc_manager.upload_version(1, make_file('v3.txt', b"x"), bob['id'], auth.private_key(bob))[0]
+
+    for version, data in ((1, original), (2, edited)):
+        success, message = doc_manager.download_version(1, version, bob['id'], auth.private_key(bob))
+        assert success, message
+        with open(f"downloads/decrypted_v{version}_doc.txt", 'rb') as f:
+            assert f.read() == data
+
+
+def test_delete_releases_every_chunk(auth, doc_manager, login, make_file):
+    alice = login('alice')
+    public_key = alice['public_key'].encode('utf-8')
+    original = text_file(400000, seed=3)
+    edited = original[:1000] + b"edit" + original[1000:]
+
+    doc_manager.upload_document(make_file('a.txt', original), alice['id'], public_key)
+    doc_manager.upload_document(make_file('b.txt', original), alice['id'], public_key)
+    doc_manager.upload_version(1, make_file('v2.txt', edited), alice['id'], auth.private_key(alice))
+    doc_manager.upload_version(2, make_file('v2.txt', edited), alice['id'], auth.private_key(alice))
+
+    # Both documents' versions share every chunk, each referenced once per version
+    chunk_hashes = set(doc_manager.db.get_version_chunk_hashes(1))
+    assert chunk_hashes == set(doc_manager.db.get_version_chunk_hashes(2))
+    references = sum(blob[2] for blob in doc_manager.db.get_blobs(chunk_hashes).values())  # ref_count
+    # The original upload's whole-file blob was replaced by its chunks
+    assert doc_manager.db.get_blob(hashlib.sha256(original).hexdigest()) is None
+
+    success, _ = doc_manager.delete_document(1, alice['id'])
+    assert success
+    blobs = doc_manager.db.get_blobs(chunk_hashes)
+    assert set(blobs) == chunk_hashes
+    assert sum(blob[2] for blob in blobs.values()) * 2 == references
+    assert all(not path.startswith(os.path.join('uploads', 'manifests', '1')) for path in stored_files())
+
+    success, _ = doc_manager.delete_document(2, alice['id'])
+    assert success
+    assert doc_manager.db.get_blobs(chunk_hashes) == {}
+    assert stored_files() == []